@@ -3,23 +3,50 @@ API Flask para transcripción de audio a PDF
 Utiliza OpenAI Whisper para la transcripción y python-docx/reportlab para generar PDFs
 """
 
+import time
+# Inicio de la importación del módulo: el arranque se mide y se informa en /health y /api
+_IMPORT_STARTED = time.perf_counter()
+
 import os
 import subprocess
 import sys
-from flask import Flask, request, jsonify, send_file
+import importlib
+import shutil
+from flask import Flask, Request, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import whisper
-from docx import Document
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT
-from reportlab.lib.units import inch
+from werkzeug.exceptions import HTTPException, UnsupportedMediaType
+import numpy as np
+from xml.sax.saxutils import escape as xml_escape
 import datetime
 import uuid
+import hashlib
+import json
+import gzip
+import re
+import math
+import bisect
+import heapq
+import difflib
+import collections
+import io
+import functools
+import itertools
+import textwrap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+import tempfile
+import zipfile
 import threading
-import queue as queue_module
+import weakref
+import sqlite3
+import socket
+import contextlib
+try:
+    import fcntl
+except ImportError:  # Windows: solo el candado en memoria para las subidas reanudables
+    fcntl = None
 import logging
 from dotenv import load_dotenv
 
@@ -38,6 +65,98 @@ SUPPORTED_LANGUAGES = [
     'spanish', 'english', 'portuguese', 'french', 'german', 'italian', 'auto'
 ]
 
+def _env_float(name, default):
+    """Leer un número de una variable de entorno, con valor por defecto si es inválido"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+#############################################
+# ARRANQUE RÁPIDO (FAST_START)              #
+#############################################
+# Con FAST_START=1 importar el módulo no hace trabajo pesado: whisper (y con él torch),
+# python-docx y ReportLab se importan en su primer uso, y FFmpeg se localiza en el PATH
+# sin lanzar procesos ni instalar nada (la versión se sondea una vez y queda en disco
+# para los workers que gunicorn recicla con --max-requests). Sin FAST_START se mantiene
+# el arranque clásico: módulos precargados y setup_ffmpeg con instalación de respaldo.
+
+FAST_START = os.environ.get("FAST_START", "0") == "1"
+# Módulos que se precargan sin FAST_START
+HEAVY_MODULES = ('whisper', 'docx', 'reportlab.platypus')
+FFMPEG_PROBE_CACHE = os.environ.get(
+    "FFMPEG_PROBE_CACHE", os.path.join(tempfile.gettempdir(), "audiotranscript-ffmpeg.json")
+)
+
+# Segundos que tardó cada importación diferida, por módulo
+lazy_import_seconds = {}
+
+def lazy_import(name):
+    """Importar un módulo pesado en su primer uso, registrando cuánto tardó"""
+    loaded = name in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    if not loaded and name not in lazy_import_seconds:
+        lazy_import_seconds[name] = round(time.perf_counter() - started, 3)
+        logger.info(f"Módulo {name} importado en {lazy_import_seconds[name]}s")
+    return module
+
+def probe_ffmpeg():
+    """Localizar FFmpeg sin instalar nada.
+
+    La versión (`ffmpeg -version`) se cachea en FFMPEG_PROBE_CACHE con la ruta, el tamaño
+    y la fecha del binario: mientras no cambie, el sondeo es un `stat` sin subprocesos.
+    """
+    path = shutil.which('ffmpeg')
+    if not path:
+        return {'available': False, 'path': None, 'version': None, 'cached': False}
+    stat = os.stat(path)
+    key = [path, stat.st_size, stat.st_mtime]
+    try:
+        with open(FFMPEG_PROBE_CACHE, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return dict(cached['info'], cached=True)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    try:
+        output = subprocess.run([path, '-version'], capture_output=True, text=True, timeout=10, check=True).stdout
+        info = {'available': True, 'path': path, 'version': output.split('\n', 1)[0].strip()}
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning(f"FFmpeg en {path} no responde: {e}")
+        return {'available': False, 'path': path, 'version': None, 'cached': False}
+    try:
+        # Escritura atómica: varios workers pueden sondear a la vez
+        tmp_path = f"{FFMPEG_PROBE_CACHE}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'info': info}, f)
+        os.replace(tmp_path, FFMPEG_PROBE_CACHE)
+    except OSError as e:
+        logger.warning(f"No se pudo guardar el sondeo de FFmpeg: {e}")
+    return dict(info, cached=False)
+
+def _process_age():
+    """Segundos desde que arrancó el proceso (solo Linux; None si no se puede saber)"""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        return round(uptime - start_ticks / os.sysconf('SC_CLK_TCK'), 3)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+# Tiempos de arranque de este proceso; se completan al final del módulo
+startup_state = {
+    'fast_start': FAST_START,
+    'import_seconds': None,
+    'process_seconds': None,
+    'ffmpeg_probe_seconds': None,
+    'ffmpeg': None,
+    'lazy_imports': lazy_import_seconds,
+    'started_at': None
+}
+
 def check_ffmpeg():
     """Verificar si FFmpeg está disponible"""
     try:
@@ -81,30 +200,228 @@ app = Flask(__name__)
 # Configurar CORS para permitir peticiones desde cualquier origen
 CORS(app, resources={
     r"/health": {"origins": "*"},
+    r"/ready": {"origins": "*"},
     r"/api": {"origins": "*"},
-    r"/transcribe": {"origins": "*"}
+    r"/transcribe": {"origins": "*"},
+    r"/uploads*": {"origins": "*"},
+    r"/batches*": {"origins": "*"}
 })
 
 # Configuración
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB máximo
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
+app.config['CACHE_FOLDER'] = os.environ.get('CACHE_FOLDER', 'cache')
+app.config['JOB_DB_PATH'] = os.environ.get('JOB_DB_PATH', 'jobs.db')
 
 # Crear directorios si no existen
 for folder in ['uploads', 'outputs']:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-# Configurar FFmpeg
-setup_ffmpeg()
+# Configurar FFmpeg (los procesos del pool no lo necesitan)
+if multiprocessing.current_process().name == 'MainProcess':
+    probe_started = time.perf_counter()
+    if FAST_START:
+        startup_state['ffmpeg'] = probe_ffmpeg()
+        if not startup_state['ffmpeg']['available']:
+            logger.warning("FFmpeg no encontrado en el PATH; instálalo (FAST_START no instala nada)")
+    else:
+        setup_ffmpeg()
+    startup_state['ffmpeg_probe_seconds'] = round(time.perf_counter() - probe_started, 3)
+    if not FAST_START:
+        for name in HEAVY_MODULES:
+            lazy_import(name)
+
+#############################################
+# MÉTRICAS (PROMETHEUS)                     #
+#############################################
+# Contadores e histogramas persistidos en SQLite (la misma base que la cola) para que
+# /metrics agregue los datos de todos los workers de gunicorn y no solo los del que
+# responde. Los gauges (profundidad de la cola, tareas activas) se calculan al consultar.
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 4)
+
+METRICS = {
+    'transcribe_stage_seconds': ('histogram', 'Duración de cada etapa del pipeline', DURATION_BUCKETS),
+    'transcribe_chunk_inference_seconds': ('histogram', 'Inferencia Whisper por chunk', DURATION_BUCKETS),
+    'transcribe_request_seconds': ('histogram', 'Duración total de una transcripción (sin espera en cola)', DURATION_BUCKETS),
+    'transcribe_realtime_factor': ('histogram', 'Segundos de proceso por segundo de audio', RTF_BUCKETS),
+    'transcribe_model_load_seconds': ('histogram', 'Tiempo de carga de un modelo', DURATION_BUCKETS),
+    'transcribe_jobs_total': ('counter', 'Transcripciones terminadas por modo y estado', None),
+    'transcribe_audio_seconds_total': ('counter', 'Segundos de audio transcritos', None),
+    'transcribe_vad_skipped_seconds_total': ('counter', 'Segundos sin voz omitidos por el VAD', None),
+    'transcribe_cache_requests_total': ('counter', 'Consultas a la caché de transcripciones', None),
+    'transcribe_model_loads_total': ('counter', 'Modelos cargados', None),
+    'transcribe_admission_total': ('counter', 'Decisiones de admisión de /transcribe', None),
+}
+
+def _format_labels(labels):
+    """labels como texto Prometheus: clave="valor" ordenado y escapado"""
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+
+class MetricsStore:
+    """Contadores e histogramas compartidos entre procesos mediante SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS metric_counters (
+                    name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL,
+                    PRIMARY KEY (name, labels)
+                );
+                CREATE TABLE IF NOT EXISTS metric_buckets (
+                    name TEXT NOT NULL, labels TEXT NOT NULL, le TEXT NOT NULL, count INTEGER NOT NULL,
+                    PRIMARY KEY (name, labels, le)
+                );
+            """)
+            self._local.conn = conn
+        return conn
+
+    def record(self, counters=(), observations=()):
+        """Sumar contadores [(nombre, labels, valor)] y observar valores en histogramas, en una transacción.
+
+        Un fallo de métricas nunca debe interrumpir una transcripción: solo se registra en el log.
+        """
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = [(name, _format_labels(labels), value) for name, labels, value in counters]
+                buckets = []
+                for name, labels, value in observations:
+                    if value is None:
+                        continue
+                    label_text = _format_labels(labels)
+                    le = next((str(b) for b in METRICS[name][2] if value <= b), '+Inf')
+                    buckets.append((name, label_text, le))
+                    rows.append((f"{name}_sum", label_text, value))
+                    rows.append((f"{name}_count", label_text, 1))
+                conn.executemany(
+                    "INSERT INTO metric_counters (name, labels, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value",
+                    rows
+                )
+                conn.executemany(
+                    "INSERT INTO metric_buckets (name, labels, le, count) VALUES (?, ?, ?, 1) "
+                    "ON CONFLICT(name, labels, le) DO UPDATE SET count = count + 1",
+                    buckets
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"No se pudieron guardar métricas: {e}")
+
+    def inc(self, name, value=1, **labels):
+        self.record(counters=[(name, labels, value)])
+
+    def observe(self, name, value, **labels):
+        self.record(observations=[(name, labels, value)])
+
+    def render(self, gauges=()):
+        """Formato de exposición de texto de Prometheus; gauges: [(nombre, ayuda, [(labels, valor)])]"""
+        conn = self._conn()
+        counters = collections.defaultdict(dict)
+        for name, labels, value in conn.execute("SELECT name, labels, value FROM metric_counters"):
+            counters[name][labels] = value
+        buckets = collections.defaultdict(lambda: collections.defaultdict(dict))
+        for name, labels, le, count in conn.execute("SELECT name, labels, le, count FROM metric_buckets"):
+            buckets[name][labels][le] = count
+
+        lines = []
+        for name, help_text, samples in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{{{_format_labels(labels)}}} {value}" if labels else f"{name} {value}"
+                      for labels, value in samples]
+        for name, (kind, help_text, bucket_bounds) in METRICS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == 'counter':
+                for labels, value in sorted(counters.get(name, {}).items()):
+                    lines.append(f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}")
+                continue
+            for labels, by_le in sorted(buckets.get(name, {}).items()):
+                prefix = f"{labels}," if labels else ''
+                cumulative = 0
+                for bound in bucket_bounds:
+                    cumulative += by_le.get(str(bound), 0)
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                total = cumulative + by_le.get('+Inf', 0)
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {total}')
+                suffix = f"{{{labels}}}" if labels else ''
+                lines.append(f"{name}_sum{suffix} {counters.get(f'{name}_sum', {}).get(labels, 0):g}")
+                lines.append(f"{name}_count{suffix} {total}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsStore(app.config['JOB_DB_PATH'])
+
+@contextlib.contextmanager
+def timed_stage(timings, stage):
+    """Sumar a timings[stage] los segundos que tarda el bloque"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round(timings.get(stage, 0.0) + time.perf_counter() - started, 4)
+
+def _timed_iter(iterable, timings, stage):
+    """Recorrer `iterable` contando en timings[stage] solo el tiempo de producir cada elemento"""
+    iterator = iter(iterable)
+    while True:
+        with timed_stage(timings, stage):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+def record_transcription_metrics(mode, status, stats, total_seconds=None):
+    """Exportar a /metrics los tiempos por etapa y el RTF de una transcripción terminada"""
+    stats = stats or {}
+    counters = [('transcribe_jobs_total', {'mode': mode, 'status': status}, 1)]
+    observations = [
+        ('transcribe_stage_seconds', {'mode': mode, 'stage': stage}, seconds)
+        for stage, seconds in stats.get('timings', {}).items()
+    ]
+    observations += [
+        ('transcribe_chunk_inference_seconds', {}, seconds)
+        for seconds in stats.get('chunk_inference_seconds', [])
+    ]
+    if total_seconds is not None:
+        observations.append(('transcribe_request_seconds', {'mode': mode}, total_seconds))
+    audio_duration = stats.get('audio_duration')
+    if status == 'done' and audio_duration:
+        counters.append(('transcribe_audio_seconds_total', {'mode': mode}, audio_duration))
+        # Un acierto de caché no dice nada de la velocidad de inferencia
+        if total_seconds is not None and not stats.get('cache_hit'):
+            observations.append(('transcribe_realtime_factor', {'mode': mode}, total_seconds / audio_duration))
+    if stats.get('vad_skipped_seconds'):
+        counters.append(('transcribe_vad_skipped_seconds_total', {}, stats['vad_skipped_seconds']))
+    metrics.record(counters=counters, observations=observations)
 
 #############################################
 # CARGA DIFERIDA (LAZY LOAD) DEL MODELO    #
 #############################################
 # Evita cargar el modelo al iniciar el proceso, reduciendo uso de memoria inicial
 # y tiempo de arranque en Render. Solo se cargará en la primera transcripción.
-
-model = None  # se llenará bajo demanda
+# Varios modelos pueden convivir en un registro clave (nombre, dispositivo, dtype);
+# si se supera MODEL_MEMORY_BUDGET_MB se expulsa el menos usado recientemente.
+# WHISPER_BACKEND elige la variante optimizada para CPU de cada despliegue:
+#   torch        float32 tal como lo devuelve whisper.load_model (por defecto)
+#   int8         cuantización dinámica int8 de las capas lineales (torch)
+#   compile      encoder compilado con torch.compile
+#   ctranslate2  motor CTranslate2 vía faster-whisper (dependencia opcional)
+# Todas exponen el mismo .transcribe(), así que transcribe_audio no cambia.
 
 FALLBACK_ORDER = [
     MODEL,          # Modelo solicitado por el usuario
@@ -113,32 +430,311 @@ FALLBACK_ORDER = [
     "tiny"         # Último recurso (rápido, menos precisión)
 ]
 
-def load_whisper_model():
+# Nombres de whisper.available_models(), fijos para no importar whisper (y torch) al arrancar
+WHISPER_MODEL_NAMES = (
+    'tiny.en', 'tiny', 'base.en', 'base', 'small.en', 'small', 'medium.en', 'medium',
+    'large-v1', 'large-v2', 'large-v3', 'large', 'large-v3-turbo', 'turbo'
+)
+
+# Modelos que una petición puede elegir con el campo 'model'. Por defecto solo el
+# configurado y los de degradación: cualquier otro supone una descarga de varios GB
+ALLOWED_MODELS = [
+    m.strip() for m in os.environ.get("ALLOWED_MODELS", ",".join(dict.fromkeys(FALLBACK_ORDER))).split(",")
+    if m.strip()
+]
+
+# Parámetros (millones) de cada tamaño, para estimar la memoria de un modelo antes de cargarlo
+WHISPER_MODEL_PARAMS_M = {
+    'tiny': 39, 'base': 74, 'small': 244, 'medium': 769,
+    'large-v1': 1550, 'large-v2': 1550, 'large-v3': 1550, 'large': 1550,
+    'large-v3-turbo': 809, 'turbo': 809
+}
+# Bytes por parámetro aproximados de cada variante (int8 deja embeddings y convoluciones en float32)
+DTYPE_BYTES_PER_PARAM = {'float32': 4, 'compile': 4, 'int8': 2, 'ctranslate2': 1}
+
+WHISPER_BACKENDS = ('torch', 'int8', 'compile', 'ctranslate2')
+
+def whisper_backend():
+    """Backend de inferencia configurado (WHISPER_BACKEND); valores desconocidos usan torch"""
+    backend = os.environ.get("WHISPER_BACKEND", "torch").strip().lower()
+    return backend if backend in WHISPER_BACKENDS else 'torch'
+
+def _model_footprint(m):
+    """Bytes ocupados por los pesos de un modelo (incluye pesos int8 empaquetados)"""
+    if hasattr(m, 'footprint_bytes'):
+        return m.footprint_bytes
+    try:
+        import torch
+        total = 0
+        for value in m.state_dict().values():
+            for t in (value if isinstance(value, (tuple, list)) else (value,)):
+                if torch.is_tensor(t):
+                    total += t.numel() * t.element_size()
+        return total
+    except Exception:
+        return 0
+
+class FasterWhisperModel:
+    """Adaptador de faster-whisper (CTranslate2) con la interfaz de model.transcribe de Whisper"""
+
+    def __init__(self, name, device, compute_type):
+        from faster_whisper import WhisperModel
+        from faster_whisper.utils import download_model
+        path = download_model(name)
+        self.model = WhisperModel(path, device=device, compute_type=compute_type)
+        self.device = device
+        self.is_multilingual = self.model.model.is_multilingual
+        self.footprint_bytes = sum(
+            os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)
+            if os.path.isfile(os.path.join(path, f))
+        )
+
+    def transcribe(self, audio, language=None, task='transcribe', temperature=0.0, initial_prompt=None, **_):
+        if language:
+            whisper = lazy_import('whisper')
+            language = whisper.tokenizer.TO_LANGUAGE_CODE.get(language.lower(), language.lower())
+        segments, info = self.model.transcribe(
+            audio, language=language, task=task, temperature=temperature,
+            initial_prompt=initial_prompt, beam_size=1, condition_on_previous_text=True
+        )
+        result_segments = [
+            {
+                'id': i,
+                'seek': s.seek,
+                'start': s.start,
+                'end': s.end,
+                'text': s.text,
+                'tokens': list(s.tokens),
+                'temperature': s.temperature,
+                'avg_logprob': s.avg_logprob,
+                'compression_ratio': s.compression_ratio,
+                'no_speech_prob': s.no_speech_prob
+            }
+            for i, s in enumerate(segments)
+        ]
+        return {
+            'text': ''.join(s['text'] for s in result_segments),
+            'segments': result_segments,
+            'language': info.language
+        }
+
+    def language_probabilities(self, audio):
+        # transcribe detecta el idioma al llamarse; los segmentos son un generador que no se consume
+        _, info = self.model.transcribe(audio, language=None, beam_size=1)
+        return dict(info.all_language_probs or [(info.language, info.language_probability)])
+
+def _build_model(name, device, backend):
+    """Cargar `name` y aplicar la optimización del backend"""
+    if backend == 'ctranslate2':
+        compute_type = os.environ.get("WHISPER_CT2_COMPUTE_TYPE", "int8")
+        return FasterWhisperModel(name, device, compute_type)
+
+    import torch
+    whisper = lazy_import('whisper')
+    m = whisper.load_model(name, device=device)
+    if backend == 'int8':
+        if device != 'cpu':
+            logger.warning(f"[Registro] int8 dinámico solo aplica en CPU; {name} queda en float32 en {device}")
+            return m
+        # whisper.model.Linear es una subclase de nn.Linear que quantize_dynamic no reconoce;
+        # su forward solo convierte el dtype, así que se trata como nn.Linear normal
+        for module in m.modules():
+            if type(module) is whisper.model.Linear:
+                module.__class__ = torch.nn.Linear
+        torch.ao.quantization.quantize_dynamic(m, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif backend == 'compile':
+        # Solo el encoder: forma fija (30 s de mel) y la mayor parte del cómputo en CPU.
+        # El decoder usa hooks de kv-cache y longitudes variables que no compilan bien.
+        import torch._dynamo
+        torch._dynamo.config.suppress_errors = True
+        m.encoder = torch.compile(m.encoder)
+    return m
+
+class ModelTooLarge(RuntimeError):
+    """El modelo pedido no cabe en MODEL_MEMORY_BUDGET_MB"""
+
+class ModelRegistry:
+    """Modelos cargados bajo demanda con expulsión LRU según un presupuesto de memoria.
+
+    Cada entrada se identifica por (nombre, dispositivo, dtype). Las cargas del
+    mismo modelo se serializan con un lock por clave para no descargar dos veces;
+    un modelo expulsado sigue vivo mientras alguna transcripción lo esté usando.
+    """
+
+    def __init__(self, budget_bytes=0):
+        self.budget_bytes = budget_bytes
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        # Memoria medida de cada (nombre, dtype) ya cargado alguna vez (sobrevive a la expulsión)
+        self._footprints = {}
+
+    def estimated_bytes(self, name, dtype='float32'):
+        """Memoria esperada de un modelo: la medida si ya se cargó, si no la estimada por tamaño"""
+        known = self._footprints.get((name, dtype))
+        if known:
+            return known
+        params = WHISPER_MODEL_PARAMS_M.get(name.removesuffix('.en'))
+        if params is None:
+            return None
+        return params * 1000 * 1000 * DTYPE_BYTES_PER_PARAM.get(dtype, 4)
+
+    def fits(self, name, dtype='float32'):
+        """False si se sabe que el modelo no cabe en el presupuesto ni estando solo"""
+        estimate = self.estimated_bytes(name, dtype)
+        return self.budget_bytes <= 0 or estimate is None or estimate <= self.budget_bytes
+
+    def get(self, name, device=None, dtype='float32'):
+        """dtype identifica la variante: 'float32' (torch), 'int8', 'compile' o 'ctranslate2'"""
+        key = (name, device or _default_device(), dtype)
+        with self._lock:
+            entry = self._touch(key)
+            if entry is not None:
+                return entry['model']
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                # Otro hilo pudo cargarlo mientras se esperaba el lock de carga
+                entry = self._touch(key)
+                if entry is not None:
+                    return entry['model']
+            if not self.fits(name, dtype):
+                raise ModelTooLarge(
+                    f"El modelo {name} ({dtype}) necesita unos {self.estimated_bytes(name, dtype) // (1024 * 1024)} MB "
+                    f"y MODEL_MEMORY_BUDGET_MB es {self.budget_bytes // (1024 * 1024)}"
+                )
+            started = time.time()
+            m = _build_model(name, key[1], 'torch' if dtype == 'float32' else dtype)
+            entry = {
+                'model': m,
+                'footprint': _model_footprint(m),
+                'load_seconds': round(time.time() - started, 2)
+            }
+            with self._lock:
+                entry['last_used'] = time.time()
+                self._footprints[(name, dtype)] = entry['footprint']
+                self._entries[key] = entry
+                self._evict(keep=key)
+            metrics.record(
+                counters=[('transcribe_model_loads_total', {'model': name, 'backend': dtype}, 1)],
+                observations=[('transcribe_model_load_seconds', {'model': name, 'backend': dtype}, entry['load_seconds'])]
+            )
+            logger.info(
+                "[Registro] Modelo %s cargado en %.1fs (%.0f MB)",
+                key, entry['load_seconds'], entry['footprint'] / (1024 * 1024)
+            )
+            return m
+
+    def _touch(self, key):
+        """Marcar un modelo cargado como el más reciente (con self._lock tomado); None si no está"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            entry['last_used'] = time.time()
+        return entry
+
+    def _evict(self, keep):
+        """Expulsar los modelos menos usados hasta respetar el presupuesto (con self._lock tomado)"""
+        if self.budget_bytes <= 0:
+            return
+        while self.total_bytes() > self.budget_bytes and len(self._entries) > 1:
+            key = next(k for k in self._entries if k != keep)
+            evicted = self._entries.pop(key)
+            logger.info("[Registro] Expulsado modelo %s (%.0f MB) por presupuesto de memoria",
+                        key, evicted['footprint'] / (1024 * 1024))
+
+    def total_bytes(self):
+        return sum(e['footprint'] for e in self._entries.values())
+
+    def is_loaded(self, name=None):
+        with self._lock:
+            return any(name is None or k[0] == name for k in self._entries)
+
+    def snapshot(self):
+        """Modelos residentes, del menos al más usado recientemente"""
+        with self._lock:
+            return [
+                {
+                    'name': k[0],
+                    'device': k[1],
+                    'dtype': k[2],
+                    'memory_mb': round(e['footprint'] / (1024 * 1024), 1),
+                    'load_seconds': e['load_seconds'],
+                    'last_used': datetime.datetime.fromtimestamp(e['last_used']).isoformat()
+                }
+                for k, e in self._entries.items()
+            ]
+
+# Whisper instala hooks de kv-cache en el propio modelo durante cada decodificación, así que
+# dos hilos no pueden decodificar con la misma instancia a la vez (ASYNC_WORKERS > 1 sin pool,
+# peticiones síncronas simultáneas en gthread, warm-up). Cada instancia tiene su lock.
+_inference_locks = weakref.WeakKeyDictionary()
+_inference_locks_guard = threading.Lock()
+
+def inference_lock(m):
+    """Lock que serializa la inferencia sobre una instancia de modelo"""
+    with _inference_locks_guard:
+        lock = _inference_locks.get(m)
+        if lock is None:
+            lock = _inference_locks[m] = threading.Lock()
+        return lock
+
+def _default_device():
+    """Dispositivo para los modelos: WHISPER_DEVICE o CUDA si está disponible"""
+    device = os.environ.get("WHISPER_DEVICE")
+    if device:
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+# Presupuesto para los modelos residentes: 1 GB da para el modelo por defecto (base,
+# ~300 MB en float32) y un fallback; render.yaml lo ajusta a la RAM del plan. 0 sin límite
+model_registry = ModelRegistry(int(_env_float("MODEL_MEMORY_BUDGET_MB", 1024) * 1024 * 1024))
+
+if not model_registry.fits(MODEL, 'float32' if whisper_backend() == 'torch' else whisper_backend()):
+    logger.warning(f"[Registro] WHISPER_MODEL={MODEL} no cabe en MODEL_MEMORY_BUDGET_MB; se usará un modelo de degradación")
+
+def model_admissible(name):
+    """Mensaje de error si una petición no puede usar `name` (None si puede)"""
+    if name not in ALLOWED_MODELS:
+        return f'Modelo no permitido: {name}'
+    backend = whisper_backend()
+    if not model_registry.fits(resolve_model_name(name), 'float32' if backend == 'torch' else backend):
+        return f'Modelo demasiado grande para MODEL_MEMORY_BUDGET_MB: {name}'
+    return None
+
+# Degradaciones ya resueltas (solicitado -> cargado) para no reintentar en cada petición
+_downgraded = {}
+
+def load_whisper_model(name=None, backend=None):
     """Cargar el modelo Whisper bajo demanda con degradación automática.
     Usa la variable de entorno WHISPER_AUTO_DOWNGRADE=1 para permitir bajar de modelo
-    si hay errores de memoria o descarga.
+    si hay errores de memoria o descarga. `backend` por defecto es WHISPER_BACKEND.
     """
-    global model
-    if model is not None:
-        return model
+    backend = backend or whisper_backend()
+    dtype = 'float32' if backend == 'torch' else backend
+    requested = name or MODEL
+    if requested in _downgraded:
+        requested_order = [_downgraded[requested]]
+    else:
+        requested_order = [requested] + [c for c in FALLBACK_ORDER if c != requested]
 
     auto_downgrade = os.environ.get("WHISPER_AUTO_DOWNGRADE", "1") == "1"
     tried = set()
     errors = {}
 
-    logger.info("[Whisper] Carga diferida iniciada. Modelo solicitado: %s", MODEL)
-    for candidate in FALLBACK_ORDER:
+    for candidate in requested_order:
         if candidate in tried:
             continue
         tried.add(candidate)
         try:
-            logger.info("[Whisper] Intentando cargar modelo: %s", candidate)
-            m = whisper.load_model(candidate)
-            model = m
-            logger.info("[Whisper] Modelo '%s' cargado correctamente", candidate)
-            if candidate != MODEL:
-                logger.warning("[Whisper] Se degradó el modelo solicitado '%s' -> '%s'", MODEL, candidate)
-            return model
+            if not model_registry.is_loaded(candidate):
+                logger.info("[Whisper] Intentando cargar modelo: %s", candidate)
+            m = model_registry.get(candidate, dtype=dtype)
+            if candidate != requested and requested not in _downgraded:
+                logger.warning("[Whisper] Se degradó el modelo solicitado '%s' -> '%s'", requested, candidate)
+                _downgraded[requested] = candidate
+            return m
         except Exception as e:
             errors[candidate] = str(e)
             logger.error("[Whisper] Error cargando '%s': %s", candidate, e)
@@ -150,6 +746,204 @@ def load_whisper_model():
     summary = "; ".join([f"{k}: {v[:120]}" for k,v in errors.items()])
     raise RuntimeError(f"No se pudo cargar ningún modelo Whisper. Errores: {summary}")
 
+def resolve_model_name(name):
+    """Nombre de modelo efectivo tras aplicar degradaciones conocidas"""
+    requested = name or MODEL
+    return _downgraded.get(requested, requested)
+
+#############################################
+# POOL DE PROCESOS CON RÉPLICAS DEL MODELO  #
+#############################################
+# TRANSCRIBE_PROCESSES=N (>0) reparte la inferencia (chunks de un mismo archivo y de
+# distintas tareas) entre N procesos, cada uno con su propio modelo Whisper cargado.
+# TORCH_THREADS_PER_WORKER limita los hilos intra-op de torch por proceso para no
+# sobresuscribir los núcleos (por defecto: núcleos disponibles / N).
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _is_pool_child():
+    """True si este proceso es un worker del pool (no debe arrancar colas ni servidor).
+
+    Se usa el nombre del proceso porque 'spawn' lo fija antes de reimportar el
+    módulo principal, mientras que parent_process() aún no está disponible.
+    """
+    return multiprocessing.current_process().name != 'MainProcess'
+
+def _pool_size():
+    """Número de procesos configurado para el pool (0 = inferencia en el propio proceso)"""
+    try:
+        return max(0, int(os.environ.get("TRANSCRIBE_PROCESSES", "0")))
+    except ValueError:
+        return 0
+
+def _torch_threads_per_worker(processes):
+    default = max(1, (os.cpu_count() or 1) // max(processes, 1))
+    try:
+        return max(1, int(os.environ.get("TORCH_THREADS_PER_WORKER", default)))
+    except ValueError:
+        return default
+
+# Tiempos de carga y calentamiento de este proceso del pool, por modelo
+_pool_warmup_timings = {}
+
+def _pool_initializer(threads):
+    """Inicialización de cada proceso del pool: limitar hilos y cargar su réplica del modelo.
+
+    Con WARMUP=1 cada proceso carga y calienta WARMUP_MODELS aquí, antes de aceptar
+    tareas, así que un proceso nuevo (también tras recrear un pool roto) nunca atiende
+    en frío.
+    """
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    if not WARMUP_ENABLED:
+        load_whisper_model()
+        return
+    for name in WARMUP_MODELS:
+        started = time.time()
+        m = load_whisper_model(name)
+        loaded = time.time()
+        _synthetic_inference(m)
+        _pool_warmup_timings[name] = {
+            'load_seconds': round(loaded - started, 2),
+            'warmup_seconds': round(time.time() - loaded, 2)
+        }
+
+def _pool_transcribe(audio, options, model_name=None):
+    """Tarea ejecutada en un proceso del pool: transcribir un array de audio"""
+    m = load_whisper_model(model_name)
+    started = time.perf_counter()
+    with inference_lock(m):
+        result = m.transcribe(audio, **options)
+    return {
+        'text': result.get('text', ''),
+        'segments': result.get('segments', []),
+        'language': result.get('language'),
+        'inference_seconds': round(time.perf_counter() - started, 4)
+    }
+
+def get_transcription_pool():
+    """Obtener (creando bajo demanda) el pool compartido por todas las tareas del proceso"""
+    global _pool
+    processes = _pool_size()
+    if processes <= 0 or _is_pool_child():
+        return None
+    with _pool_lock:
+        if _pool is None:
+            threads = _torch_threads_per_worker(processes)
+            logger.info(f"[Pool] Iniciando {processes} procesos de transcripción ({threads} hilos torch cada uno)")
+            # 'spawn' evita heredar por fork el estado de torch y los hilos del servidor
+            _pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_pool_initializer,
+                initargs=(threads,)
+            )
+        return _pool
+
+def _reset_transcription_pool():
+    """Descartar un pool roto (p. ej. un worker murió por falta de memoria) para recrearlo"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+#############################################
+# PRECALENTAMIENTO (WARM-UP) EN SEGUNDO PLANO #
+#############################################
+# Con WARMUP=1 los modelos de WARMUP_MODELS (por defecto WHISPER_MODEL) se cargan en un
+# hilo al arrancar y se ejecuta una inferencia sintética corta para calentar kernels.
+# /ready responde 503 hasta que termina; /health sigue respondiendo OK mientras tanto.
+
+WARMUP_ENABLED = os.environ.get("WARMUP", "0") == "1"
+WARMUP_MODELS = [
+    m.strip() for m in os.environ.get("WARMUP_MODELS", MODEL).split(",") if m.strip()
+]
+
+warmup_state = {
+    'status': 'pending' if WARMUP_ENABLED else 'disabled',
+    'models': {},
+    'started_at': None,
+    'finished_at': None,
+    'error': None
+}
+
+def _synthetic_inference(m):
+    """Inferencia mínima (1 s de silencio) para inicializar kernels y caches de torch"""
+    with inference_lock(m):
+        m.transcribe(
+            np.zeros(SAMPLE_RATE, dtype=np.float32),
+            fp16=False, language='en', temperature=0.0, verbose=None
+        )
+
+def _pool_warmup():
+    """Tarea que informa del proceso que la atiende (ya calentado por _pool_initializer)"""
+    return os.getpid(), _pool_warmup_timings
+
+def _wait_pool_warm(pool, processes):
+    """Esperar a que todos los procesos del pool hayan terminado su inicialización.
+
+    El executor no reparte una tarea por proceso: uno rápido puede atender varias
+    mientras otro sigue cargando. Se envían tareas hasta que respondan `processes`
+    PID distintos y se devuelven los tiempos de cada uno.
+    """
+    timings = {}
+    while len(timings) < processes:
+        futures = [pool.submit(_pool_warmup) for _ in range(processes - len(timings))]
+        for future in futures:
+            pid, info = future.result()
+            timings[pid] = info
+        if len(timings) < processes:
+            time.sleep(0.1)
+    return timings
+
+def warmup_models():
+    """Cargar y calentar los modelos configurados; actualiza warmup_state"""
+    warmup_state['status'] = 'loading'
+    warmup_state['started_at'] = datetime.datetime.now().isoformat()
+    try:
+        pool = get_transcription_pool()
+        # Con pool cada réplica se calienta en su inicializador; aquí solo se espera a todas
+        pool_timings = _wait_pool_warm(pool, _pool_size()) if pool is not None else None
+        if pool_timings is not None:
+            warmup_state['processes'] = len(pool_timings)
+        for name in WARMUP_MODELS:
+            info = {}
+            if pool is None:
+                started = time.time()
+                m = load_whisper_model(name)
+                info['load_seconds'] = round(time.time() - started, 2)
+                started = time.time()
+                _synthetic_inference(m)
+                info['warmup_seconds'] = round(time.time() - started, 2)
+            else:
+                # El proceso más lento marca cuándo está listo el pool
+                replicas = [timings[name] for timings in pool_timings.values() if name in timings]
+                info['load_seconds'] = max((r['load_seconds'] for r in replicas), default=None)
+                info['warmup_seconds'] = max((r['warmup_seconds'] for r in replicas), default=None)
+            warmup_state['models'][name] = info
+            logger.info(f"[Warm-up] Modelo '{name}' listo: carga {info['load_seconds']}s, calentamiento {info['warmup_seconds']}s")
+        warmup_state['status'] = 'ready'
+    except Exception as e:
+        logger.error(f"[Warm-up] Error precalentando modelos: {e}")
+        warmup_state['status'] = 'error'
+        warmup_state['error'] = str(e)
+    finally:
+        warmup_state['finished_at'] = datetime.datetime.now().isoformat()
+
+def is_ready():
+    """Listo para transcribir: warm-up terminado, o sin warm-up (carga diferida)"""
+    return warmup_state['status'] in ('ready', 'disabled')
+
+if WARMUP_ENABLED and not _is_pool_child():
+    threading.Thread(target=warmup_models, daemon=True).start()
+    logger.info(f"[Warm-up] Precalentando modelos en segundo plano: {WARMUP_MODELS}")
+
 # Formatos de audio permitidos
 ALLOWED_EXTENSIONS = {
     'mp3', 'wav', 'flac', 'm4a', 'aac', 'ogg', 'wma', 
@@ -161,11 +955,642 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def transcribe_audio(audio_path, language='spanish', progress_callback=None):
+# Whisper trabaja internamente con audio mono a 16 kHz, en ventanas de 30 s
+# (whisper.audio.SAMPLE_RATE y CHUNK_LENGTH, fijos para no importar whisper al arrancar)
+SAMPLE_RATE = 16000
+WHISPER_WINDOW_SECONDS = 30
+
+def _ffmpeg_pcm_command(audio_path, sample_rate=SAMPLE_RATE, start=None, duration=None):
+    """Comando FFmpeg que escribe PCM s16le mono en stdout (opcionalmente solo un tramo)"""
+    # -ss antes de -i: búsqueda rápida por el contenedor, sin decodificar lo anterior
+    window = []
+    if start:
+        window += ['-ss', f"{start:.3f}"]
+    if duration:
+        window += ['-t', f"{duration:.3f}"]
+    return [
+        'ffmpeg', '-nostdin', '-threads', '0', '-loglevel', 'error',
+        *window, '-i', audio_path,
+        '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(sample_rate),
+        '-'
+    ]
+
+def decode_audio(audio_path, sample_rate=SAMPLE_RATE, start=None, duration=None):
+    """Decodificar cualquier formato a un array float32 mono usando un pipe de FFmpeg.
+
+    FFmpeg escribe PCM s16le en stdout y se convierte directamente a NumPy,
+    sin AudioSegment de pydub ni WAV temporal en disco. `start` y `duration`
+    (segundos) limitan la decodificación a un tramo.
+    """
+    try:
+        command = _ffmpeg_pcm_command(audio_path, sample_rate, start, duration)
+        out = subprocess.run(command, capture_output=True, check=True).stdout
+    except FileNotFoundError:
+        raise RuntimeError("FFmpeg no está instalado o no está en el PATH")
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode('utf-8', errors='ignore').strip()
+        raise RuntimeError(f"FFmpeg no pudo decodificar el archivo: {stderr[-500:]}")
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+def iter_audio_windows(audio_path, window_seconds, sample_rate=SAMPLE_RATE):
+    """Leer el audio en ventanas fijas directamente desde el pipe de FFmpeg.
+
+    Genera tuplas (offset_en_muestras, array_float32). Solo hay una ventana
+    residente a la vez: el buffer de lectura se reutiliza entre iteraciones,
+    así que la memoria no depende de la duración total del archivo.
+    """
+    window_bytes = int(window_seconds * sample_rate) * 2
+    raw = bytearray(window_bytes)
+    view = memoryview(raw)
+    # stderr a archivo temporal para no bloquear el pipe si FFmpeg escribe mucho
+    with tempfile.TemporaryFile() as stderr_file:
+        try:
+            proc = subprocess.Popen(
+                _ffmpeg_pcm_command(audio_path, sample_rate),
+                stdout=subprocess.PIPE, stderr=stderr_file
+            )
+        except FileNotFoundError:
+            raise RuntimeError("FFmpeg no está instalado o no está en el PATH")
+        offset = 0
+        try:
+            while True:
+                got = 0
+                while got < window_bytes:
+                    n = proc.stdout.readinto(view[got:])
+                    if not n:
+                        break
+                    got += n
+                samples = got // 2
+                if samples == 0:
+                    break
+                window = np.frombuffer(raw, np.int16, count=samples).astype(np.float32) / 32768.0
+                yield offset, window
+                offset += samples
+                if got < window_bytes:
+                    break
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            returncode = proc.wait()
+        if returncode != 0 and offset == 0:
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', errors='ignore').strip()
+            raise RuntimeError(f"FFmpeg no pudo decodificar el archivo: {stderr[-500:]}")
+
+def find_cut_point(audio, target, search, sample_rate=SAMPLE_RATE):
+    """Buscar el punto más silencioso alrededor de `target` (en muestras).
+
+    Calcula la energía por tramos de 50 ms de forma vectorizada en
+    [target - search, target + search] (sin pasar del final de `audio`), la
+    suaviza (~0.3 s) y devuelve el centro del tramo con menor energía, para no
+    cortar a mitad de palabra.
+    """
+    frame = int(0.05 * sample_rate)
+    lo = max(0, target - search)
+    hi = min(len(audio), target + search)
+    n_frames = (hi - lo) // frame
+    if n_frames < 3:
+        return min(target, len(audio))
+    region = audio[lo:lo + n_frames * frame].reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(region ** 2, axis=1))
+    # Media móvil normalizada: con mode='same' los bordes se rellenan con ceros y
+    # parecerían más silenciosos de lo que son
+    kernel = np.ones(6)
+    smooth = np.convolve(energy, kernel, mode='same') / np.convolve(np.ones(n_frames), kernel, mode='same')
+    best = int(np.argmin(smooth))
+    return lo + best * frame + frame // 2
+
+def iter_audio_chunks(audio_path, chunk_seconds, overlap_seconds=0.0, search_seconds=0.0, sample_rate=SAMPLE_RATE):
+    """Dividir el audio en chunks solapados con cortes alineados a silencios.
+
+    Se apoya en iter_audio_windows (lectura en streaming), así que solo se
+    mantiene un chunk más el solapamiento en memoria. Genera tuplas
+    (offset_en_muestras, array_float32); cada chunk comienza
+    `overlap_seconds` antes del final del anterior.
+
+    El silencio solo se busca en los `search_seconds` previos al límite: un
+    chunk nunca dura más de `chunk_seconds`, así que con CHUNK_SECONDS <= 30
+    cada chunk cabe en una sola ventana de Whisper.
+    """
+    chunk = int(chunk_seconds * sample_rate)
+    # Limitar solapamiento y búsqueda para que cada chunk avance siempre
+    overlap = min(int(overlap_seconds * sample_rate), chunk // 4)
+    search = min(int(search_seconds * sample_rate), chunk // 4)
+    buf = np.zeros(0, dtype=np.float32)
+    buf_start = 0
+    covered = 0  # última muestra (absoluta) ya entregada en algún chunk
+    for _, window in iter_audio_windows(audio_path, chunk_seconds, sample_rate):
+        buf = np.concatenate((buf, window)) if len(buf) else window
+        while len(buf) >= chunk:
+            cut = find_cut_point(buf[:chunk], chunk, search, sample_rate) if search else chunk
+            yield buf_start, buf[:cut]
+            covered = buf_start + cut
+            keep_from = max(cut - overlap, 0)
+            buf = buf[keep_from:].copy()
+            buf_start += keep_from
+    if len(buf) and buf_start + len(buf) > covered:
+        yield buf_start, buf
+
+def _normalize_words(text):
+    """Palabras en minúscula sin puntuación, para comparar textos de chunks"""
+    return re.findall(r"\w+", (text or '').lower())
+
+def merge_chunk_segments(merged, new_segments, overlap_start, overlap_end, tolerance=1.0):
+    """Fusionar los segmentos de un chunk nuevo eliminando duplicados del solapamiento.
+
+    merged: segmentos ya aceptados (se modifica en sitio).
+    new_segments: segmentos del chunk nuevo, ya con tiempos absolutos.
+    overlap_start/overlap_end: región (en segundos) cubierta por ambos chunks.
+
+    Primero se alinea por tiempo: la mitad del solapamiento actúa como frontera
+    y cada segmento se asigna al chunk donde cae su punto medio. Después se
+    alinea por texto: si el primer segmento nuevo repite palabras del final del
+    último aceptado, se recortan (o se descarta si es un duplicado completo).
+    """
+    def midpoint(s):
+        return (s.get('start', 0.0) + s.get('end', 0.0)) / 2.0
+
+    if overlap_end > overlap_start:
+        boundary = (overlap_start + overlap_end) / 2.0
+        while merged and midpoint(merged[-1]) >= boundary:
+            merged.pop()
+        new_segments = [s for s in new_segments if midpoint(s) >= boundary]
+
+    while merged and new_segments:
+        prev, first = merged[-1], new_segments[0]
+        if first.get('start', 0.0) > prev.get('end', 0.0) + tolerance:
+            break
+        prev_words = _normalize_words(prev.get('text'))
+        raw_words = (first.get('text') or '').split()
+        first_words = _normalize_words(first.get('text'))
+        if not first_words or not prev_words:
+            break
+        if difflib.SequenceMatcher(None, prev_words, first_words).ratio() >= 0.8:
+            new_segments = new_segments[1:]
+            continue
+        # Mayor k tal que las últimas k palabras previas == primeras k nuevas
+        repeated = 0
+        for k in range(min(len(prev_words), len(first_words), 20), 0, -1):
+            if prev_words[-k:] == first_words[:k]:
+                repeated = k
+                break
+        if repeated and len(raw_words) == len(first_words):
+            remaining = raw_words[repeated:]
+            if not remaining:
+                new_segments = new_segments[1:]
+                continue
+            first = dict(first, text=' ' + ' '.join(remaining))
+            new_segments = [first] + new_segments[1:]
+        break
+
+    merged.extend(new_segments)
+    return merged
+
+def _segments_to_text(segments):
+    """Texto final a partir de segmentos: un párrafo por chunk"""
+    paragraphs = []
+    current_chunk = object()
+    for s in segments:
+        if s.get('chunk') != current_chunk:
+            paragraphs.append([])
+            current_chunk = s.get('chunk')
+        paragraphs[-1].append((s.get('text') or '').strip())
+    return '\n'.join(' '.join(p for p in para if p) for para in paragraphs)
+
+def probe_duration(audio_path):
+    """Duración en segundos leyendo solo la cabecera (ffprobe, o `ffmpeg -i` como respaldo).
+
+    Devuelve None si no se puede determinar.
+    """
+    try:
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', audio_path],
+            capture_output=True, check=True, text=True
+        ).stdout.strip()
+        return float(out)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        pass
+    try:
+        info = subprocess.run(['ffmpeg', '-nostdin', '-i', audio_path], capture_output=True, text=True).stderr
+        match = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", info)
+        if match:
+            h, m, s = match.groups()
+            return int(h) * 3600 + int(m) * 60 + float(s)
+    except FileNotFoundError:
+        pass
+    return None
+
+def _current_rss_bytes():
+    """Memoria residente actual del proceso (None si la plataforma no lo permite)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reporta KB, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+class PeakRssMonitor:
+    """Muestrear el RSS en segundo plano mientras dura un trabajo y guardar el pico"""
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.peak = _current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        current = _current_rss_bytes()
+        if current is not None and (self.peak is None or current > self.peak):
+            self.peak = current
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._sample()
+        return False
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / (1024 * 1024), 1) if self.peak is not None else None
+
+#############################################
+# MOTOR DE INFERENCIA POR LOTES             #
+#############################################
+# model.transcribe procesa ventanas de 30 s de una en una (lote 1). Con BATCH_MAX_SIZE > 1,
+# las ventanas de hasta 30 s (notas de voz cortas o chunks con CHUNK_SECONDS <= 30) de
+# todas las peticiones y tareas en curso se acumulan hasta BATCH_MAX_SIZE o hasta
+# BATCH_MAX_WAIT_MS, el encoder se ejecuta una sola vez sobre el lote y luego se decodifica
+# cada grupo de opciones compatible con whisper.decode. Solo aplica sin pool de procesos.
+
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "1"))
+BATCH_MAX_WAIT_MS = _env_float("BATCH_MAX_WAIT_MS", 50.0)
+BATCH_WINDOW_SAMPLES = WHISPER_WINDOW_SECONDS * SAMPLE_RATE
+# Mismos umbrales que model.transcribe para descartar ventanas sin voz
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+
+def _tokens_to_segments(tokens, tokenizer, duration):
+    """Segmentos con tiempos a partir de los tokens de timestamp (<|0.00|> texto <|2.40|>...)"""
+    segments = []
+    start = None
+    text_tokens = []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            t = min((token - tokenizer.timestamp_begin) * 0.02, duration)
+            if start is not None and text_tokens:
+                segments.append({'start': start, 'end': t, 'tokens': text_tokens})
+                start, text_tokens = None, []
+            else:
+                start = t
+        elif token < tokenizer.eot:
+            text_tokens.append(token)
+    if text_tokens:
+        segments.append({
+            'start': start if start is not None else (segments[-1]['end'] if segments else 0.0),
+            'end': duration,
+            'tokens': text_tokens
+        })
+    for i, s in enumerate(segments):
+        s['id'] = i
+        s['seek'] = 0
+        s['text'] = tokenizer.decode(s['tokens'])
+    return segments
+
+class BatchInferenceEngine:
+    """Agrupar ventanas de 30 s de varias peticiones en un único paso del encoder"""
+
+    def __init__(self, max_batch_size, max_wait_seconds):
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batches = 0
+        self.windows = 0
+
+    def submit(self, audio, options, model_name=None):
+        """Encolar una ventana (<= 30 s de audio 16 kHz); devuelve un Future con {'text', 'segments'}"""
+        model_key = resolve_model_name(model_name)
+        m = load_whisper_model(model_key)
+        whisper = lazy_import('whisper')
+        # El mel se calcula en el hilo que envía (en paralelo entre peticiones)
+        mel = whisper.log_mel_spectrogram(
+            whisper.pad_or_trim(np.asarray(audio, dtype=np.float32)),
+            getattr(m.dims, 'n_mels', 80)
+        ).to(m.device)
+        future = Future()
+        with self._cond:
+            self._pending.append((model_key, mel, dict(options), len(audio) / SAMPLE_RATE, future, time.time()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Esperar a llenar el lote, como mucho max_wait desde la llegada de la primera ventana
+            deadline = self._pending[0][5] + self.max_wait_seconds
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            model_key = self._pending[0][0]
+            batch, rest = [], collections.deque()
+            while self._pending:
+                item = self._pending.popleft()
+                if item[0] == model_key and len(batch) < self.max_batch_size:
+                    batch.append(item)
+                else:
+                    rest.append(item)
+            self._pending = rest
+            return model_key, batch
+
+    def _loop(self):
+        while True:
+            model_key, batch = self._take_batch()
+            try:
+                self._run(model_key, batch)
+            except Exception as e:
+                logger.error(f"[Lotes] Error en lote de {len(batch)} ventanas: {e}")
+                for item in batch:
+                    if not item[4].done():
+                        item[4].set_exception(e)
+
+    def _run(self, model_key, batch):
+        import torch
+        whisper = lazy_import('whisper')
+        started = time.perf_counter()
+        m = load_whisper_model(model_key)
+        with torch.no_grad():
+            features = m.embed_audio(torch.stack([item[1] for item in batch]))
+        self.batches += 1
+        self.windows += len(batch)
+        logger.info(f"[Lotes] Encoder ejecutado sobre {len(batch)} ventanas ({model_key})")
+
+        # Decodificar por grupos con las mismas opciones (idioma, tarea, prompt)
+        groups = collections.defaultdict(list)
+        for i, item in enumerate(batch):
+            opts = item[2]
+            groups[(opts.get('language'), opts.get('task', 'transcribe'), opts.get('initial_prompt'))].append(i)
+        for (language, task, prompt), indices in groups.items():
+            decode_options = whisper.DecodingOptions(
+                task=task, language=language, temperature=0.0,
+                prompt=prompt, fp16=False, without_timestamps=False
+            )
+            with inference_lock(m):
+                results = whisper.decode(m, features[indices], decode_options)
+            for i, res in zip(indices, results):
+                duration, future = batch[i][3], batch[i][4]
+                if res.no_speech_prob > NO_SPEECH_THRESHOLD and res.avg_logprob < LOGPROB_THRESHOLD:
+                    future.set_result({'text': '', 'segments': [], 'language': res.language,
+                                       'inference_seconds': round(time.perf_counter() - started, 4)})
+                    continue
+                tokenizer = whisper.tokenizer.get_tokenizer(
+                    m.is_multilingual, num_languages=m.num_languages, language=res.language, task=task
+                )
+                segments = _tokens_to_segments(res.tokens, tokenizer, duration)
+                for s in segments:
+                    s.update({
+                        'temperature': res.temperature,
+                        'avg_logprob': res.avg_logprob,
+                        'compression_ratio': res.compression_ratio,
+                        'no_speech_prob': res.no_speech_prob
+                    })
+                future.set_result({
+                    'text': ''.join(s['text'] for s in segments),
+                    'segments': segments,
+                    'language': res.language,
+                    # Tiempo del lote hasta esta ventana (el encoder es compartido)
+                    'inference_seconds': round(time.perf_counter() - started, 4)
+                })
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': round(self.max_wait_seconds * 1000),
+            'batches': self.batches,
+            'windows': self.windows,
+            'avg_batch_size': round(self.windows / self.batches, 2) if self.batches else None
+        }
+
+_batch_engine = None
+_batch_engine_lock = threading.Lock()
+
+def get_batch_engine():
+    """Motor de lotes compartido (None si BATCH_MAX_SIZE <= 1, si hay pool de procesos o con CTranslate2)"""
+    global _batch_engine
+    if BATCH_MAX_SIZE <= 1 or _pool_size() > 0 or whisper_backend() == 'ctranslate2':
+        return None
+    with _batch_engine_lock:
+        if _batch_engine is None:
+            _batch_engine = BatchInferenceEngine(BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS / 1000)
+        return _batch_engine
+
+#############################################
+# DETECCIÓN DE VOZ (VAD) ANTES DE WHISPER   #
+#############################################
+# Reuniones, prédicas y entrevistas tienen mucho silencio o música entre intervenciones.
+# Con VAD_ENABLED=1 se calcula la energía por tramas de 30 ms (vectorizado con numpy),
+# se marcan como voz las tramas que superan el ruido de fondo en VAD_MARGIN_DB, y solo
+# esas regiones (con un margen de VAD_PAD_MS) se concatenan y pasan a Whisper. Los
+# tiempos de los segmentos se traducen de vuelta a la línea de tiempo original.
+
+VAD_ENABLED = os.environ.get("VAD_ENABLED", "0") == "1"
+VAD_FRAME_MS = 30
+VAD_MARGIN_DB = _env_float("VAD_MARGIN_DB", 12.0)
+VAD_FLOOR_DB = _env_float("VAD_FLOOR_DB", -50.0)
+VAD_MIN_SPEECH_MS = _env_float("VAD_MIN_SPEECH_MS", 250)
+VAD_MIN_SILENCE_MS = _env_float("VAD_MIN_SILENCE_MS", 700)
+VAD_PAD_MS = _env_float("VAD_PAD_MS", 200)
+
+def _merge_close_regions(starts, ends, min_gap):
+    """Unir regiones separadas por menos de `min_gap` (arrays ordenados)"""
+    if len(starts) < 2:
+        return starts, ends
+    keep_gap = (starts[1:] - ends[:-1]) >= min_gap
+    return starts[np.concatenate(([True], keep_gap))], ends[np.concatenate((keep_gap, [True]))]
+
+def detect_speech_regions(audio, sample_rate=SAMPLE_RATE):
+    """Regiones con voz como lista de (muestra_inicio, muestra_fin) sobre `audio`"""
+    frame = int(sample_rate * VAD_FRAME_MS / 1000)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy_db = 10 * np.log10(np.mean(np.square(frames, dtype=np.float32), axis=1) + 1e-10)
+    noise_floor = np.percentile(energy_db, 10)
+    if np.percentile(energy_db, 90) - noise_floor < VAD_MARGIN_DB:
+        # Sin contraste (voz continua o todo silencio): solo el umbral absoluto
+        threshold = VAD_FLOOR_DB
+    else:
+        threshold = max(noise_floor + VAD_MARGIN_DB, VAD_FLOOR_DB)
+    voiced = np.concatenate(([False], energy_db > threshold, [False]))
+    edges = np.diff(voiced.astype(np.int8))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+    starts, ends = _merge_close_regions(starts, ends, VAD_MIN_SILENCE_MS / VAD_FRAME_MS)
+    long_enough = (ends - starts) >= VAD_MIN_SPEECH_MS / VAD_FRAME_MS
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    pad = int(sample_rate * VAD_PAD_MS / 1000)
+    starts = np.clip(starts * frame - pad, 0, len(audio))
+    # La última trama incompleta pertenece a la región que llega al final
+    ends = np.where(ends == n_frames, len(audio), np.clip(ends * frame + pad, 0, len(audio)))
+    starts, ends = _merge_close_regions(starts, ends, 1)
+    return [(int(s), int(e)) for s, e in zip(starts, ends)]
+
+def vad_compact(audio, counted_from=0, sample_rate=SAMPLE_RATE):
+    """Concatenar solo las regiones con voz.
+
+    Devuelve (audio_compactado, mapping, segundos_omitidos). `mapping` es una lista de
+    (inicio_compactado_s, inicio_original_s, duración_s); los segundos omitidos se cuentan
+    solo desde la muestra `counted_from` (para no contar dos veces el solapamiento entre chunks).
+    """
+    regions = detect_speech_regions(audio, sample_rate)
+    mapping = []
+    pieces = []
+    position = 0
+    speech_counted = 0
+    for s, e in regions:
+        mapping.append((position / sample_rate, s / sample_rate, (e - s) / sample_rate))
+        pieces.append(audio[s:e])
+        position += e - s
+        speech_counted += max(0, e - max(s, counted_from))
+    skipped = max(0, len(audio) - counted_from - speech_counted) / sample_rate
+    compacted = np.concatenate(pieces) if pieces else audio[:0]
+    return compacted, mapping, skipped
+
+def remap_segments(segments, mapping):
+    """Traducir tiempos de segmentos del audio compactado a la línea de tiempo original"""
+    if not mapping:
+        return segments
+    compact_starts = [m[0] for m in mapping]
+
+    def _remap(t, is_end):
+        # Un final justo en la unión pertenece a la región anterior
+        i = (bisect.bisect_left(compact_starts, t) if is_end else bisect.bisect_right(compact_starts, t)) - 1
+        compact_start, original_start, duration = mapping[max(i, 0)]
+        return original_start + min(max(t - compact_start, 0.0), duration)
+
+    for s in segments:
+        if 'start' in s:
+            s['start'] = _remap(s['start'], False)
+        if 'end' in s:
+            s['end'] = max(_remap(s['end'], True), s.get('start', 0.0))
+    return segments
+
+#############################################
+# IDENTIFICACIÓN DE IDIOMA (MODO AUTO)      #
+#############################################
+# Con lang=auto, Whisper detecta el idioma en cada ventana de 30 s de cada chunk: pasos
+# de decodificador desperdiciados y chunks de una misma grabación en idiomas distintos.
+# Aquí se detecta una sola vez por archivo sobre unas pocas ventanas con voz repartidas
+# por la grabación y el idioma elegido se fija para todos los chunks.
+# LANGUAGE_DETECTION=chunk conserva la detección por chunk (audio multilingüe); también
+# se vuelve a ella si la confianza no llega a LANGUAGE_MIN_CONFIDENCE.
+
+LANGUAGE_DETECTION = os.environ.get("LANGUAGE_DETECTION", "file").lower()
+LANGUAGE_SAMPLE_WINDOWS = int(os.environ.get("LANGUAGE_SAMPLE_WINDOWS", "3"))
+LANGUAGE_MIN_CONFIDENCE = _env_float("LANGUAGE_MIN_CONFIDENCE", 0.5)
+LANGUAGE_WINDOW_SECONDS = WHISPER_WINDOW_SECONDS
+
+def sample_speech_windows(audio_path, duration, windows=LANGUAGE_SAMPLE_WINDOWS):
+    """Ventanas de hasta 30 s repartidas por el archivo, reducidas a la voz que contienen"""
+    span = max(duration - LANGUAGE_WINDOW_SECONDS, 0.0)
+    # Un archivo corto no da para varias ventanas distintas
+    windows = max(1, min(windows, math.ceil(duration / LANGUAGE_WINDOW_SECONDS)))
+    for i in range(windows):
+        start = span * (i + 1) / (windows + 1)
+        audio = decode_audio(audio_path, start=start, duration=LANGUAGE_WINDOW_SECONDS)
+        regions = detect_speech_regions(audio)
+        speech = np.concatenate([audio[a:b] for a, b in regions]) if regions else audio[:0]
+        # Menos de un segundo de voz no da una detección fiable
+        if len(speech) >= SAMPLE_RATE:
+            yield speech
+
+def language_probabilities(model, audio):
+    """Probabilidad por código de idioma para una ventana de hasta 30 s"""
+    if not model.is_multilingual:
+        return {'en': 1.0}
+    if isinstance(model, FasterWhisperModel):
+        return model.language_probabilities(audio)
+    whisper = lazy_import('whisper')
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels).to(model.device)
+    with inference_lock(model):
+        _, probs = model.detect_language(mel)
+    return probs
+
+def _pool_language_probabilities(windows, model_name=None):
+    """Tarea del pool: detección de idioma con la réplica del modelo del proceso"""
+    m = load_whisper_model(model_name)
+    return [language_probabilities(m, w) for w in windows]
+
+def identify_language(audio_path, duration, model=None, pool=None, model_name=None):
+    """Detectar el idioma de un archivo una sola vez.
+
+    Promedia las probabilidades de las ventanas muestreadas ponderando por segundos de
+    voz. Devuelve {'language', 'confidence', 'candidates', 'windows'} o None si no
+    se conoce la duración o no hay voz suficiente.
+    """
+    if not duration:
+        return None
+    windows = list(sample_speech_windows(audio_path, duration))
+    if not windows:
+        return None
+    if pool is not None:
+        probs_list = pool.submit(_pool_language_probabilities, windows, model_name).result()
+    else:
+        probs_list = [language_probabilities(model, w) for w in windows]
+    totals = collections.Counter()
+    for window, probs in zip(windows, probs_list):
+        for code, p in probs.items():
+            totals[code] += p * len(window)
+    weight = sum(len(w) for w in windows)
+    ranked = [(code, round(p / weight, 4)) for code, p in totals.most_common(3)]
+    return {
+        'language': ranked[0][0],
+        'confidence': ranked[0][1],
+        'candidates': dict(ranked),
+        'windows': len(windows)
+    }
+
+def transcribe_audio(audio_path, language='spanish', progress_callback=None, stats=None, model_name=None,
+                     segment_callback=None, duration_hint=None):
     """Transcribir archivo de audio usando Whisper.
 
     language: idioma forzado (si es 'auto' se deja que Whisper detecte).
     progress_callback: función opcional progress_callback(percentage:int, meta:dict)
+    stats: dict opcional que se completa con duración, chunks, pico de RSS (MB) y modelo usado
+    model_name: modelo Whisper a usar (por defecto WHISPER_MODEL)
+    segment_callback: función opcional segment_callback(first_index:int, segments:list) llamada con
+        los segmentos que ya son definitivos (el solapamiento con el chunk siguiente no los cambiará)
+    duration_hint: duración ya conocida (p. ej. medida al recibir la subida) para no volver a sondear
+
+    Los tiempos por etapa (model_load, decode, vad, inference, merge) se suman en stats['timings']
+    y la inferencia de cada chunk en stats['chunk_inference_seconds'].
     """
     try:
         # Verificar que el archivo existe
@@ -182,15 +1607,23 @@ def transcribe_audio(audio_path, language='spanish', progress_callback=None):
         
         logger.info(f"Iniciando transcripción de: {audio_path}")
         
-        # Verificar si es un archivo WAV (formato nativo soportado)
+        # Extensión solo informativa: FFmpeg decodifica todos los formatos permitidos
         file_ext = os.path.splitext(audio_path)[1].lower()
         
-        # Cargar modelo ahora (lazy)
-        active_model = load_whisper_model()
+        # Con pool de procesos la inferencia ocurre en los workers (cada uno con su modelo);
+        # sin pool se carga el modelo en este proceso (lazy)
+        timings = {}
+        chunk_inference = []
+        detected = None
+        pool = get_transcription_pool()
+        with timed_stage(timings, 'model_load'):
+            active_model = load_whisper_model(model_name) if pool is None else None
+        engine = get_batch_engine()
 
-        # Opciones comunes Whisper (forzamos español)
+        # Opciones comunes Whisper (forzamos español). fp16 solo tiene sentido en GPU
+        # con pesos torch; en CPU Whisper lo desactiva igualmente con un aviso.
         base_options = {
-            "fp16": False,
+            "fp16": _default_device().startswith('cuda') and whisper_backend() in ('torch', 'compile'),
             "task": "transcribe",
             "verbose": False,
             "temperature": 0.0,
@@ -207,129 +1640,210 @@ def transcribe_audio(audio_path, language='spanish', progress_callback=None):
         except ValueError:
             CHUNK_SECONDS = 0
 
-        def _transcribe_wav_internal(wav_path):
-            return active_model.transcribe(wav_path, **base_options)
+        if 'language' not in base_options and LANGUAGE_DETECTION == 'file':
+            # Detección única por archivo; el idioma elegido se fija para todos los chunks.
+            # Sin chunking y con una sola ventana de 30 s, Whisper ya detecta una sola vez.
+            if not duration_hint:
+                duration_hint = probe_duration(audio_path)
+            if CHUNK_SECONDS > 0 or (duration_hint or 0) > LANGUAGE_WINDOW_SECONDS:
+                with timed_stage(timings, 'language_id'):
+                    detected = identify_language(audio_path, duration_hint, active_model, pool, model_name)
+            if detected:
+                detected['pinned'] = detected['confidence'] >= LANGUAGE_MIN_CONFIDENCE
+                if detected['pinned']:
+                    base_options["language"] = detected['language']
+                logger.info(
+                    f"Idioma detectado: {detected['language']} (confianza {detected['confidence']:.2f}, "
+                    f"{detected['windows']} ventanas){'' if detected['pinned'] else ' - sin fijar, detección por chunk'}"
+                )
 
-        if file_ext == '.wav':
-            # Archivo WAV: usar directamente
-            logger.info("Archivo WAV detectado, procesando directamente")
-            
-            # Si chunking está activado y el archivo es largo, dividir
+        with PeakRssMonitor() as rss:
             if CHUNK_SECONDS > 0:
-                try:
-                    from pydub import AudioSegment
-                    seg_audio = AudioSegment.from_wav(audio_path)
-                    duration_sec = len(seg_audio) / 1000.0
-                    if duration_sec > CHUNK_SECONDS:
-                        logger.info(f"Aplicando chunking: duración {duration_sec:.1f}s > {CHUNK_SECONDS}s")
-                        texts = []
-                        segments_all = []
-                        start_ms = 0
-                        idx = 0
-                        total_chunks = int((len(seg_audio) + (CHUNK_SECONDS*1000 - 1)) // (CHUNK_SECONDS*1000)) or 1
-                        while start_ms < len(seg_audio):
-                            end_ms = min(start_ms + CHUNK_SECONDS * 1000, len(seg_audio))
-                            chunk = seg_audio[start_ms:end_ms]
-                            temp_chunk = audio_path.replace('.wav', f'_chunk{idx}.wav')
-                            chunk.export(temp_chunk, format='wav')
-                            logger.info(f"Transcribiendo chunk {idx} ({start_ms/1000:.1f}-{end_ms/1000:.1f}s)...")
-                            partial = _transcribe_wav_internal(temp_chunk)
-                            texts.append(partial.get('text',''))
-                            segs = partial.get('segments', [])
-                            # Ajustar tiempos sumando offset
-                            for s in segs:
-                                if 'start' in s:
-                                    s['start'] += start_ms/1000.0
-                                if 'end' in s:
-                                    s['end'] += start_ms/1000.0
-                            segments_all.extend(segs)
-                            try:
-                                os.remove(temp_chunk)
-                            except: pass
-                            start_ms = end_ms
-                            if progress_callback:
-                                try:
-                                    percentage = int(((idx + 1) / total_chunks) * 100)
-                                    progress_callback(min(percentage, 99), {"chunk": idx+1, "total_chunks": total_chunks})
-                                except Exception:
-                                    pass
-                            idx += 1
-                        result = {"text": '\n'.join(texts), "segments": segments_all}
-                    else:
-                        result = _transcribe_wav_internal(audio_path)
-                except ImportError:
-                    logger.warning("Chunking requiere pydub instalado. Continuando sin dividir.")
-                    result = _transcribe_wav_internal(audio_path)
-                except Exception as ce:
-                    logger.warning(f"Fallo chunking ({ce}); usando transcripción directa.")
-                    result = _transcribe_wav_internal(audio_path)
-            else:
-                result = _transcribe_wav_internal(audio_path)
-            
-        else:
-            # Para otros formatos, intentar conversión usando pydub si está disponible
-            logger.info(f"Archivo {file_ext} detectado, intentando conversión")
-            
-            try:
-                import pydub
-                from pydub import AudioSegment
-                
-                # Cargar archivo con pydub
-                audio = AudioSegment.from_file(audio_path)
-                
-                # Convertir a WAV temporal
-                temp_wav = audio_path.replace(file_ext, '_temp.wav')
-                audio.export(temp_wav, format="wav")
-                
-                logger.info(f"Archivo convertido a WAV temporal: {temp_wav}")
-                
-                # Transcribir el archivo WAV con español
-                result = active_model.transcribe(temp_wav, **base_options)
-                
-                # Limpiar archivo temporal
-                try:
-                    os.remove(temp_wav)
-                    logger.info("Archivo WAV temporal eliminado")
-                except:
-                    pass
-                    
-            except ImportError:
-                logger.warning("pydub no está disponible, intentando conversión con FFmpeg")
-                
-                # Intentar conversión usando FFmpeg directamente
-                try:
-                    import subprocess
-                    temp_wav = audio_path.replace(file_ext, '_temp.wav')
-                    
-                    # Intentar con ffmpeg si está disponible
-                    try:
-                        cmd = ['ffmpeg', '-i', audio_path, '-ar', '16000', '-ac', '1', '-y', temp_wav]
-                        subprocess.run(cmd, capture_output=True, check=True)
-                        logger.info(f"Archivo convertido con FFmpeg: {temp_wav}")
-                        
-                        # Transcribir el archivo WAV con español
-                        result = active_model.transcribe(temp_wav, **base_options)
-                        
-                        # Limpiar archivo temporal
+                # Chunking en streaming: los chunks se leen del pipe de FFmpeg y se
+                # transcriben a medida que llegan. Cada chunk se solapa con el anterior
+                # y se corta en el punto más silencioso antes del límite.
+                overlap_seconds = _env_float("CHUNK_OVERLAP_SECONDS", 2.0)
+                search_seconds = _env_float("CHUNK_SEARCH_SECONDS", 5.0)
+                use_context = os.environ.get("CHUNK_PROMPT_CONTEXT", "1") == "1"
+                logger.info(
+                    f"Archivo {file_ext} detectado, chunking en streaming de {CHUNK_SECONDS}s "
+                    f"(solapamiento {overlap_seconds}s, búsqueda de silencio {search_seconds}s antes del límite)"
+                )
+                if not duration_hint:
+                    duration_hint = probe_duration(audio_path)
+                effective_overlap = min(overlap_seconds, CHUNK_SECONDS / 4)
+                step = CHUNK_SECONDS - effective_overlap
+                total_chunks = max(1, math.ceil((duration_hint - effective_overlap) / step)) if duration_hint else None
+                segments_all = []
+                total_samples = 0
+                state = {'done': 0, 'prev_end': 0.0, 'published': 0, 'vad_skipped': 0.0}
+
+                def _publish(until=None):
+                    # Publicar segmentos definitivos: los que terminan antes de la zona de
+                    # solapamiento del siguiente chunk ya no pueden ser recortados al fusionar
+                    if not segment_callback:
+                        return
+                    first = state['published']
+                    last = first
+                    while last < len(segments_all) and (
+                        until is None
+                        or (segments_all[last].get('start', 0.0) + segments_all[last].get('end', 0.0)) / 2 < until
+                    ):
+                        last += 1
+                    if last > first:
+                        for i in range(first, last):
+                            segments_all[i]['id'] = i
+                        try:
+                            segment_callback(first, segments_all[first:last])
+                        except Exception as e:
+                            logger.warning(f"Error publicando segmentos parciales: {e}")
+                        state['published'] = last
+
+                def _accept(chunk_idx, offset, chunk_end, partial, vad_mapping=None):
+                    if partial.get('inference_seconds') is not None:
+                        chunk_inference.append(partial['inference_seconds'])
+                        timings['inference'] = round(timings.get('inference', 0.0) + partial['inference_seconds'], 4)
+                    segs = remap_segments(partial.get('segments', []), vad_mapping)
+                    # Ajustar tiempos sumando offset
+                    for s in segs:
+                        if 'start' in s:
+                            s['start'] += offset
+                        if 'end' in s:
+                            s['end'] += offset
+                        s['chunk'] = chunk_idx
+                    with timed_stage(timings, 'merge'):
+                        merge_chunk_segments(segments_all, segs, offset, state['prev_end'])
+                    state['prev_end'] = chunk_end
+                    state['done'] += 1
+                    _publish(until=chunk_end - effective_overlap)
+                    if progress_callback:
                         try:
-                            os.remove(temp_wav)
-                            logger.info("Archivo WAV temporal eliminado")
-                        except:
+                            done = state['done']
+                            # La duración sondeada puede ser inexacta: nunca superar el número real de chunks
+                            expected = max(total_chunks or done + 1, done)
+                            percentage = int((done / expected) * 100)
+                            progress_callback(min(percentage, 99), {
+                                "chunk": done,
+                                "total_chunks": total_chunks,
+                                "peak_rss_mb": rss.peak_mb,
+                                # Texto aceptado de este chunk, para mostrarlo en vivo
+                                "partial_text": _segments_to_text(
+                                    [s for s in segments_all if s.get('chunk') == chunk_idx]
+                                )
+                            })
+                        except Exception:
                             pass
-                            
-                    except (subprocess.CalledProcessError, FileNotFoundError):
-                        logger.warning("FFmpeg no disponible, intentando transcripción directa")
-                        
-                        # Intentar transcripción directa en español
-                        result = active_model.transcribe(audio_path, **base_options)
-                        
-                except Exception as direct_error:
-                    logger.error(f"Error en transcripción: {direct_error}")
-                    raise Exception(
-                        f"No se pudo procesar el archivo {file_ext}. "
-                        f"Whisper con FFmpeg puede manejar la mayoría de formatos directamente. "
-                        f"Error específico: {str(direct_error)}"
-                    )
+
+                # En modo pool los chunks se envían a los procesos y se reensamblan en orden;
+                # se limita el número en vuelo para mantener la memoria acotada.
+                # Con el motor de lotes los chunks cortos también se envían sin esperar,
+                # para que sus ventanas compartan paso del encoder.
+                in_flight = collections.deque()
+                max_in_flight = 2 * _pool_size() if pool is not None else max(1, 2 * BATCH_MAX_SIZE)
+                sequential = pool is None and engine is None
+                idx = 0
+                chunks = _timed_iter(
+                    iter_audio_chunks(audio_path, CHUNK_SECONDS, overlap_seconds, search_seconds), timings, 'decode'
+                )
+                for start, chunk_audio in chunks:
+                    offset = start / SAMPLE_RATE
+                    chunk_end = (start + len(chunk_audio)) / SAMPLE_RATE
+                    vad_mapping = None
+                    if VAD_ENABLED:
+                        with timed_stage(timings, 'vad'):
+                            chunk_audio, vad_mapping, skipped = vad_compact(chunk_audio, counted_from=max(0, total_samples - start))
+                        state['vad_skipped'] += skipped
+                    total_samples = max(total_samples, int(chunk_end * SAMPLE_RATE))
+                    logger.info(f"Transcribiendo chunk {idx} ({offset:.1f}-{chunk_end:.1f}s)...")
+                    options = dict(base_options)
+                    if len(chunk_audio) == 0:
+                        # Chunk sin voz: no se invoca a Whisper
+                        empty = Future()
+                        empty.set_result({'text': '', 'segments': []})
+                        in_flight.append((idx, offset, chunk_end, empty, None))
+                    elif engine is not None and len(chunk_audio) <= BATCH_WINDOW_SAMPLES:
+                        in_flight.append((idx, offset, chunk_end, engine.submit(chunk_audio, options, model_name), vad_mapping))
+                    elif pool is None:
+                        # Respetar el orden: aceptar antes los chunks ya enviados al motor de lotes
+                        while in_flight:
+                            chunk_idx, c_offset, c_end, future, c_mapping = in_flight.popleft()
+                            _accept(chunk_idx, c_offset, c_end, future.result(), c_mapping)
+                        if use_context and segments_all:
+                            # Contexto: final del texto ya aceptado como prompt del chunk siguiente
+                            options["initial_prompt"] = _segments_to_text(segments_all[-8:])[-200:]
+                        chunk_started = time.perf_counter()
+                        with inference_lock(active_model):
+                            partial = active_model.transcribe(chunk_audio, **options)
+                        partial['inference_seconds'] = round(time.perf_counter() - chunk_started, 4)
+                        _accept(idx, offset, chunk_end, partial, vad_mapping)
+                    else:
+                        # Sin contexto previo: los chunks se transcriben en paralelo
+                        in_flight.append((idx, offset, chunk_end, pool.submit(_pool_transcribe, chunk_audio, options, model_name), vad_mapping))
+                    while in_flight and (len(in_flight) >= max_in_flight or sequential):
+                        chunk_idx, c_offset, c_end, future, c_mapping = in_flight.popleft()
+                        _accept(chunk_idx, c_offset, c_end, future.result(), c_mapping)
+                    idx += 1
+                while in_flight:
+                    chunk_idx, c_offset, c_end, future, c_mapping = in_flight.popleft()
+                    _accept(chunk_idx, c_offset, c_end, future.result(), c_mapping)
+                for i, s in enumerate(segments_all):
+                    s['id'] = i
+                _publish()
+                result = {"text": _segments_to_text(segments_all), "segments": segments_all}
+                duration_sec = total_samples / SAMPLE_RATE
+                chunks_processed = idx
+                vad_skipped = state['vad_skipped']
+            else:
+                # Decodificación única con FFmpeg -> array float32 a 16 kHz (cualquier formato).
+                # Whisper acepta el array directamente, así que no se generan WAV temporales.
+                logger.info(f"Archivo {file_ext} detectado, decodificando con FFmpeg a PCM 16 kHz")
+                with timed_stage(timings, 'decode'):
+                    audio = decode_audio(audio_path)
+                duration_sec = len(audio) / SAMPLE_RATE
+                logger.info(f"Audio decodificado: {duration_sec:.1f}s ({audio.nbytes} bytes en memoria)")
+                vad_mapping = None
+                vad_skipped = 0.0
+                if VAD_ENABLED:
+                    with timed_stage(timings, 'vad'):
+                        audio, vad_mapping, vad_skipped = vad_compact(audio)
+                inference_started = time.perf_counter()
+                if len(audio) == 0:
+                    result = {'text': '', 'segments': []}
+                elif engine is not None and len(audio) <= BATCH_WINDOW_SAMPLES:
+                    # Notas de voz cortas: una ventana que se agrupa con las de otras peticiones
+                    result = engine.submit(audio, base_options, model_name).result()
+                elif pool is None:
+                    with inference_lock(active_model):
+                        result = active_model.transcribe(audio, **base_options)
+                else:
+                    result = pool.submit(_pool_transcribe, audio, base_options, model_name).result()
+                timings['inference'] = round(time.perf_counter() - inference_started, 4)
+                chunk_inference.append(timings['inference'])
+                remap_segments(result.get('segments', []), vad_mapping)
+                del audio
+                chunks_processed = 1
+                if detected is None and 'language' not in base_options and result.get('language'):
+                    # Archivo de una sola ventana: la detección de Whisper ya fue única
+                    detected = {'language': result['language'], 'confidence': None, 'windows': 1, 'pinned': True}
+                if segment_callback and result.get('segments'):
+                    segment_callback(0, result['segments'])
+
+        logger.info(f"Pico de memoria residente durante la transcripción: {rss.peak_mb} MB")
+        if VAD_ENABLED:
+            logger.info(f"VAD: {vad_skipped:.1f}s de {duration_sec:.1f}s sin voz omitidos")
+        if stats is not None:
+            stats.update({
+                'audio_duration': round(duration_sec, 2),
+                'chunks': chunks_processed,
+                'peak_rss_mb': rss.peak_mb,
+                'model': resolve_model_name(model_name)
+            })
+            if VAD_ENABLED:
+                stats['vad_skipped_seconds'] = round(vad_skipped, 2)
+            if detected:
+                stats['language_detected'] = detected
+            stats.setdefault('timings', {}).update(timings)
+            stats['chunk_inference_seconds'] = chunk_inference
         
         if not result or "text" not in result:
             raise ValueError("La transcripción no produjo resultados válidos")
@@ -352,6 +1866,8 @@ def transcribe_audio(audio_path, language='spanish', progress_callback=None):
     except Exception as e:
         logger.error(f"Error en transcripción: {str(e)}")
         logger.error(f"Tipo de error: {type(e).__name__}")
+        if isinstance(e, BrokenProcessPool):
+            _reset_transcription_pool()
         
         # Información adicional para debug
         if os.path.exists(audio_path):
@@ -362,80 +1878,818 @@ def transcribe_audio(audio_path, language='spanish', progress_callback=None):
             
         raise e
 
-def create_pdf_with_reportlab(text, output_path, metadata=None):
-    """Crear PDF usando ReportLab"""
-    try:
-        doc = SimpleDocTemplate(output_path, pagesize=letter)
-        styles = getSampleStyleSheet()
-        
-        # Crear estilos personalizados
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
+#############################################
+# INGESTA DE SUBIDAS EN STREAMING           #
+#############################################
+# Werkzeug acumula cada parte multipart en un archivo temporal antes de que la ruta
+# la vea; después había que copiarla a UPLOAD_FOLDER y volver a leerla para el hash.
+# Aquí el cuerpo se escribe directamente en UPLOAD_FOLDER en bloques grandes mientras
+# se calcula el SHA-256 y se comprueban los primeros bytes, de modo que un archivo que
+# no es audio/vídeo se rechaza (415) sin esperar a que termine de subir.
+# Para archivos muy grandes hay subidas reanudables: POST /uploads, PUT /uploads/<id>
+# con Content-Range y después `upload_id` en /transcribe o /transcribe_async.
+
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+UPLOAD_SNIFF = os.environ.get("UPLOAD_SNIFF", "1") == "1"
+SNIFF_BYTES = 16
+
+def sniff_container(head):
+    """Contenedor reconocido por sus bytes mágicos (None si no parece audio/vídeo)"""
+    if head[:3] == b'ID3':
+        return 'mp3'
+    if head[:4] == b'RIFF' and head[8:12] in (b'WAVE', b'AVI '):
+        return 'wav' if head[8:12] == b'WAVE' else 'avi'
+    # WAV de 64 bits (grabadoras y estaciones de radio para archivos de más de 4 GB)
+    if head[:4] in (b'RF64', b'BW64') and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[4:8] == b'ftyp':
+        return 'mp4'
+    # QuickTime antiguo: el .mov puede empezar directamente por otro átomo, sin ftyp
+    if head[4:8] in (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'):
+        return 'mov'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'matroska'
+    if head[:4] == b'\x30\x26\xb2\x75':
+        return 'asf'
+    # Sincronía de trama MPEG (MP3 sin ID3) o ADTS (AAC crudo)
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0:
+        return 'mpeg' if (head[1] & 0x06) else 'aac'
+    # Zip de un lote (/batches); en las rutas de un solo archivo lo rechaza la extensión
+    if head[:4] == b'PK\x03\x04':
+        return 'zip'
+    return None
+
+class HashingUploadFile:
+    """Destino de una parte multipart: escribe en disco, calcula SHA-256 y valida la cabecera"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{uuid.uuid4().hex}.part")
+        self._file = open(self.path, 'w+b')
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self.size = 0
+        self.container = None
+
+    def write(self, data):
+        if len(self._head) < SNIFF_BYTES:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+            if len(self._head) >= SNIFF_BYTES:
+                self._check_head()
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def _check_head(self):
+        self.container = sniff_container(self._head)
+        if self.container is None and UPLOAD_SNIFF:
+            self.discard()
+            raise UnsupportedMediaType('El archivo no parece audio ni vídeo (cabecera no reconocida)')
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        return self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def commit(self, target_path):
+        """Mover el archivo recibido a su ruta definitiva (sin copiar) y devolver (tamaño, sha256)"""
+        if self.size < SNIFF_BYTES:
+            self._check_head()
+        self._file.close()
+        os.replace(self.path, target_path)
+        self.path = None
+        return self.size, self.hexdigest()
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+class StreamingUploadRequest(Request):
+    """Request cuyas partes de archivo se escriben directamente en UPLOAD_FOLDER"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = HashingUploadFile(app.config['UPLOAD_FOLDER'])
+        if not hasattr(self, '_upload_files'):
+            self._upload_files = []
+        self._upload_files.append(upload)
+        return upload
+
+app.request_class = StreamingUploadRequest
+
+@app.teardown_request
+def _discard_uploads(exc=None):
+    # Partes recibidas pero no usadas por la ruta (error, validación fallida...)
+    for upload in getattr(request, '_upload_files', []):
+        upload.discard()
+
+def save_upload(file_storage, path):
+    """Guardar un archivo subido calculando su SHA-256 al vuelo.
+
+    Si la parte ya se recibió en streaming solo se renombra; si no, se copia en bloques.
+    Devuelve (tamaño_en_bytes, hash_hex) sin volver a leer el archivo del disco.
+    """
+    if isinstance(file_storage.stream, HashingUploadFile):
+        return file_storage.stream.commit(path)
+    return copy_hashed(file_storage.stream, path)
+
+def copy_hashed(stream, path):
+    """Copiar `stream` a `path` en bloques; devuelve (tamaño_en_bytes, hash_hex)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as out:
+        while True:
+            block = stream.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
+def probe_media(audio_path):
+    """Sondear solo la cabecera: duración, contenedor y códec de la primera pista de audio.
+
+    Devuelve None si FFmpeg no encuentra ninguna pista de audio decodificable.
+    """
+    try:
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration,format_name:stream=codec_name,codec_type',
+             '-of', 'json', audio_path],
+            capture_output=True, check=True, text=True
+        ).stdout
+        info = json.loads(out)
+        audio = [s for s in info.get('streams', []) if s.get('codec_type') == 'audio']
+        if not audio:
+            return None
+        duration = info.get('format', {}).get('duration')
+        return {
+            'duration': float(duration) if duration else None,
+            'container': info.get('format', {}).get('format_name'),
+            'codec': audio[0].get('codec_name')
+        }
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        pass
+    try:
+        info = subprocess.run(['ffmpeg', '-nostdin', '-i', audio_path], capture_output=True, text=True).stderr
+    except FileNotFoundError:
+        # Sin FFmpeg no se puede validar aquí; la transcripción dará el error
+        return {'duration': probe_duration(audio_path), 'container': None, 'codec': None}
+    codec = re.search(r"Stream #.*?Audio:\s*([\w-]+)", info)
+    if not codec:
+        return None
+    container = re.search(r"Input #0,\s*([^,]+(?:,[^,\s]+)*),\s*from", info)
+    duration = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", info)
+    return {
+        'duration': int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3)) if duration else None,
+        'container': container.group(1) if container else None,
+        'codec': codec.group(1)
+    }
+
+class UploadError(Exception):
+    """Subida rechazada; `status` es el código HTTP a devolver"""
+
+    def __init__(self, message, status=400, extra=None):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra or {}
+
+    def response(self):
+        return jsonify({'error': str(self), **self.extra}), self.status
+
+##### Subidas reanudables #####
+# El estado vive en disco (<id>.part + <id>.json) para que cualquier worker de gunicorn
+# pueda continuar una subida. El hash se actualiza en memoria mientras los bloques llegan
+# en orden al mismo proceso; si no (reinicio u otro worker) se recalcula al finalizar.
+
+RESUMABLE_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+_resumable_hashers = {}
+_resumable_writers = set()
+_resumable_lock = threading.Lock()
+
+def _resumable_paths(upload_id):
+    if not RESUMABLE_UPLOAD_ID.match(upload_id or ''):
+        raise UploadError('upload_id inválido', 400)
+    base = os.path.join(app.config['UPLOAD_FOLDER'], upload_id)
+    return base + '.part', base + '.json'
+
+def resumable_info(upload_id):
+    part_path, meta_path = _resumable_paths(upload_id)
+    if not os.path.exists(meta_path):
+        raise UploadError('Subida no encontrada', 404)
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    meta['offset'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    meta['complete'] = meta.get('size') is not None and meta['offset'] >= meta['size']
+    return meta
+
+@contextlib.contextmanager
+def _resumable_writer(upload_id, out):
+    """Un solo escritor por subida: por id dentro del proceso y con flock entre workers.
+
+    Si otra petición ya está escribiendo se responde 409 en lugar de esperarla.
+    """
+    with _resumable_lock:
+        registered = upload_id not in _resumable_writers
+        if registered:
+            _resumable_writers.add(upload_id)
+    try:
+        busy = not registered
+        if registered and fcntl is not None:
+            try:
+                # Se libera al cerrar `out`
+                fcntl.flock(out.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                busy = True
+        if busy:
+            raise UploadError('Otra petición está enviando esta subida', 409,
+                              {'offset': os.fstat(out.fileno()).st_size})
+        yield
+    finally:
+        if registered:
+            with _resumable_lock:
+                _resumable_writers.discard(upload_id)
+
+def _resumable_sniff(upload_id, head):
+    """Rechazar (y borrar) la subida si su cabecera no parece audio ni vídeo"""
+    if UPLOAD_SNIFF and sniff_container(head) is None:
+        resumable_delete(upload_id)
+        raise UploadError('El archivo no parece audio ni vídeo (cabecera no reconocida)', 415)
+
+def resumable_append(upload_id, start, total, stream):
+    """Añadir bytes desde `start`; solo se acepta continuar exactamente donde quedó la subida"""
+    part_path, meta_path = _resumable_paths(upload_id)
+    meta = resumable_info(upload_id)
+    limit = app.config['MAX_CONTENT_LENGTH']
+    # O_APPEND y el candado del escritor: el offset se vuelve a leer ya con el candado,
+    # así dos peticiones con el mismo Content-Range no pueden escribir las dos
+    with open(part_path, 'ab') as out, _resumable_writer(upload_id, out):
+        offset = os.fstat(out.fileno()).st_size
+        if start != offset:
+            raise UploadError('El bloque no continúa la subida', 409, {'offset': offset})
+        if total is not None:
+            if meta.get('size') is None:
+                meta['size'] = total
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({k: v for k, v in meta.items() if k not in ('offset', 'complete')}, f)
+            elif meta['size'] != total:
+                raise UploadError('El tamaño total no coincide con el declarado', 400)
+        with _resumable_lock:
+            offset, digest = _resumable_hashers.get(upload_id, (None, None))
+            if offset != start:
+                digest = hashlib.sha256() if start == 0 else None
+        # La cabecera se sondea sobre lo acumulado, aunque llegue en bloques muy pequeños
+        head = b''
+        if start < SNIFF_BYTES:
+            with open(part_path, 'rb') as f:
+                head = f.read(start)
+        written = 0
+        while True:
+            block = stream.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            if len(head) < SNIFF_BYTES:
+                head += block[:SNIFF_BYTES - len(head)]
+                if len(head) >= SNIFF_BYTES:
+                    _resumable_sniff(upload_id, head)
+            if start + written + len(block) > (meta.get('size') or limit):
+                raise UploadError('El bloque supera el tamaño declarado de la subida', 413)
+            out.write(block)
+            if digest is not None:
+                digest.update(block)
+            written += len(block)
+        with _resumable_lock:
+            if digest is not None:
+                _resumable_hashers[upload_id] = (start + written, digest)
+            else:
+                _resumable_hashers.pop(upload_id, None)
+    return start + written
+
+def resumable_create(filename, size=None):
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = _resumable_paths(upload_id)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'id': upload_id, 'filename': filename, 'size': size,
+                   'created_at': datetime.datetime.utcnow().isoformat()}, f)
+    return upload_id
+
+def resumable_delete(upload_id):
+    for path in _resumable_paths(upload_id):
+        if os.path.exists(path):
+            os.remove(path)
+    with _resumable_lock:
+        _resumable_hashers.pop(upload_id, None)
+
+def resumable_commit(upload_id, target_path):
+    """Mover una subida completa a su ruta definitiva y devolver (tamaño, sha256)"""
+    meta = resumable_info(upload_id)
+    if not meta['complete']:
+        raise UploadError('La subida no está completa', 409, {'offset': meta['offset'], 'size': meta.get('size')})
+    part_path, meta_path = _resumable_paths(upload_id)
+    if meta['offset'] < SNIFF_BYTES:
+        # Archivo más corto que la cabecera: no se sondeó mientras llegaba
+        with open(part_path, 'rb') as f:
+            _resumable_sniff(upload_id, f.read())
+    with _resumable_lock:
+        offset, digest = _resumable_hashers.pop(upload_id, (None, None))
+    if digest is None or offset != meta['offset']:
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(UPLOAD_BLOCK_SIZE), b''):
+                digest.update(block)
+    os.replace(part_path, target_path)
+    os.remove(meta_path)
+    return meta['offset'], digest.hexdigest()
+
+def receive_audio():
+    """Recibir el audio de la petición (archivo multipart o `upload_id` reanudable).
+
+    Lo deja en UPLOAD_FOLDER y sondea su cabecera una sola vez. Devuelve
+    (input_path, filename, timestamp, size, sha256, media) o lanza UploadError.
+    """
+    upload_id = request.form.get('upload_id')
+    if upload_id:
+        filename = secure_filename(resumable_info(upload_id).get('filename') or '')
+    else:
+        if 'audio' not in request.files:
+            raise UploadError('No se encontró archivo de audio')
+        file = request.files['audio']
+        if file.filename == '':
+            raise UploadError('No se seleccionó archivo')
+        filename = secure_filename(file.filename)
+    if not allowed_file(filename):
+        raise UploadError('Formato de archivo no soportado', 400, {'supported_formats': list(ALLOWED_EXTENSIONS)})
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    input_path = unique_input_path(timestamp, filename)
+    if upload_id:
+        size, audio_hash = resumable_commit(upload_id, input_path)
+    else:
+        size, audio_hash = save_upload(file, input_path)
+    media = accept_media(input_path, size, audio_hash)
+    return input_path, filename, timestamp, size, audio_hash, media
+
+def unique_input_path(timestamp, filename):
+    """Ruta de entrada en UPLOAD_FOLDER; el sufijo aleatorio evita que dos subidas del
+    mismo nombre en el mismo segundo compartan archivo"""
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp}_{uuid.uuid4().hex[:8]}_{filename}")
+
+def accept_media(input_path, size, audio_hash):
+    """Sondear un archivo ya guardado; lo borra y lanza UploadError si no tiene audio"""
+    media = probe_media(input_path)
+    if media is None:
+        os.remove(input_path)
+        raise UploadError('El archivo no contiene una pista de audio decodificable', 415)
+    logger.info(
+        f"Archivo recibido: {input_path} ({size} bytes, sha256 {audio_hash[:12]}, "
+        f"{media.get('container')}/{media.get('codec')}, {media.get('duration')}s)"
+    )
+    return media
+
+#############################################
+# CACHÉ DE TRANSCRIPCIONES POR CONTENIDO    #
+#############################################
+# Clave: hash SHA-256 de los bytes subidos + modelo + idioma + opciones de decodificación.
+# Se guarda texto y segmentos en CACHE_FOLDER; al superar TRANSCRIPT_CACHE_MB se
+# eliminan las entradas menos usadas recientemente (mtime se actualiza en cada acierto).
+
+def decoding_fingerprint(language, model_name):
+    """Opciones que afectan al resultado de la transcripción (parte de la clave de caché)"""
+    return {
+        'model': resolve_model_name(model_name),
+        'backend': whisper_backend(),
+        'language': (language or 'auto').lower(),
+        'chunk_seconds': os.environ.get("CHUNK_SECONDS", "0"),
+        'chunk_overlap': os.environ.get("CHUNK_OVERLAP_SECONDS", "2.0"),
+        'chunk_search': os.environ.get("CHUNK_SEARCH_SECONDS", "5.0"),
+        'chunk_context': os.environ.get("CHUNK_PROMPT_CONTEXT", "1"),
+        # Los chunks en paralelo no usan contexto previo, así que el resultado difiere
+        'parallel': _pool_size() > 0,
+        # Las ventanas por lotes se decodifican sin el avance por timestamps de model.transcribe
+        'batched': get_batch_engine() is not None,
+        'vad': [VAD_MARGIN_DB, VAD_FLOOR_DB, VAD_MIN_SPEECH_MS, VAD_MIN_SILENCE_MS, VAD_PAD_MS] if VAD_ENABLED else None,
+        # En auto, fijar el idioma por archivo o detectarlo por chunk da resultados distintos
+        'language_detection': [LANGUAGE_DETECTION, LANGUAGE_SAMPLE_WINDOWS, LANGUAGE_MIN_CONFIDENCE]
+        if (language or 'auto').lower() == 'auto' else None,
+    }
+
+class TranscriptCache:
+    """Caché persistente en disco de resultados de transcripción con expulsión LRU por tamaño"""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(folder, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(audio_hash, fingerprint):
+        payload = json.dumps(fingerprint, sort_keys=True)
+        return hashlib.sha256(f"{audio_hash}|{payload}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json.gz")
+
+    def contains(self, key):
+        """Si hay entrada para `key` (sin leerla ni contar acierto)"""
+        return self.enabled and os.path.exists(self._path(key))
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+            os.utime(path)  # marcar como usado recientemente
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, text, segments, language=None):
+        if not self.enabled:
+            return
+        data = {'text': text, 'segments': compact_segments(segments), 'language': language}
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"[Caché] No se pudo guardar la entrada {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json.gz'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        entries = self._entries() if self.enabled else []
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(entries),
+            'size_mb': round(sum(size for _, size, _ in entries) / (1024 * 1024), 2),
+            'max_mb': round(self.max_bytes / (1024 * 1024))
+        }
+
+transcript_cache = TranscriptCache(
+    app.config['CACHE_FOLDER'],
+    int(_env_float("TRANSCRIPT_CACHE_MB", 512) * 1024 * 1024)
+)
+
+def transcribe_cached(audio_path, language, audio_hash=None, progress_callback=None, stats=None, model_name=None,
+                      segment_callback=None, duration_hint=None):
+    """transcribe_audio con caché por contenido: un acierto evita la inferencia por completo"""
+    key = None
+    if audio_hash and transcript_cache.enabled:
+        lookup_started = time.perf_counter()
+        key = TranscriptCache.make_key(audio_hash, decoding_fingerprint(language, model_name))
+        cached = transcript_cache.get(key)
+        metrics.inc('transcribe_cache_requests_total', result='hit' if cached is not None else 'miss')
+        if stats is not None:
+            stats.setdefault('timings', {})['cache_lookup'] = round(time.perf_counter() - lookup_started, 4)
+        if cached is not None:
+            logger.info(f"[Caché] Acierto para {os.path.basename(audio_path)} ({audio_hash[:12]})")
+            if stats is not None:
+                stats['cache_hit'] = True
+                stats['model'] = resolve_model_name(model_name)
+                if cached['segments']:
+                    stats['audio_duration'] = cached['segments'][-1].get('end')
+                if cached.get('language'):
+                    stats['language_detected'] = cached['language']
+            if segment_callback and cached['segments']:
+                segment_callback(0, cached['segments'])
+            return cached['text'], cached['segments']
+    text, segments = transcribe_audio(
+        audio_path, language, progress_callback=progress_callback,
+        stats=stats, model_name=model_name, segment_callback=segment_callback,
+        duration_hint=duration_hint
+    )
+    if key:
+        with timed_stage(stats.setdefault('timings', {}) if stats is not None else {}, 'cache_store'):
+            transcript_cache.put(key, text, segments, language=(stats or {}).get('language_detected'))
+    if stats is not None:
+        stats['cache_hit'] = False
+    return text, segments
+
+PDF_PARAGRAPH_CHARS = int(os.environ.get("PDF_PARAGRAPH_CHARS", "900"))
+PDF_BATCH_FLOWABLES = int(os.environ.get("PDF_BATCH_FLOWABLES", "64"))
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+@functools.lru_cache(maxsize=None)
+def _pdf_styles():
+    """Estilos del PDF: getSampleStyleSheet es caro, se construyen una vez por proceso"""
+    lazy_import('reportlab.platypus')
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT
+    styles = getSampleStyleSheet()
+    return {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=16,
             textColor='black',
             spaceAfter=30,
             alignment=TA_LEFT
-        )
-        
-        content_style = ParagraphStyle(
+        ),
+        # spaceAfter incluye el antiguo Spacer(1, 6) entre párrafos
+        'content': ParagraphStyle(
             'CustomContent',
             parent=styles['Normal'],
             fontSize=11,
             textColor='black',
             alignment=TA_JUSTIFY,
-            spaceAfter=12,
+            spaceAfter=18,
             leftIndent=0,
             rightIndent=0
+        ),
+        # La marca de tiempo va como viñeta en un margen colgante: el texto sigue siendo
+        # un único fragmento y conserva la ruta rápida de partición de líneas
+        'timed': ParagraphStyle(
+            'TimedContent',
+            parent=styles['Normal'],
+            fontSize=11,
+            textColor='black',
+            alignment=TA_LEFT,
+            spaceAfter=10,
+            leftIndent=62,
+            bulletIndent=0,
+            bulletFontSize=9,
+            bulletColor='grey'
+        ),
+        'meta': ParagraphStyle(
+            'MetaData',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor='grey',
+            spaceAfter=20
         )
-        
-        story = []
-        
-        # Título
-        title = Paragraph("Transcripción de Audio en Español", title_style)
-        story.append(title)
-        story.append(Spacer(1, 12))
-        
-        # Metadatos
-        if metadata:
-            meta_style = ParagraphStyle(
-                'MetaData',
-                parent=styles['Normal'],
-                fontSize=10,
-                textColor='grey',
-                spaceAfter=20
-            )
-            
-            meta_text = f"Fecha de transcripción: {datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S')}<br/>"
-            if 'filename' in metadata:
-                meta_text += f"Archivo original: {metadata['filename']}<br/>"
-            if 'duration' in metadata:
-                meta_text += f"Duración: {metadata['duration']:.2f} segundos<br/>"
-            
-            story.append(Paragraph(meta_text, meta_style))
-            story.append(Spacer(1, 20))
-        
-        # Dividir el texto en párrafos para mejor legibilidad
-        paragraphs = text.split('\n')
-        for paragraph in paragraphs:
-            if paragraph.strip():
-                # Escapar caracteres especiales para ReportLab
-                escaped_text = paragraph.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-                p = Paragraph(escaped_text, content_style)
-                story.append(p)
-                story.append(Spacer(1, 6))
-        
-        doc.build(story)
+    }
+
+def _escape_pdf(text):
+    """Escapar caracteres especiales para el marcado de Paragraph"""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def _sentences(line, limit):
+    """Frases de una línea; las que no tienen puntuación se cortan por palabras a `limit`"""
+    for sentence in _SENTENCE_END.split(line.strip()):
+        if len(sentence) <= limit:
+            yield sentence
+        else:
+            yield from textwrap.wrap(sentence, limit, break_long_words=False, break_on_hyphens=False)
+
+def _paragraph_blocks(lines, target_chars):
+    """Fusionar líneas en párrafos de ~`target_chars`: ni un flowable por línea ni un párrafo gigante.
+
+    Un párrafo enorme obliga a ReportLab a volver a maquetar el resto en cada salto de
+    página (coste cuadrático); miles de párrafos diminutos multiplican el coste por flowable.
+    """
+    buffer, size = [], 0
+    for line in lines:
+        for sentence in _sentences(line, target_chars):
+            if not sentence:
+                continue
+            if buffer and size + len(sentence) > target_chars:
+                yield ' '.join(buffer)
+                buffer, size = [], 0
+            buffer.append(sentence)
+            size += len(sentence) + 1
+    if buffer:
+        yield ' '.join(buffer)
+
+def _timed_blocks(segments, target_chars):
+    """(inicio, texto) agrupando segmentos consecutivos hasta ~`target_chars`"""
+    buffer, size, start = [], 0, 0.0
+    for s in segments:
+        line = (s.get('text') or '').strip()
+        if not line:
+            continue
+        if buffer and size + len(line) > target_chars:
+            yield start, ' '.join(buffer)
+            buffer, size = [], 0
+        if not buffer:
+            start = s.get('start', 0.0)
+        buffer.append(line)
+        size += len(line) + 1
+    if buffer:
+        yield start, ' '.join(buffer)
+
+def _pdf_flowables(text, metadata=None, segments=None, timestamps=False):
+    """Generador de flowables del PDF: nunca materializa la historia completa"""
+    from reportlab.platypus import Paragraph, Spacer
+    styles = _pdf_styles()
+
+    # Título
+    yield Paragraph("Transcripción de Audio en Español", styles['title'])
+    yield Spacer(1, 12)
+
+    # Metadatos
+    if metadata:
+        meta_text = f"Fecha de transcripción: {datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S')}<br/>"
+        if 'filename' in metadata:
+            meta_text += f"Archivo original: {_escape_pdf(str(metadata['filename']))}<br/>"
+        if 'duration' in metadata:
+            meta_text += f"Duración: {metadata['duration']:.2f} segundos<br/>"
+        yield Paragraph(meta_text, styles['meta'])
+        yield Spacer(1, 20)
+
+    if timestamps and segments:
+        for start, block in _timed_blocks(segments, PDF_PARAGRAPH_CHARS):
+            yield Paragraph(_escape_pdf(block), styles['timed'], bulletText=f"[{_format_timestamp(start)[:8]}]")
+    else:
+        lines = (m.group(0) for m in re.finditer(r'[^\n]+', text or ''))
+        for block in _paragraph_blocks(lines, PDF_PARAGRAPH_CHARS):
+            yield Paragraph(_escape_pdf(block), styles['content'])
+
+class FlowableStream(list):
+    """Lista de flowables que se rellena por lotes desde un iterador.
+
+    `SimpleDocTemplate.build` consume la lista con `len()`, `[0]` y `del flowables[0]`
+    (y reinserta al principio los trozos de un flowable partido). Cada `len()` repone
+    el lote cuando quedan menos de dos flowables (keepWithNext necesita ver el
+    siguiente), así que solo el lote en curso está en memoria y se usa la API pública.
+    """
+
+    def __init__(self, source, batch_size=PDF_BATCH_FLOWABLES):
+        super().__init__()
+        self._source = iter(source)
+        self._batch_size = max(2, batch_size)
+
+    def __len__(self):
+        if self._source is not None and super().__len__() < 2:
+            batch = list(itertools.islice(self._source, self._batch_size))
+            if batch:
+                self.extend(batch)
+            else:
+                self._source = None
+        return super().__len__()
+
+def create_pdf_with_reportlab(text, output_path, metadata=None, segments=None, timestamps=False):
+    """Crear PDF usando ReportLab, maquetando por lotes (con marcas de tiempo si se piden y hay segmentos)"""
+    try:
+        from reportlab.lib.pagesizes import letter
+        doc = lazy_import('reportlab.platypus').SimpleDocTemplate(output_path, pagesize=letter)
+        doc.build(FlowableStream(_pdf_flowables(text, metadata, segments, timestamps)))
         logger.info(f"PDF creado exitosamente: {output_path}")
         
     except Exception as e:
         logger.error(f"Error creando PDF: {str(e)}")
         raise e
 
-def create_docx(text, output_path, metadata=None):
-    """Crear documento DOCX usando python-docx"""
+DOCX_STREAMING = os.environ.get("DOCX_STREAMING", "1") == "1"
+DOCX_WRITE_BUFFER = 64 * 1024
+_DOCX_META_MARK = '__TRANSCRIPT_META__'
+_DOCX_BODY_MARK = '__TRANSCRIPT_BODY__'
+# Caracteres de control no válidos en XML 1.0 (python-docx los rechaza con ValueError)
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _docx_paragraph_xml(text):
+    return f'<w:p><w:r><w:t>{xml_escape(text)}</w:t></w:r></w:p>'
+
+@functools.lru_cache(maxsize=1)
+def _docx_template():
+    """Partes del DOCX generadas una vez con python-docx: estilos, título y cabecera de contenido.
+
+    `document.xml` se parte en tres trozos alrededor de dos marcas; el bloque de
+    metadatos y los párrafos se escriben en medio en cada renderizado.
+    """
+    doc = lazy_import('docx').Document()
+    doc.add_heading('Transcripción de Audio en Español', 0)
+    doc.add_paragraph(_DOCX_META_MARK)
+    doc.add_heading('Transcripción:', level=1)
+    doc.add_paragraph(_DOCX_BODY_MARK)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    with zipfile.ZipFile(buffer) as zf:
+        parts = [(info.filename, zf.read(info.filename)) for info in zf.infolist()]
+    document_xml = dict(parts)['word/document.xml'].decode('utf-8')
+    head, rest = document_xml.split(_docx_paragraph_xml(_DOCX_META_MARK))
+    middle, tail = rest.split(_docx_paragraph_xml(_DOCX_BODY_MARK))
+    return parts, head, middle, tail
+
+def _docx_meta_xml(metadata):
+    """Bloque de metadatos igual al de python-docx: runs en cursiva con salto de línea y un párrafo vacío"""
+    if not metadata:
+        return ''
+    lines = [f"Fecha de transcripción: {datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S')}"]
+    if 'filename' in metadata:
+        lines.append(f"Archivo original: {metadata['filename']}")
+    if 'duration' in metadata:
+        lines.append(f"Duración: {metadata['duration']:.2f} segundos")
+    runs = ''.join(
+        f'<w:r><w:rPr><w:i/></w:rPr><w:t>{xml_escape(_XML_INVALID.sub("", line))}</w:t><w:br/></w:r>'
+        for line in lines
+    )
+    return f'<w:p>{runs}</w:p><w:p/>'
+
+def _docx_body_xml(text, segments=None, timestamps=False):
+    """Párrafos del cuerpo como fragmentos XML, uno por línea (o por bloque con marca de tiempo)"""
+    if timestamps and segments:
+        for start, block in _timed_blocks(segments, PDF_PARAGRAPH_CHARS):
+            yield (
+                '<w:p><w:r><w:rPr><w:color w:val="808080"/><w:sz w:val="18"/></w:rPr>'
+                f'<w:t xml:space="preserve">[{_format_timestamp(start)[:8]}] </w:t></w:r>'
+                f'<w:r><w:t>{xml_escape(_XML_INVALID.sub("", block))}</w:t></w:r></w:p>'
+            )
+        return
+    for match in re.finditer(r'[^\n]+', text or ''):
+        line = _XML_INVALID.sub('', match.group(0)).strip()
+        if line:
+            yield _docx_paragraph_xml(line)
+
+def create_docx_streaming(text, output_path, metadata=None, segments=None, timestamps=False):
+    """Crear DOCX escribiendo `word/document.xml` directamente en el zip, sin árbol lxml"""
+    parts, head, middle, tail = _docx_template()
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts:
+            if name != 'word/document.xml':
+                zf.writestr(name, data)
+                continue
+            with zf.open(name, 'w') as part:
+                pending, size = [head, _docx_meta_xml(metadata), middle], 0
+                for paragraph in _docx_body_xml(text, segments, timestamps):
+                    pending.append(paragraph)
+                    size += len(paragraph)
+                    if size >= DOCX_WRITE_BUFFER:
+                        part.write(''.join(pending).encode('utf-8'))
+                        pending, size = [], 0
+                pending.append(tail)
+                part.write(''.join(pending).encode('utf-8'))
+
+def create_docx(text, output_path, metadata=None, segments=None, timestamps=False):
+    """Crear documento DOCX (en streaming por defecto; DOCX_STREAMING=0 usa python-docx)"""
     try:
-        doc = Document()
+        if DOCX_STREAMING:
+            create_docx_streaming(text, output_path, metadata, segments=segments, timestamps=timestamps)
+            logger.info(f"DOCX creado exitosamente: {output_path}")
+            return
+        doc = lazy_import('docx').Document()
         
         # Título
         title = doc.add_heading('Transcripción de Audio en Español', 0)
@@ -467,6 +2721,111 @@ def create_docx(text, output_path, metadata=None):
         logger.error(f"Error creando DOCX: {str(e)}")
         raise e
 
+#############################################
+# TRANSCRIPCIÓN INTERMEDIA Y EXPORTACIÓN    #
+#############################################
+# El resultado de cada tarea se guarda una vez (texto + segmentos) y cada formato se
+# genera bajo demanda desde ese archivo, sin repetir la inferencia.
+
+EXPORT_MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'txt': 'text/plain',
+    'srt': 'application/x-subrip; charset=utf-8',
+    'vtt': 'text/vtt',
+    'json': 'application/json'
+}
+EXPORT_FORMATS = list(EXPORT_MIMETYPES)
+
+def compact_segments(segments):
+    """Segmentos reducidos a lo necesario para renderizar (sin tokens ni métricas de Whisper)"""
+    return [
+        {k: s[k] for k in ('id', 'start', 'end', 'text', 'chunk') if k in s}
+        for s in segments
+    ]
+
+def save_transcript(path, text, segments, metadata=None):
+    """Guardar la transcripción intermedia comprimida (escritura atómica)"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(
+            {'text': text, 'segments': compact_segments(segments), 'metadata': metadata or {}},
+            f, ensure_ascii=False, separators=(',', ':')
+        )
+    os.replace(tmp_path, path)
+
+def load_transcript(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+def _format_timestamp(seconds, decimal_marker='.'):
+    """Marca de tiempo hh:mm:ss.mmm (SRT usa coma como separador decimal)"""
+    millis = int(round(max(seconds, 0.0) * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{decimal_marker}{millis:03d}"
+
+def create_txt(text, output_path, metadata=None):
+    """Crear archivo de texto plano"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for paragraph in text.split('\n'):
+            if paragraph.strip():
+                f.write(paragraph.strip() + '\n\n')
+    logger.info(f"TXT creado exitosamente: {output_path}")
+
+def create_srt(segments, output_path):
+    """Crear subtítulos SubRip a partir de los segmentos"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        index = 1
+        for s in segments:
+            line = (s.get('text') or '').strip()
+            if not line:
+                continue
+            f.write(f"{index}\n{_format_timestamp(s['start'], ',')} --> {_format_timestamp(s['end'], ',')}\n{line}\n\n")
+            index += 1
+    logger.info(f"SRT creado exitosamente: {output_path}")
+
+def create_vtt(segments, output_path):
+    """Crear subtítulos WebVTT a partir de los segmentos"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write("WEBVTT\n\n")
+        for s in segments:
+            line = (s.get('text') or '').strip()
+            if not line:
+                continue
+            f.write(f"{_format_timestamp(s['start'])} --> {_format_timestamp(s['end'])}\n{line}\n\n")
+    logger.info(f"VTT creado exitosamente: {output_path}")
+
+def create_json(text, segments, output_path, metadata=None):
+    """Exportar texto, segmentos y metadatos como JSON"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(
+            {'text': text, 'segments': compact_segments(segments), 'metadata': metadata or {}},
+            f, ensure_ascii=False, indent=2
+        )
+    logger.info(f"JSON creado exitosamente: {output_path}")
+
+def render_transcript(transcript, fmt, output_path, timestamps=False):
+    """Renderizar una transcripción intermedia en el formato pedido (`timestamps`: maquetación con marcas de tiempo)"""
+    text = transcript['text']
+    segments = transcript.get('segments', [])
+    metadata = transcript.get('metadata') or None
+    if fmt == 'pdf':
+        create_pdf_with_reportlab(text, output_path, metadata, segments=segments, timestamps=timestamps)
+    elif fmt == 'docx':
+        create_docx(text, output_path, metadata, segments=segments, timestamps=timestamps)
+    elif fmt == 'txt':
+        create_txt(text, output_path, metadata)
+    elif fmt == 'srt':
+        create_srt(segments, output_path)
+    elif fmt == 'vtt':
+        create_vtt(segments, output_path)
+    elif fmt == 'json':
+        create_json(text, segments, output_path, metadata)
+    else:
+        raise ValueError(f"Formato de exportación no soportado: {fmt}")
+
 @app.route('/', methods=['GET'])
 def index():
     """Endpoint principal - sirve la página web"""
@@ -482,31 +2841,20 @@ def index():
 @app.route('/info', methods=['GET'])
 def get_api_info():
     """Endpoint de información de la API"""
-    loaded_name = None
-    try:
-        if model is not None and hasattr(model, 'dims') and hasattr(model.dims, 'n_vocab'):
-            vocab = model.dims.n_vocab
-            mapping = {
-                51864: 'tiny',
-                51865: 'base',
-                51866: 'small',
-                51867: 'medium'
-            }
-            loaded_name = mapping.get(vocab, 'large')
-    except Exception:
-        pass
-
-    if loaded_name is None:
+    descriptors = {
+        'tiny': 'rápido',
+        'base': 'alta precisión',
+        'small': 'muy alta precisión',
+        'medium': 'excelente precisión',
+        'large': 'máxima precisión'
+    }
+    resident = model_registry.snapshot()
+    if not resident:
         model_info = f"(pendiente de carga lazy) solicitado={MODEL}"
     else:
-        descriptors = {
-            'tiny': 'rápido',
-            'base': 'alta precisión',
-            'small': 'muy alta precisión',
-            'medium': 'excelente precisión',
-            'large': 'máxima precisión'
-        }
-        model_info = f"{loaded_name} ({descriptors.get(loaded_name,'')})"
+        # El más usado recientemente va al final del snapshot
+        loaded_name = resident[-1]['name']
+        model_info = f"{loaded_name} ({descriptors.get(loaded_name.split('.')[0].split('-')[0], '')})"
 
     return jsonify({
         'message': 'API de Transcripción de Audio a Documento - Optimizada para Español',
@@ -514,18 +2862,43 @@ def get_api_info():
         'language_default': 'spanish',
         'model_requested': MODEL,
         'model_active': model_info,
-        'lazy_loaded': model is not None,
+        'lazy_loaded': bool(resident),
+        'models_allowed': ALLOWED_MODELS,
+        'models_resident': resident,
+        'whisper_backend': whisper_backend(),
+        'model_memory_budget_mb': round(model_registry.budget_bytes / (1024 * 1024)) or None,
         'languages_supported': SUPPORTED_LANGUAGES,
         'queue_enabled': ENABLE_ASYNC,
         'chunk_seconds': int(os.environ.get('CHUNK_SECONDS', '0') or 0),
+        'transcribe_processes': _pool_size(),
+        'transcript_cache': transcript_cache.stats(),
+        'batch_inference': _batch_engine.stats() if _batch_engine else None,
+        'startup': startup_state,
+        'sync_admission': {
+            'timeout_seconds': SYNC_TIMEOUT_SECONDS,
+            'max_waiting': SYNC_MAX_WAITING,
+            'on_overload': SYNC_OVERLOAD
+        } if ENABLE_ASYNC else None,
         'endpoints': {
             'GET /': 'Página principal web',
             'GET /api': 'Información de la API (JSON)',
             'GET /health': 'Verificar estado de la API',
-            'POST /transcribe': 'Transcribir archivo (sin cola, espera la respuesta)',
+            'GET /ready': 'Disponibilidad para transcribir (503 durante el warm-up)',
+            'GET /metrics': 'Métricas Prometheus: tiempos por etapa, RTF, cola, caché, carga de modelos',
+            'POST /transcribe': 'Transcribir archivo y esperar la respuesta (202 con job_id o 429/503 si no cabe en el tiempo límite)',
             'POST /transcribe_async': 'Crear tarea de transcripción en cola (si habilitado)',
+            'POST /uploads': 'Iniciar subida reanudable (después `upload_id` en /transcribe o /transcribe_async)',
+            'PUT /uploads/<id>': 'Enviar un bloque con Content-Range; GET devuelve los bytes recibidos',
             'GET /jobs/<id>': 'Estado de una tarea asíncrona',
-            'GET /jobs/<id>/download': 'Descargar resultado de tarea completa'
+            'POST /batches': 'Crear un lote de tareas (varios archivos `audio` o un zip en `archive`)',
+            'GET /batches/<id>': 'Progreso agregado de un lote',
+            'GET /batches/<id>/download': 'Todas las salidas del lote en un zip',
+            'GET /jobs/<id>/events': 'Progreso en vivo de una tarea (Server-Sent Events)',
+            'GET /jobs/<id>/wait?since=<versión>': 'Long-poll: responde cuando la tarea cambia',
+            'GET /jobs/<id>/partial?since=<n>': 'Segmentos ya transcritos de una tarea en curso',
+            'GET /jobs/<id>/partial.txt': 'Texto parcial en streaming, crece a medida que avanza la tarea',
+            'GET /jobs/<id>/download': 'Descargar resultado de tarea completa',
+            'GET /jobs/<id>/export/<formato>': 'Descargar en otro formato (pdf, docx, txt, srt, vtt, json) sin re-transcribir'
         },
         'supported_formats': list(ALLOWED_EXTENSIONS),
         'max_file_size': '1GB'
@@ -533,20 +2906,42 @@ def get_api_info():
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Endpoint de salud"""
+    """Endpoint de salud; tareas y disco son la última medida del barrido de retención"""
+    stats = health_stats()
     return jsonify({
         'status': 'OK',
         'timestamp': datetime.datetime.now().isoformat(),
-        'model_loaded': model is not None,
-        'requested_model': MODEL
+        'model_loaded': model_registry.is_loaded(),
+        'requested_model': MODEL,
+        'ready': is_ready(),
+        'warmup': warmup_state['status'],
+        'jobs': stats['jobs'],
+        'disk': stats['disk'],
+        'stats_measured_at': stats['measured_at'],
+        'retention': retention_state,
+        'startup': startup_state
     })
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Endpoint de disponibilidad: 503 hasta que el warm-up termina"""
+    body = dict(warmup_state, ready=is_ready())
+    return jsonify(body), (200 if body['ready'] else 503)
+
 #############################################
-# COLA ASÍNCRONA SIMPLE EN MEMORIA          #
+# COLA ASÍNCRONA PERSISTENTE (SQLITE)       #
 #############################################
-job_queue = None
-jobs = {}
-jobs_lock = threading.Lock()
+# Las tareas viven en una base SQLite en modo WAL (JOB_DB_PATH), compartida por todos
+# los hilos y workers de gunicorn del mismo host: sobreviven a reinicios y cada
+# worker reclama tareas pendientes con una transacción atómica. Mientras procesa una
+# tarea, el proceso renueva su "lease"; si muere, la tarea vuelve a la cola cuando el
+# lease caduca (JOB_LEASE_SECONDS), hasta JOB_MAX_ATTEMPTS intentos.
+#
+# Planificación: las tareas no salen en FIFO. Primero por prioridad explícita
+# (high/normal/low); dentro de cada nivel, por coste estimado (duración del audio
+# sondeada al subir) con envejecimiento, para que las cortas tengan baja latencia sin
+# que las largas esperen indefinidamente; y con reparto justo por cliente: cada tarea
+# de un cliente ya en proceso o por delante en la cola penaliza a las siguientes.
 
 class JobStatus:
     PENDING = 'pending'
@@ -554,109 +2949,1166 @@ class JobStatus:
     DONE = 'done'
     ERROR = 'error'
 
+JOB_PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+# Coste asumido (segundos de audio) cuando no se pudo sondear la duración
+DEFAULT_JOB_COST = _env_float("DEFAULT_JOB_COST", 300)
+# Cada JOB_AGING_SECONDS de espera el coste efectivo de una tarea se reduce a la mitad, a un tercio...
+JOB_AGING_SECONDS = _env_float("JOB_AGING_SECONDS", 600)
+# Peso de la carga ya asignada a un cliente (segundos de audio) frente al coste propio
+FAIR_SHARE_WEIGHT = _env_float("FAIR_SHARE_WEIGHT", 1.0)
+# Segundos de proceso por segundo de audio si aún no hay tareas terminadas para estimarlo
+ESTIMATED_RTF = _env_float("ESTIMATED_RTF", 0.5)
+
+def schedule_order(pending, active_load, now):
+    """Ordenar tareas pendientes según prioridad, coste con envejecimiento y reparto justo.
+
+    pending: lista de dicts con id, priority, client, cost, created_ts.
+    active_load: segundos de audio en proceso por cliente.
+    Selección voraz: en cada paso se elige la tarea de menor (prioridad, coste
+    efectivo + peso * carga del cliente) y su coste se suma a la carga de su cliente.
+
+    Todas las tareas de un cliente comparten su carga, así que entre ellas el orden es
+    fijo (prioridad, coste efectivo, llegada): basta un heap con la primera tarea de
+    cada cliente, O(n log clientes) en lugar de comparar todas en cada paso.
+    """
+    load = dict(active_load)
+    queues = collections.defaultdict(list)
+    for index, job in enumerate(pending):
+        cost = job['cost'] if job['cost'] is not None else DEFAULT_JOB_COST
+        waited = max(0.0, now - job['created_ts'])
+        effective = cost / (1.0 + waited / JOB_AGING_SECONDS)
+        queues[job['client']].append((job['priority'], effective, job['created_ts'], index, cost, job))
+    heap = []
+
+    def push(client):
+        priority, effective, created_ts, index, _, _ = queues[client][-1]
+        # El índice original desempata igual que min() sobre la lista de pendientes
+        heapq.heappush(heap, (priority, effective + FAIR_SHARE_WEIGHT * load.get(client, 0.0), created_ts, index, client))
+
+    for client, jobs in queues.items():
+        # Orden inverso: pop() saca la siguiente tarea del cliente
+        jobs.sort(key=lambda item: item[:4], reverse=True)
+        push(client)
+    ordered = []
+    while heap:
+        client = heapq.heappop(heap)[-1]
+        _, _, _, _, cost, job = queues[client].pop()
+        ordered.append(job)
+        load[client] = load.get(client, 0.0) + cost
+        if queues[client]:
+            push(client)
+    return ordered
+
+# Segundos que se reutiliza el orden calculado de la cola para posiciones, ETAs y admisión
+SCHEDULE_CACHE_SECONDS = _env_float("SCHEDULE_CACHE_SECONDS", 2.0)
+
+JOB_LEASE_SECONDS = _env_float("JOB_LEASE_SECONDS", 60)
+JOB_MAX_ATTEMPTS = int(_env_float("JOB_MAX_ATTEMPTS", 3))
+# Identificador de este proceso como dueño de tareas
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# Cada cuánto quien espera una tarea mira la base por si la cambió otro proceso
+# (los cambios de este proceso despiertan al instante sin consultarla)
+JOB_WAIT_POLL_SECONDS = _env_float("JOB_WAIT_POLL_SECONDS", 5)
+
+class _JobWaiter:
+    """Condición compartida por quienes esperan cambios de una misma tarea"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        # Última versión publicada por este proceso
+        self.version = 0
+        self.refs = 0
+
+class JobStore:
+    """Almacén de tareas en SQLite con búsqueda indexada por id y reclamación atómica.
+
+    El registro completo se guarda como JSON en `data`; status, progress y
+    created_at se replican en columnas para indexar y ordenar. owner,
+    heartbeat_at y attempts son internos y no forman parte del registro.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # Esperas por tarea (SSE, long-poll, /transcribe) en este proceso: job_id -> _JobWaiter
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+        # Foto del planificador (ver _schedule_snapshot); la generación descarta
+        # fotos calculadas mientras otra operación la invalidaba
+        self._schedule = None
+        self._schedule_generation = 0
+        self._schedule_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                owner TEXT,
+                heartbeat_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+        """)
+        # Segmentos definitivos publicados mientras la tarea sigue en proceso
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_segments (
+                job_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                start REAL,
+                end REAL,
+                text TEXT,
+                PRIMARY KEY (job_id, idx)
+            )
+        """)
+        # Columnas de planificación (añadidas a bases creadas por versiones anteriores)
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name, ddl in (('priority', 'INTEGER NOT NULL DEFAULT 1'), ('client', 'TEXT'),
+                          ('cost', 'REAL'), ('created_ts', 'REAL'), ('started_ts', 'REAL'),
+                          ('batch_id', 'TEXT')):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {ddl}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch_id)")
+        # Lotes (/batches): el registro guarda opciones y archivos rechazados; el
+        # progreso se agrega de las tareas hijas
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                created_ts REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Una conexión por hilo; autocommit y transacciones explícitas
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _record(row):
+        return json.loads(row['data']) if row else None
+
+    @staticmethod
+    def _dump(record):
+        """Serializar incrementando la versión (los clientes la usan para detectar cambios)"""
+        record['version'] = record.get('version', 0) + 1
+        return json.dumps(record, ensure_ascii=False)
+
+    def _notify(self, record):
+        """Despertar solo a quienes esperan esta tarea, con la versión recién escrita"""
+        with self._waiters_lock:
+            waiter = self._waiters.get(record['id'])
+        if waiter is not None:
+            with waiter.cond:
+                waiter.version = max(waiter.version, record.get('version', 0))
+                waiter.cond.notify_all()
+
+    @contextlib.contextmanager
+    def _waiter(self, job_id):
+        with self._waiters_lock:
+            waiter = self._waiters.get(job_id)
+            if waiter is None:
+                waiter = self._waiters[job_id] = _JobWaiter()
+            waiter.refs += 1
+        try:
+            yield waiter
+        finally:
+            with self._waiters_lock:
+                waiter.refs -= 1
+                if not waiter.refs:
+                    del self._waiters[job_id]
+
+    def _version(self, job_id):
+        """Versión de la tarea sin deserializar el registro (None si no existe)"""
+        row = self._conn().execute(
+            "SELECT json_extract(data, '$.version') AS version FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return (row['version'] or 0) if row else None
+
+    def wait_for_update(self, job_id, since_version, timeout, poll_interval=JOB_WAIT_POLL_SECONDS):
+        """Esperar hasta que la tarea supere `since_version` o pase `timeout`.
+
+        Los cambios hechos en este proceso despiertan solo a quienes esperan esa
+        tarea, sin consultar la base; los de otros workers de gunicorn se detectan
+        leyendo solo la versión cada `poll_interval`.
+        Devuelve el registro (o None si la tarea no existe).
+        """
+        deadline = time.time() + timeout
+        with self._waiter(job_id) as waiter:
+            # Registrado antes de leer: un cambio entre la lectura y la espera no se pierde
+            job = self.get(job_id)
+            if job is None or job.get('version', 0) > since_version or job['status'] in (JobStatus.DONE, JobStatus.ERROR):
+                return job
+            while True:
+                with waiter.cond:
+                    remaining = deadline - time.time()
+                    if waiter.version <= since_version and remaining > 0:
+                        waiter.cond.wait(min(remaining, poll_interval))
+                    if waiter.version > since_version:
+                        break
+                if time.time() >= deadline:
+                    return job
+                version = self._version(job_id)
+                if version is None or version > since_version:
+                    break
+        return self.get(job_id)
+
+    def create(self, record):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, progress, created_at, updated_at, priority, client, cost, created_ts, "
+                "batch_id, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record['id'], record['status'], record.get('progress', 0), record['created_at'], now,
+                 JOB_PRIORITIES.get(record.get('priority'), JOB_PRIORITIES['normal']),
+                 record.get('client'), record.get('audio_duration_estimate'), now,
+                 record.get('batch_id'), self._dump(record))
+            )
+        self._invalidate_schedule()
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._record(row)
+
+    def mutate(self, job_id, fn):
+        """Modificar un registro dentro de una transacción: fn(record) lo edita en sitio"""
+        record, status_changed = self._mutate(job_id, fn)
+        if status_changed:
+            # Entra o sale de la cola / del conjunto en proceso
+            self._invalidate_schedule()
+        if record is not None:
+            self._notify(record)
+        return record
+
+    def _mutate(self, job_id, fn):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None, False
+            record = json.loads(row['data'])
+            previous_status = record['status']
+            fn(record)
+            now = time.time()
+            # Quien actualiza una tarea propia renueva también su lease
+            heartbeat = now if row['owner'] == WORKER_ID else None
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, updated_at = ?, "
+                "heartbeat_at = COALESCE(?, heartbeat_at), data = ? WHERE id = ?",
+                (record['status'], record.get('progress', 0), now, heartbeat,
+                 self._dump(record), job_id)
+            )
+            return record, record['status'] != previous_status
+
+    def update(self, job_id, **fields):
+        return self.mutate(job_id, lambda record: record.update(fields))
+
+    def _pending_order(self, conn, now):
+        pending = [
+            {
+                'id': row['id'], 'priority': row['priority'], 'client': row['client'],
+                'cost': row['cost'], 'created_ts': row['created_ts'] if row['created_ts'] is not None else now,
+                'batch_id': row['batch_id']
+            }
+            for row in conn.execute(
+                "SELECT id, priority, client, cost, created_ts, batch_id FROM jobs WHERE status = ?",
+                (JobStatus.PENDING,)
+            )
+        ]
+        active = self._active(conn)
+        load = {}
+        for row in active:
+            load[row['client']] = load.get(row['client'], 0.0) + (row['cost'] if row['cost'] is not None else DEFAULT_JOB_COST)
+        return schedule_order(pending, load, now), active
+
+    @staticmethod
+    def _active(conn):
+        return conn.execute(
+            "SELECT id, client, cost, started_ts FROM jobs WHERE status = ?", (JobStatus.PROCESSING,)
+        ).fetchall()
+
+    def claim_next(self, owner=WORKER_ID):
+        """Reclamar la siguiente tarea según el planificador (o None).
+
+        El orden se calcula fuera de la transacción de escritura; la reclamación es un
+        UPDATE condicionado a que la tarea siga pendiente, y si otro worker se adelantó
+        se prueba con la siguiente.
+        """
+        for candidate in self._schedule_snapshot(max_age=0)['ordered']:
+            record = self._claim(candidate['id'], owner)
+            if record is not None:
+                return record
+        return None
+
+    def claim_siblings(self, batch_id, limit, max_cost, owner=WORKER_ID):
+        """Reclamar hasta `limit` tareas pendientes del lote `batch_id` con coste <= `max_cost`.
+
+        Se toman en el orden del planificador; las de coste desconocido no se agrupan.
+        """
+        claimed = []
+        for candidate in self._schedule_snapshot(max_age=0)['ordered']:
+            if len(claimed) >= limit:
+                break
+            if candidate['batch_id'] != batch_id or candidate['cost'] is None or candidate['cost'] > max_cost:
+                continue
+            record = self._claim(candidate['id'], owner)
+            if record is not None:
+                claimed.append(record)
+        return claimed
+
+    def _claim(self, job_id, owner):
+        """Pasar una tarea a en proceso si sigue pendiente; None si otro worker se adelantó"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE id = ? AND status = ?", (job_id, JobStatus.PENDING)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            record = json.loads(row['data'])
+            record['status'] = JobStatus.PROCESSING
+            record['progress'] = 1
+            record['started_at'] = datetime.datetime.utcnow().isoformat()
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, owner = ?, heartbeat_at = ?, started_ts = ?, "
+                "attempts = attempts + 1, updated_at = ?, data = ? WHERE id = ? AND status = ?",
+                (JobStatus.PROCESSING, owner, now, now, now, self._dump(record), job_id, JobStatus.PENDING)
+            )
+        self._invalidate_schedule()
+        self._notify(record)
+        return record
+
+    def _invalidate_schedule(self):
+        with self._schedule_lock:
+            self._schedule = None
+            self._schedule_generation += 1
+
+    def _schedule_snapshot(self, max_age=SCHEDULE_CACHE_SECONDS):
+        """Orden de la cola, tareas en curso y RTF estimado, recalculados como mucho cada `max_age` s.
+
+        Posiciones, ETAs y admisión consultan esta foto en lugar de repetir el
+        planificador en cada petición. Crear, reclamar o cambiar de estado una tarea
+        en este proceso la invalida; los cambios de otros workers se ven al caducar.
+        """
+        with self._schedule_lock:
+            snapshot = self._schedule
+            if snapshot is not None and time.time() - snapshot['at'] < max_age:
+                return snapshot
+            generation = self._schedule_generation
+        now = time.time()
+        ordered, active = self._pending_order(self._conn(), now)
+        rtf = self.estimated_rtf()
+        # ahead[i]: segundos de proceso de las tareas por delante de la i-ésima
+        ahead = [0.0]
+        for job in ordered:
+            ahead.append(ahead[-1] + (job['cost'] if job['cost'] is not None else DEFAULT_JOB_COST) * rtf)
+        snapshot = {
+            'at': now,
+            'ordered': ordered,
+            'index': {job['id']: i for i, job in enumerate(ordered)},
+            'ahead': ahead,
+            'active': [dict(row) for row in active],
+            'rtf': rtf
+        }
+        with self._schedule_lock:
+            if self._schedule_generation == generation:
+                self._schedule = snapshot
+        return snapshot
+
+    def estimated_rtf(self, sample=50):
+        """Segundos de proceso por segundo de audio, promediado sobre las últimas tareas terminadas"""
+        try:
+            row = self._conn().execute(
+                "SELECT AVG(json_extract(data, '$.processing_seconds') / json_extract(data, '$.audio_duration')) AS rtf "
+                "FROM (SELECT data FROM jobs WHERE status = ? AND json_extract(data, '$.audio_duration') > 0 "
+                "AND json_extract(data, '$.cache_hit') = 0 ORDER BY updated_at DESC LIMIT ?)",
+                (JobStatus.DONE, sample)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        return row['rtf'] if row and row['rtf'] else ESTIMATED_RTF
+
+    @staticmethod
+    def _busy_seconds(active, rtf, now):
+        """Lo que queda por procesar de las tareas en curso"""
+        return sum(
+            max(0.0, (row['cost'] if row['cost'] is not None else DEFAULT_JOB_COST) * rtf - (now - (row['started_ts'] or now)))
+            for row in active
+        )
+
+    def queue_position(self, job_id, workers=1):
+        """Posición en la cola (1 = la siguiente) y segundos estimados hasta que empiece"""
+        snapshot = self._schedule_snapshot()
+        position = snapshot['index'].get(job_id)
+        if position is None:
+            return None, None
+        # Trabajo restante: lo que queda de las tareas en proceso + las que van por delante
+        busy = self._busy_seconds(snapshot['active'], snapshot['rtf'], time.time())
+        return position + 1, (busy + snapshot['ahead'][position]) / max(workers, 1)
+
+    def backlog_seconds(self, workers=1, priority='normal'):
+        """Segundos estimados hasta que empezaría una tarea nueva de `priority`, y el RTF usado.
+
+        Cuenta las tareas en curso y las pendientes de igual o mayor prioridad.
+        """
+        snapshot = self._schedule_snapshot()
+        rtf = snapshot['rtf']
+        level = JOB_PRIORITIES.get(priority, JOB_PRIORITIES['normal'])
+        ahead = sum(
+            (job['cost'] if job['cost'] is not None else DEFAULT_JOB_COST) * rtf
+            for job in snapshot['ordered'] if job['priority'] <= level
+        )
+        return (self._busy_seconds(snapshot['active'], rtf, time.time()) + ahead) / max(workers, 1), rtf
+
+    def heartbeat(self, owner=WORKER_ID):
+        """Renovar el lease de todas las tareas en proceso de este dueño"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+                (time.time(), owner, JobStatus.PROCESSING)
+            )
+
+    def requeue_stale(self, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        """Devolver a la cola las tareas cuyo dueño dejó de renovar el lease.
+
+        Las que ya agotaron sus intentos se marcan como error para no bloquear la cola.
+        Devuelve el número de tareas reencoladas.
+        """
+        cutoff = time.time() - lease_seconds
+        requeued = 0
+        records = []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, attempts, data FROM jobs WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (JobStatus.PROCESSING, cutoff)
+            ).fetchall()
+            for row in rows:
+                record = json.loads(row['data'])
+                if row['attempts'] >= max_attempts:
+                    record['status'] = JobStatus.ERROR
+                    record['error'] = f"La tarea se interrumpió {row['attempts']} veces (reinicio o caída del worker)"
+                else:
+                    record['status'] = JobStatus.PENDING
+                    record['progress'] = 0
+                    requeued += 1
+                conn.execute(
+                    "UPDATE jobs SET status = ?, progress = ?, owner = NULL, updated_at = ?, data = ? WHERE id = ?",
+                    (record['status'], record.get('progress', 0), time.time(),
+                     self._dump(record), row['id'])
+                )
+                records.append(record)
+        if rows:
+            self._invalidate_schedule()
+        for record in records:
+            self._notify(record)
+        return requeued
+
+    def append_segments(self, job_id, first_index, segments):
+        """Guardar segmentos parciales (idempotente por índice) y avisar a quien espera"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_segments (job_id, idx, start, end, text) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, first_index + i, s.get('start'), s.get('end'), s.get('text'))
+                 for i, s in enumerate(segments)]
+            )
+        self.update(job_id, partial_segments=first_index + len(segments))
+
+    def get_segments(self, job_id, since=0):
+        rows = self._conn().execute(
+            "SELECT idx, start, end, text FROM job_segments WHERE job_id = ? AND idx >= ? ORDER BY idx",
+            (job_id, since)
+        ).fetchall()
+        return [{'id': row['idx'], 'start': row['start'], 'end': row['end'], 'text': row['text']} for row in rows]
+
+    def clear_segments(self, job_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM job_segments WHERE job_id = ?", (job_id,))
+
+    def count_by_status(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def retained_records(self):
+        """Todas las tareas que siguen en la base (sus archivos no se pueden borrar sueltos)"""
+        rows = self._conn().execute("SELECT data FROM jobs").fetchall()
+        return [self._record(row) for row in rows]
+
+    def finished_by_age(self):
+        """(updated_at, registro) de las tareas terminadas, de la más antigua a la más reciente"""
+        rows = self._conn().execute(
+            "SELECT updated_at, data FROM jobs WHERE status IN (?, ?) ORDER BY updated_at",
+            (JobStatus.DONE, JobStatus.ERROR)
+        ).fetchall()
+        return [(row['updated_at'], self._record(row)) for row in rows]
+
+    def purge_finished(self, older_than, max_finished=None):
+        """Borrar tareas terminadas (y sus segmentos) sin cambios desde `older_than`, más
+        las más antiguas que excedan `max_finished`. Devuelve los registros borrados."""
+        finished = (JobStatus.DONE, JobStatus.ERROR)
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, data FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (*finished, older_than)
+            ).fetchall()
+            if max_finished is not None:
+                rows += conn.execute(
+                    "SELECT id, data FROM jobs WHERE status IN (?, ?) AND updated_at >= ? "
+                    "ORDER BY updated_at DESC LIMIT -1 OFFSET ?", (*finished, older_than, max_finished)
+                ).fetchall()
+            ids = [(row['id'],) for row in rows]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", ids)
+            conn.executemany("DELETE FROM job_segments WHERE job_id = ?", ids)
+            # Lotes sin tareas hijas que queden
+            conn.execute(
+                "DELETE FROM batches WHERE created_ts < ? AND NOT EXISTS "
+                "(SELECT 1 FROM jobs WHERE jobs.batch_id = batches.id)", (older_than,)
+            )
+        return [self._record(row) for row in rows]
+
+    def create_batch(self, record):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO batches (id, created_ts, data) VALUES (?, ?, ?)",
+                (record['id'], time.time(), json.dumps(record, ensure_ascii=False))
+            )
+
+    def get_batch(self, batch_id):
+        row = self._conn().execute("SELECT data FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return self._record(row)
+
+    def batch_jobs(self, batch_id):
+        rows = self._conn().execute(
+            "SELECT data FROM jobs WHERE batch_id = ? ORDER BY created_ts, rowid", (batch_id,)
+        ).fetchall()
+        return [self._record(row) for row in rows]
+
+job_store = JobStore(app.config['JOB_DB_PATH'])
+
+# Despierta a los hilos consumidores cuando este proceso encola una tarea; las
+# encoladas por otros workers se detectan por sondeo (JOB_POLL_SECONDS)
+_job_wakeup = threading.Event()
+JOB_POLL_SECONDS = _env_float("JOB_POLL_SECONDS", 1.0)
+# Intervalo mínimo entre actualizaciones de progreso publicadas por una tarea
+PROGRESS_MIN_INTERVAL = _env_float("PROGRESS_MIN_INTERVAL", 0.5)
+
+_export_locks = {}
+_export_locks_guard = threading.Lock()
+
+# Formatos con maquetación opcional de marcas de tiempo (SRT/VTT/JSON ya las llevan)
+TIMESTAMP_FORMATS = ('pdf', 'docx')
+
+def export_job_output(job_id, fmt, timestamps=False):
+    """Ruta del resultado de una tarea en `fmt`, renderizándolo una sola vez desde la transcripción intermedia"""
+    # La variante con marcas de tiempo se cachea aparte ('pdf+timestamps')
+    timestamps = timestamps and fmt in TIMESTAMP_FORMATS
+    key = f"{fmt}+timestamps" if timestamps else fmt
+    with _export_locks_guard:
+        lock = _export_locks.setdefault((job_id, key), threading.Lock())
+    with lock:
+        job = job_store.get(job_id)
+        path = (job.get('exports') or {}).get(key)
+        if path and os.path.exists(path):
+            return path
+        transcript_path = job.get('transcript_path')
+        if not transcript_path or not os.path.exists(transcript_path):
+            raise FileNotFoundError(f"Transcripción intermedia no encontrada para {job_id}")
+        suffix = '.timestamps' if timestamps else ''
+        path = os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}{suffix}.{fmt}")
+        # Renderizar a un temporal y renombrar: otro worker puede estar exportando lo mismo
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            render_transcript(load_transcript(transcript_path), fmt, tmp_path, timestamps=timestamps)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        job_store.mutate(job_id, lambda record: record.setdefault('exports', {}).__setitem__(key, path))
+        return path
+
+def process_job(job):
+    """Procesar una tarea ya reclamada de la cola"""
+    job_id = job['id']
+    started = time.time()
+    last_progress = {'at': 0.0}
+    try:
+        def _progress(pct, meta=None):
+            # Agrupar actualizaciones: una tarea rápida no debe inundar la base ni a los clientes
+            now = time.time()
+            if now - last_progress['at'] < PROGRESS_MIN_INTERVAL and pct < 99:
+                return
+            last_progress['at'] = now
+            fields = {'progress': pct}
+            if meta:
+                fields['meta'] = meta
+            job_store.update(job_id, **fields)
+        # Un reintento empieza de cero: descartar parciales del intento anterior
+        job_store.clear_segments(job_id)
+        stats = {'timings': dict(job.get('timings') or {})}
+        if job.get('created_at') and job.get('started_at'):
+            waited = datetime.datetime.fromisoformat(job['started_at']) - datetime.datetime.fromisoformat(job['created_at'])
+            stats['timings']['queue_wait'] = round(waited.total_seconds(), 4)
+        text, segments = transcribe_cached(
+            job['input_path'], job['language'], audio_hash=job.get('audio_sha256'),
+            progress_callback=_progress, stats=stats, model_name=job.get('model'),
+            duration_hint=job.get('audio_duration_estimate'),
+            segment_callback=lambda first, segs: job_store.append_segments(job_id, first, segs)
+        )
+        metadata = {
+            'filename': job['original_filename'],
+            'timestamp': job['timestamp']
+        }
+        if segments:
+            last_segment = segments[-1]
+            if 'end' in last_segment:
+                metadata['duration'] = last_segment['end']
+        if stats.get('language_detected'):
+            metadata['language'] = stats['language_detected']['language']
+        # Transcripción intermedia: el resto de formatos se generan desde aquí bajo demanda
+        transcript_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}.transcript.json.gz")
+        with timed_stage(stats['timings'], 'save_transcript'):
+            save_transcript(transcript_path, text, segments, metadata)
+        job_store.update(job_id, transcript_path=transcript_path)
+        with timed_stage(stats['timings'], 'render'):
+            output_path = export_job_output(job_id, job['format'], timestamps=job.get('timestamps', False))
+        output_filename = f"{job['timestamp']}_transcription.{job['format']}"
+        with timed_stage(stats['timings'], 'cleanup'):
+            if os.path.exists(job['input_path']):
+                os.remove(job['input_path'])
+        processing_seconds = round(time.time() - started, 2)
+        job_store.update(
+            job_id,
+            status=JobStatus.DONE,
+            progress=100,
+            output_path=output_path,
+            download_name=output_filename,
+            audio_duration=stats.get('audio_duration'),
+            peak_rss_mb=stats.get('peak_rss_mb'),
+            model_used=stats.get('model'),
+            cache_hit=stats.get('cache_hit', False),
+            vad_skipped_seconds=stats.get('vad_skipped_seconds'),
+            language_detected=stats.get('language_detected'),
+            processing_seconds=processing_seconds,
+            timings=stats['timings'],
+            chunk_inference_seconds=stats.get('chunk_inference_seconds'),
+            finished_at=datetime.datetime.utcnow().isoformat()
+        )
+        record_transcription_metrics(job.get('mode', 'async'), 'done', stats, total_seconds=processing_seconds)
+    except Exception as e:
+        logger.error(f"Job {job_id} error: {e}")
+        job_store.update(job_id, status=JobStatus.ERROR, error=str(e))
+        record_transcription_metrics(job.get('mode', 'async'), 'error', locals().get('stats'))
+    finally:
+        # Limpieza del archivo de entrada
+        try:
+            if os.path.exists(job['input_path']):
+                os.remove(job['input_path'])
+        except Exception:
+            pass
+
+def batch_group_size():
+    """Tareas cortas de un mismo lote que un worker procesa a la vez (BATCH_GROUP_SIZE).
+
+    Por defecto BATCH_MAX_SIZE cuando el motor de lotes está activo: así las ventanas
+    de los hermanos llegan juntas al motor y comparten cada paso del encoder. Sin motor
+    no hay nada que compartir y las tareas del lote se procesan una a una.
+    """
+    try:
+        size = int(os.environ.get("BATCH_GROUP_SIZE", "0"))
+    except ValueError:
+        size = 0
+    if size <= 0:
+        size = BATCH_MAX_SIZE if get_batch_engine() is not None else 1
+    return max(1, size)
+
+def claim_batch_group(job):
+    """Hermanos cortos de `job` (del mismo lote) reclamados para procesarse junto a él"""
+    size = batch_group_size()
+    cost = job.get('audio_duration_estimate')
+    if size <= 1 or not job.get('batch_id') or cost is None or cost > WHISPER_WINDOW_SECONDS:
+        return []
+    try:
+        return job_store.claim_siblings(job['batch_id'], size - 1, WHISPER_WINDOW_SECONDS)
+    except sqlite3.Error as e:
+        logger.warning(f"Error reclamando tareas del lote {job['batch_id']}: {e}")
+        return []
+
 def worker_loop():
     while True:
-        job = job_queue.get()
+        try:
+            job = job_store.claim_next()
+        except sqlite3.Error as e:
+            logger.error(f"Error reclamando tarea: {e}")
+            job = None
         if job is None:
+            _job_wakeup.wait(JOB_POLL_SECONDS)
+            _job_wakeup.clear()
+            continue
+        siblings = claim_batch_group(job)
+        if siblings:
+            logger.info(f"[Lote {job['batch_id']}] Procesando {len(siblings) + 1} tareas cortas a la vez")
+        threads = [threading.Thread(target=process_job, args=(sibling,), daemon=True) for sibling in siblings]
+        for thread in threads:
+            thread.start()
+        process_job(job)
+        for thread in threads:
+            thread.join()
+
+def heartbeat_loop():
+    """Renovar los leases de este proceso y recuperar tareas de workers caídos"""
+    interval = max(1.0, JOB_LEASE_SECONDS / 4)
+    while True:
+        try:
+            job_store.heartbeat()
+            if job_store.requeue_stale():
+                _job_wakeup.set()
+        except sqlite3.Error as e:
+            logger.warning(f"Error renovando leases de tareas: {e}")
+        time.sleep(interval)
+
+# Hilos consumidores de la cola: con pool de procesos conviene uno por proceso para
+# que los chunks de distintas tareas se intercalen en el pool
+try:
+    ASYNC_WORKERS = max(1, int(os.environ.get("ASYNC_WORKERS", max(1, _pool_size()))))
+except ValueError:
+    ASYNC_WORKERS = 1
+
+if ENABLE_ASYNC and not _is_pool_child():
+    # Al arrancar: tareas de procesos anteriores con lease vencido vuelven a la cola
+    recovered = job_store.requeue_stale()
+    pending = job_store.count_by_status().get(JobStatus.PENDING, 0)
+    for _ in range(ASYNC_WORKERS):
+        threading.Thread(target=worker_loop, daemon=True).start()
+    threading.Thread(target=heartbeat_loop, daemon=True).start()
+    logger.info(f"Cola asíncrona iniciada ({ASYNC_WORKERS} hilos, {pending} pendientes, {recovered} recuperadas)")
+
+#############################################
+# RETENCIÓN Y LIMPIEZA                      #
+#############################################
+# Un hilo por proceso barre periódicamente: tareas terminadas con más de JOB_TTL_HOURS
+# (o por encima de JOB_MAX_FINISHED) se borran de la base junto con sus archivos;
+# outputs/ se limpia por antigüedad y se mantiene bajo OUTPUT_QUOTA_MB expulsando
+# primero lo más antiguo; en uploads/ se borran los restos sin tarea activa (entradas
+# de procesos caídos, partes de subidas abandonadas). Los archivos de una tarea que sigue
+# en la base nunca se borran sueltos: si hace falta espacio se purga la tarea entera,
+# empezando por las terminadas más antiguas. Con varios workers el barrido es idempotente.
+
+JOB_TTL_HOURS = _env_float("JOB_TTL_HOURS", 24)
+JOB_MAX_FINISHED = int(os.environ.get("JOB_MAX_FINISHED", "10000"))
+OUTPUT_TTL_HOURS = _env_float("OUTPUT_TTL_HOURS", 24)
+OUTPUT_QUOTA_MB = _env_float("OUTPUT_QUOTA_MB", 2048)
+UPLOAD_TTL_HOURS = _env_float("UPLOAD_TTL_HOURS", 6)
+RETENTION_SWEEP_SECONDS = _env_float("RETENTION_SWEEP_SECONDS", 300)
+# La cuota nunca expulsa archivos recién escritos (una descarga síncrona en curso, un render)
+RETENTION_GRACE_SECONDS = 300
+
+retention_state = {'last_sweep_at': None, 'last_sweep': None}
+
+# Recuentos de /health (tareas por estado y uso de disco): los mide el barrido de
+# retención y /health devuelve la última medida. Sin barrido (o si lleva tiempo sin
+# correr) se vuelven a medir como mucho cada HEALTH_STATS_SECONDS
+HEALTH_STATS_SECONDS = _env_float("HEALTH_STATS_SECONDS", 60)
+_health_stats = {'jobs': None, 'disk': None, 'measured_at': None, 'measured': 0.0}
+_health_stats_lock = threading.Lock()
+
+def _folder_files(folder):
+    """(mtime, tamaño, ruta) de los archivos de `folder`"""
+    files = []
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return files
+    for name in names:
+        path = os.path.join(folder, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if os.path.isfile(path):
+            files.append((st.st_mtime, st.st_size, path))
+    return files
+
+def _job_files(record):
+    """Rutas de disco que pertenecen a una tarea"""
+    paths = [record.get('input_path'), record.get('output_path'), record.get('transcript_path')]
+    paths.extend((record.get('exports') or {}).values())
+    return {os.path.normpath(p) for p in paths if p}
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+def _remove_job_files(records):
+    """Borrar los archivos de tareas ya purgadas; devuelve los bytes liberados"""
+    freed = 0
+    for record in records:
+        for path in _job_files(record):
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if _remove_file(path):
+                freed += size
+    return freed
+
+def disk_usage():
+    """MB usados en outputs/, uploads/ y caché"""
+    usage = {}
+    for key, folder in (('outputs', app.config['OUTPUT_FOLDER']), ('uploads', app.config['UPLOAD_FOLDER']),
+                        ('cache', app.config['CACHE_FOLDER'])):
+        files = _folder_files(folder)
+        usage[key] = {'files': len(files), 'mb': round(sum(size for _, size, _ in files) / (1024 * 1024), 2)}
+    usage['outputs']['quota_mb'] = OUTPUT_QUOTA_MB or None
+    return usage
+
+def refresh_health_stats():
+    """Medir tareas por estado y uso de disco y guardarlos para /health"""
+    counts = job_store.count_by_status()
+    disk = disk_usage()
+    _health_stats.update(
+        jobs=dict(total=sum(counts.values()), **counts), disk=disk,
+        measured_at=datetime.datetime.now().isoformat(), measured=time.monotonic()
+    )
+    return _health_stats
+
+def health_stats():
+    """Últimos recuentos medidos; solo se miden aquí si faltan o han caducado"""
+    max_age = max(HEALTH_STATS_SECONDS, 2 * RETENTION_SWEEP_SECONDS)
+    if _health_stats['measured_at'] is not None and time.monotonic() - _health_stats['measured'] < max_age:
+        return _health_stats
+    # Una sola petición mide; las demás devuelven la medida anterior si la hay
+    if not _health_stats_lock.acquire(blocking=_health_stats['measured_at'] is None):
+        return _health_stats
+    try:
+        if _health_stats['measured_at'] is None or time.monotonic() - _health_stats['measured'] >= max_age:
+            refresh_health_stats()
+        return _health_stats
+    finally:
+        _health_stats_lock.release()
+
+def sweep_retention(now=None):
+    """Una pasada de limpieza; devuelve lo que se borró"""
+    now = now or time.time()
+    result = {'jobs': 0, 'outputs': 0, 'uploads': 0, 'freed_mb': 0.0}
+    freed = 0
+
+    # 1. Tareas terminadas caducadas o por encima del límite, con sus archivos
+    purged = job_store.purge_finished(now - JOB_TTL_HOURS * 3600, JOB_MAX_FINISHED or None)
+    freed += _remove_job_files(purged)
+    result['jobs'] = len(purged)
+
+    # Los archivos de cualquier tarea que siga en la base (también las terminadas dentro de
+    # JOB_TTL_HOURS) no se borran sueltos: /jobs/<id>/download los necesita para re-exportar
+    protected = set()
+    for record in job_store.retained_records():
+        protected |= _job_files(record)
+
+    # 2. outputs/: los archivos sin tarea por antigüedad y luego por cuota, lo más antiguo primero
+    output_files = _folder_files(app.config['OUTPUT_FOLDER'])
+    files = sorted(f for f in output_files if os.path.normpath(f[2]) not in protected)
+    total = sum(size for _, size, _ in output_files)
+    quota = OUTPUT_QUOTA_MB * 1024 * 1024
+    for mtime, size, path in files:
+        expired = mtime < now - OUTPUT_TTL_HOURS * 3600
+        if not expired and (not quota or total <= quota or mtime >= now - RETENTION_GRACE_SECONDS):
             break
-        job_id = job['id']
-        with jobs_lock:
-            jobs[job_id]['status'] = JobStatus.PROCESSING
-            jobs[job_id]['progress'] = 1
+        if _remove_file(path):
+            total -= size
+            freed += size
+            result['outputs'] += 1
+
+    # 2b. Si las tareas terminadas siguen ocupando más de la cuota, se purgan tareas enteras
+    # (registro y archivos), de la más antigua a la más reciente: ninguna queda sin archivos
+    if quota and total > quota:
+        finished = job_store.finished_by_age()
+        output_sizes = {os.path.normpath(path): size for _, size, path in output_files}
+        drop = 0
+        for updated_at, record in finished:
+            if total <= quota or updated_at >= now - RETENTION_GRACE_SECONDS:
+                break
+            total -= sum(output_sizes.get(path, 0) for path in _job_files(record))
+            drop += 1
+        if drop:
+            purged = job_store.purge_finished(now - JOB_TTL_HOURS * 3600, len(finished) - drop)
+            freed += _remove_job_files(purged)
+            result['jobs'] += len(purged)
+
+    # 3. uploads/: restos sin tarea activa. Las subidas reanudables (<id>.part + <id>.json)
+    # cuentan como activas mientras cualquiera de los dos archivos se haya tocado hace poco
+    last_touch = {}
+    for mtime, size, path in _folder_files(app.config['UPLOAD_FOLDER']):
+        base = os.path.splitext(path)[0]
+        last_touch[base] = max(last_touch.get(base, 0), mtime)
+    for mtime, size, path in _folder_files(app.config['UPLOAD_FOLDER']):
+        if os.path.normpath(path) in protected:
+            continue
+        base = os.path.splitext(path)[0]
+        if last_touch[base] >= now - UPLOAD_TTL_HOURS * 3600:
+            continue
+        if _remove_file(path):
+            freed += size
+            result['uploads'] += 1
+            upload_id = os.path.basename(base)
+            with _resumable_lock:
+                _resumable_hashers.pop(upload_id, None)
+
+    # 4. Estado en memoria: locks de exportación libres y hashes de subidas que ya no existen
+    with _export_locks_guard:
+        for key in [k for k, lock in _export_locks.items() if not lock.locked()]:
+            del _export_locks[key]
+    with _resumable_lock:
+        for upload_id in list(_resumable_hashers):
+            if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], f"{upload_id}.part")):
+                del _resumable_hashers[upload_id]
+
+    result['freed_mb'] = round(freed / (1024 * 1024), 2)
+    retention_state['last_sweep_at'] = datetime.datetime.utcnow().isoformat()
+    retention_state['last_sweep'] = result
+    with _health_stats_lock:
+        refresh_health_stats()
+    if any(result[k] for k in ('jobs', 'outputs', 'uploads')):
+        logger.info(f"[Retención] Borradas {result['jobs']} tareas, {result['outputs']} salidas y "
+                    f"{result['uploads']} restos de subida ({result['freed_mb']} MB)")
+    return result
+
+def retention_loop():
+    while True:
         try:
-            def _progress(pct, meta=None):
-                with jobs_lock:
-                    if job_id in jobs:
-                        jobs[job_id]['progress'] = pct
-                        if meta:
-                            jobs[job_id]['meta'] = meta
-            text, segments = transcribe_audio(job['input_path'], job['language'], progress_callback=_progress)
-            metadata = {
-                'filename': job['original_filename'],
-                'timestamp': job['timestamp']
-            }
-            if segments:
-                last_segment = segments[-1]
-                if 'end' in last_segment:
-                    metadata['duration'] = last_segment['end']
-            output_filename = f"{job['timestamp']}_transcription.{job['format']}"
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-            if job['format'] == 'pdf':
-                create_pdf_with_reportlab(text, output_path, metadata)
-            else:
-                create_docx(text, output_path, metadata)
-            with jobs_lock:
-                jobs[job_id]['status'] = JobStatus.DONE
-                jobs[job_id]['progress'] = 100
-                jobs[job_id]['output_path'] = output_path
-                jobs[job_id]['download_name'] = output_filename
+            sweep_retention()
         except Exception as e:
-            logger.error(f"Job {job_id} error: {e}")
-            with jobs_lock:
-                jobs[job_id]['status'] = JobStatus.ERROR
-                jobs[job_id]['error'] = str(e)
-        finally:
-            # Limpieza del archivo de entrada
-            try:
-                if os.path.exists(job['input_path']):
-                    os.remove(job['input_path'])
-            except Exception:
-                pass
-            job_queue.task_done()
+            logger.warning(f"[Retención] Error en el barrido: {e}")
+        time.sleep(RETENTION_SWEEP_SECONDS)
+
+if RETENTION_SWEEP_SECONDS > 0 and not _is_pool_child():
+    threading.Thread(target=retention_loop, daemon=True).start()
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métricas en formato Prometheus (agregadas de todos los workers vía SQLite)"""
+    counts = job_store.count_by_status()
+    gauges = [
+        ('transcribe_queue_depth', 'Tareas pendientes en la cola', [({}, counts.get(JobStatus.PENDING, 0))]),
+        ('transcribe_active_jobs', 'Tareas en proceso', [({}, counts.get(JobStatus.PROCESSING, 0))]),
+        ('transcribe_jobs', 'Tareas en la base por estado', [({'status': s}, n) for s, n in sorted(counts.items())]),
+    ]
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+#############################################
+# CONTROL DE ADMISIÓN (TRANSCRIPCIÓN SÍNCRONA) #
+#############################################
+
+# /transcribe pasa por la misma cola acotada que las tareas asíncronas: la petición
+# solo espera el resultado, así que nunca hay más inferencias que hilos consumidores.
+# Tiempo máximo que una petición síncrona puede esperar (por debajo del timeout de gunicorn)
+SYNC_TIMEOUT_SECONDS = _env_float("SYNC_TIMEOUT_SECONDS", 540)
+# Peticiones síncronas esperando a la vez; el resto de hilos quedan libres para /health, /jobs...
+SYNC_MAX_WAITING = max(1, int(os.environ.get("SYNC_MAX_WAITING", 4)))
+# Qué hacer con lo que no cabe: 'async' (convertir en tarea, 202) o 'reject' (429/503 con Retry-After)
+SYNC_OVERLOAD = os.environ.get("SYNC_OVERLOAD", "async").lower()
+SYNC_OVERLOAD_POLICIES = ('async', 'reject')
+if SYNC_OVERLOAD not in SYNC_OVERLOAD_POLICIES:
+    SYNC_OVERLOAD = 'async'
+
+_sync_slots = threading.BoundedSemaphore(SYNC_MAX_WAITING)
+
+def _overload_policy():
+    """Política de sobrecarga de la petición: ?on_overload=, cabecera X-On-Overload o SYNC_OVERLOAD"""
+    policy = (request.args.get('on_overload') or request.headers.get('X-On-Overload') or SYNC_OVERLOAD).lower()
+    return policy if policy in SYNC_OVERLOAD_POLICIES else SYNC_OVERLOAD
 
-if ENABLE_ASYNC:
-    job_queue = queue_module.Queue()
-    threading.Thread(target=worker_loop, daemon=True).start()
-    logger.info("Cola asíncrona iniciada")
+def _retry_after(seconds):
+    """Valor de Retry-After: segundos enteros, al menos 1"""
+    return str(max(1, int(math.ceil(seconds))))
+
+def admission_estimate(media, audio_hash, language, model_name, priority):
+    """Segundos estimados de espera en cola y de proceso para un archivo recién recibido.
+
+    Un acierto de la caché de transcripciones no cuesta inferencia.
+    """
+    wait, rtf = job_store.backlog_seconds(ASYNC_WORKERS, priority)
+    if audio_hash and transcript_cache.contains(
+            TranscriptCache.make_key(audio_hash, decoding_fingerprint(language, model_name))):
+        return wait, 0.0
+    duration = media.get('duration')
+    return wait, (duration if duration is not None else DEFAULT_JOB_COST) * rtf
+
+def _async_accepted(job_id, reason):
+    """202: la petición síncrona se convirtió en tarea; el cliente sigue en /jobs/<id>"""
+    metrics.inc('transcribe_admission_total', decision=f'async_{reason}')
+    position, eta_seconds = job_store.queue_position(job_id, ASYNC_WORKERS)
+    response = jsonify({
+        'job_id': job_id,
+        'status': 'queued' if position is not None else 'processing',
+        'reason': reason,
+        'queue_position': position,
+        'estimated_start_seconds': round(eta_seconds, 1) if eta_seconds is not None else None,
+        'status_url': f'/jobs/{job_id}',
+        'events_url': f'/jobs/{job_id}/events',
+        'download_url': f'/jobs/{job_id}/download'
+    })
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response
+
+def _sync_job_response(job):
+    """Resultado de una tarea síncrona terminada, con las mismas cabeceras que la ruta en línea"""
+    output_path = export_job_output(job['id'], job['format'], timestamps=job.get('timestamps', False))
+    response = send_file(
+        output_path,
+        as_attachment=True,
+        download_name=job.get('download_name', f"{job['timestamp']}_transcription.{job['format']}"),
+        mimetype=EXPORT_MIMETYPES[job['format']]
+    )
+    response.headers['X-Job-Id'] = job['id']
+    if job.get('language_detected'):
+        response.headers['X-Detected-Language'] = job['language_detected']['language']
+    response.headers['Server-Timing'] = ', '.join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in (job.get('timings') or {}).items()
+    )
+    return response
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     """Endpoint principal para transcribir audio"""
+    if not ENABLE_ASYNC:
+        return transcribe_inline()
+    request_started = time.perf_counter()
+    policy = _overload_policy()
+    # Cupo de esperas síncronas: si está lleno y hay que rechazar, se responde antes de leer el cuerpo
+    acquired = _sync_slots.acquire(blocking=False)
+    if not acquired and policy == 'reject':
+        metrics.inc('transcribe_admission_total', decision='reject_busy')
+        wait, _ = job_store.backlog_seconds(ASYNC_WORKERS, 'high')
+        response = jsonify({'error': 'Demasiadas transcripciones síncronas en curso, reintenta más tarde'})
+        response.status_code = 429
+        response.headers['Retry-After'] = _retry_after(wait / SYNC_MAX_WAITING)
+        return response
+    try:
+        try:
+            options = job_options()
+            # Quien espera en línea va por delante de los lotes, salvo que pida otra prioridad
+            if 'priority' not in request.form:
+                options['priority'] = 'high'
+            input_path, filename, timestamp, upload_size, audio_hash, media = receive_audio()
+        except UploadError as e:
+            return e.response()
+        timings = {'upload': round(time.perf_counter() - request_started, 4)}
+        deadline = time.monotonic() + SYNC_TIMEOUT_SECONDS - timings['upload']
+
+        def _enqueue(mode):
+            return enqueue_job(options, input_path, filename, timestamp, upload_size, audio_hash, media,
+                               timings=timings, mode=mode)
+
+        # Sin cupo para esperar: solo cabe como tarea asíncrona
+        if not acquired:
+            return _async_accepted(_enqueue('async'), 'busy')
+        wait, processing = admission_estimate(
+            media, audio_hash, options['language'], options['model'], options['priority']
+        )
+        remaining = deadline - time.monotonic()
+        if wait + processing > remaining:
+            logger.info(f"Admisión: {filename} no cabe en {remaining:.0f}s "
+                        f"(cola {wait:.0f}s + proceso {processing:.0f}s), política {policy}")
+            if policy == 'async':
+                return _async_accepted(_enqueue('async'), 'overload')
+            os.remove(input_path)
+            metrics.inc('transcribe_admission_total', decision='reject_overload')
+            response = jsonify({
+                'error': 'El servidor no puede terminar esta transcripción dentro del tiempo límite',
+                'estimated_wait_seconds': round(wait, 1),
+                'estimated_processing_seconds': round(processing, 1),
+                'timeout_seconds': SYNC_TIMEOUT_SECONDS
+            })
+            response.status_code = 503
+            # Reintentar solo tiene sentido si el archivo cabe con la cola vacía
+            if processing <= SYNC_TIMEOUT_SECONDS:
+                response.headers['Retry-After'] = _retry_after(wait)
+            return response
+
+        metrics.inc('transcribe_admission_total', decision='accept')
+        job_id = _enqueue('sync')
+        version = -1
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # La estimación falló: la tarea sigue en la cola y el cliente la recoge después
+                logger.info(f"Transcripción síncrona {job_id} supera el tiempo límite, sigue como tarea")
+                return _async_accepted(job_id, 'timeout')
+            job = job_store.wait_for_update(job_id, version, min(remaining, LONG_POLL_MAX_SECONDS))
+            if not job:
+                return jsonify({'error': 'Job no encontrado'}), 500
+            version = job.get('version', version)
+            if job['status'] == JobStatus.DONE:
+                return _sync_job_response(job)
+            if job['status'] == JobStatus.ERROR:
+                error = job.get('error') or ''
+                if "ffmpeg" in error.lower():
+                    return jsonify({
+                        'error': 'Error de FFmpeg. Por favor instala FFmpeg para procesar archivos de audio.',
+                        'details': error,
+                        'solution': 'Instala FFmpeg desde https://ffmpeg.org/download.html o usa: winget install ffmpeg'
+                    }), 500
+                return jsonify({'error': f'Error interno del servidor: {error}', 'job_id': job_id}), 500
+    except HTTPException:
+        # 413/415 detectados mientras se recibe el cuerpo: los atienden los errorhandler
+        raise
+    except Exception as e:
+        logger.error(f"Error en transcripción: {str(e)}")
+        return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
+    finally:
+        if acquired:
+            _sync_slots.release()
+
+def transcribe_inline():
+    """Transcripción dentro de la petición (ENABLE_ASYNC=0: no hay hilos consumidores)"""
+    request_started = time.perf_counter()
+    stats = {'timings': {}}
     try:
-        # Verificar si se envió un archivo
-        if 'audio' not in request.files:
-            return jsonify({'error': 'No se encontró archivo de audio'}), 400
-        
-        file = request.files['audio']
-        
-        if file.filename == '':
-            return jsonify({'error': 'No se seleccionó archivo'}), 400
-        
-        if not allowed_file(file.filename):
-            return jsonify({
-                'error': 'Formato de archivo no soportado',
-                'supported_formats': list(ALLOWED_EXTENSIONS)
-            }), 400
-        
         # Obtener parámetros opcionales
         output_format = request.form.get('format', 'pdf').lower()
         language = request.form.get('lang', 'spanish').lower()
         if language not in SUPPORTED_LANGUAGES:
             language = 'spanish'
-        if output_format not in ['pdf', 'docx']:
-            return jsonify({'error': 'Formato de salida debe ser "pdf" o "docx"'}), 400
-        
-        # Guardar archivo temporal
-        filename = secure_filename(file.filename)
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp}_{filename}")
-        
-        # Asegurar que el directorio existe
-        os.makedirs(os.path.dirname(input_path), exist_ok=True)
-        
-        file.save(input_path)
-        logger.info(f"Archivo guardado: {input_path}")
-        
-        # Verificar que el archivo se guardó correctamente
-        if not os.path.exists(input_path):
-            raise FileNotFoundError(f"No se pudo guardar el archivo en: {input_path}")
+        model_name = request.form.get('model', MODEL).strip() or MODEL
+        # Maquetación con marcas de tiempo (PDF y DOCX)
+        timestamps = request.form.get('timestamps', '0').lower() in ('1', 'true', 'on')
+        model_error = model_admissible(model_name)
+        if model_error:
+            return jsonify({'error': model_error, 'models_allowed': ALLOWED_MODELS}), 400
+        if output_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Formato de salida debe ser uno de: {", ".join(EXPORT_FORMATS)}'}), 400
         
-        file_size = os.path.getsize(input_path)
-        logger.info(f"Archivo guardado correctamente. Tamaño: {file_size} bytes")
+        # Recibir el archivo (ya escrito en disco, con hash y cabecera sondeada)
+        try:
+            input_path, filename, timestamp, upload_size, audio_hash, media = receive_audio()
+        except UploadError as e:
+            return e.response()
+        stats['timings']['upload'] = round(time.perf_counter() - request_started, 4)
+        processing_started = time.perf_counter()
         
         # Transcribir audio
         logger.info("Iniciando transcripción...")
-        transcription_text, segments = transcribe_audio(input_path, language=language)
+        transcription_text, segments = transcribe_cached(
+            input_path, language, audio_hash=audio_hash, model_name=model_name,
+            duration_hint=media.get('duration'), stats=stats
+        )
         
         # Verificar que hay contenido (pero permitir el mensaje de "no speech")
         if not transcription_text or transcription_text.strip() == "":
@@ -676,32 +4128,46 @@ def transcribe():
             last_segment = segments[-1]
             if 'end' in last_segment:
                 metadata['duration'] = last_segment['end']
+        if stats.get('language_detected'):
+            metadata['language'] = stats['language_detected']['language']
         
         # Crear archivo de salida
         output_filename = f"{timestamp}_transcription.{output_format}"
         output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
         
-        if output_format == 'pdf':
-            create_pdf_with_reportlab(transcription_text, output_path, metadata)
-        else:  # docx
-            create_docx(transcription_text, output_path, metadata)
+        with timed_stage(stats['timings'], 'render'):
+            render_transcript(
+                {'text': transcription_text, 'segments': segments, 'metadata': metadata},
+                output_format, output_path, timestamps=timestamps
+            )
         
         # Limpiar archivo temporal
         try:
-            if os.path.exists(input_path):
-                os.remove(input_path)
-                logger.info(f"Archivo temporal eliminado: {input_path}")
+            with timed_stage(stats['timings'], 'cleanup'):
+                if os.path.exists(input_path):
+                    os.remove(input_path)
+                    logger.info(f"Archivo temporal eliminado: {input_path}")
         except Exception as cleanup_error:
             logger.warning(f"No se pudo eliminar archivo temporal: {cleanup_error}")
+        record_transcription_metrics('sync', 'done', stats, total_seconds=time.perf_counter() - processing_started)
         
-        # Retornar archivo
-        return send_file(
+        # Retornar archivo (con los tiempos por etapa en Server-Timing, en ms)
+        response = send_file(
             output_path,
             as_attachment=True,
             download_name=output_filename,
-            mimetype='application/pdf' if output_format == 'pdf' else 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+            mimetype=EXPORT_MIMETYPES[output_format]
+        )
+        if stats.get('language_detected'):
+            response.headers['X-Detected-Language'] = stats['language_detected']['language']
+        response.headers['Server-Timing'] = ', '.join(
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stats['timings'].items()
         )
+        return response
         
+    except HTTPException:
+        # 413/415 detectados mientras se recibe el cuerpo: los atienden los errorhandler
+        raise
     except FileNotFoundError as e:
         logger.error(f"Archivo no encontrado: {str(e)}")
         return jsonify({'error': f'Archivo no encontrado: {str(e)}'}), 400
@@ -710,6 +4176,7 @@ def transcribe():
         return jsonify({'error': f'Error de permisos de archivo: {str(e)}'}), 403
     except Exception as e:
         logger.error(f"Error en transcripción: {str(e)}")
+        record_transcription_metrics('sync', 'error', stats)
         
         # Limpiar archivo temporal en caso de error
         try:
@@ -728,62 +4195,319 @@ def transcribe():
         else:
             return jsonify({'error': f'Error interno del servidor: {str(e)}'}), 500
 
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Iniciar una subida reanudable; el cliente envía después los bloques con PUT"""
+    payload = request.get_json(silent=True) or request.form
+    filename = secure_filename(payload.get('filename') or '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Formato de archivo no soportado', 'supported_formats': list(ALLOWED_EXTENSIONS)}), 400
+    size = payload.get('size')
+    try:
+        size = int(size) if size is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Parámetro size inválido'}), 400
+    if size is not None and size > app.config['MAX_CONTENT_LENGTH']:
+        return too_large(None)
+    upload_id = resumable_create(filename, size)
+    return jsonify({'upload_id': upload_id, 'offset': 0, 'size': size}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def upload_status(upload_id):
+    """Bytes recibidos hasta ahora (para reanudar tras un corte)"""
+    try:
+        info = resumable_info(upload_id)
+    except UploadError as e:
+        return e.response()
+    response = jsonify(info)
+    response.headers['Upload-Offset'] = str(info['offset'])
+    return response
+
+@app.route('/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+def upload_chunk(upload_id):
+    """Añadir un bloque. Cabecera Content-Range: bytes <inicio>-<fin>/<total|*>"""
+    content_range = request.headers.get('Content-Range')
+    start, total = 0, None
+    if content_range:
+        match = re.match(r'^bytes (\d+)-(\d+)/(\d+|\*)$', content_range.strip())
+        if not match:
+            return jsonify({'error': 'Cabecera Content-Range inválida'}), 400
+        start = int(match.group(1))
+        total = int(match.group(3)) if match.group(3) != '*' else None
+    else:
+        start = int(request.headers.get('Upload-Offset', 0) or 0)
+    try:
+        offset = resumable_append(upload_id, start, total, request.stream)
+        info = resumable_info(upload_id)
+    except UploadError as e:
+        return e.response()
+    response = jsonify(info)
+    response.headers['Upload-Offset'] = str(offset)
+    return response
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    try:
+        resumable_info(upload_id)
+        resumable_delete(upload_id)
+    except UploadError as e:
+        return e.response()
+    return jsonify({'upload_id': upload_id, 'deleted': True})
+
+def job_options():
+    """Opciones de una tarea en cola a partir del formulario (comunes a /transcribe_async y /batches).
+
+    Lanza UploadError si el modelo o el formato no son válidos.
+    """
+    output_format = request.form.get('format', 'pdf').lower()
+    language = request.form.get('lang', 'spanish').lower()
+    if language not in SUPPORTED_LANGUAGES:
+        language = 'spanish'
+    model_name = request.form.get('model', MODEL).strip() or MODEL
+    model_error = model_admissible(model_name)
+    if model_error:
+        raise UploadError(model_error, 400, {'models_allowed': ALLOWED_MODELS})
+    if output_format not in EXPORT_FORMATS:
+        raise UploadError(f'Formato de salida debe ser uno de: {", ".join(EXPORT_FORMATS)}')
+    priority = request.form.get('priority', 'normal').lower()
+    if priority not in JOB_PRIORITIES:
+        priority = 'normal'
+    return {
+        'format': output_format,
+        # Maquetación con marcas de tiempo (PDF y DOCX)
+        'timestamps': request.form.get('timestamps', '0').lower() in ('1', 'true', 'on'),
+        'language': language,
+        'model': model_name,
+        'priority': priority,
+        # Identidad del cliente para el reparto justo: cabecera explícita o IP de origen
+        'client': request.headers.get('X-Client-Id') or request.form.get('client_id') or request.remote_addr
+    }
+
+def enqueue_job(options, input_path, filename, timestamp, upload_size, audio_hash, media, timings=None, batch_id=None,
+                mode='async'):
+    """Crear una tarea pendiente para un archivo ya recibido y despertar a los consumidores"""
+    job_id = str(uuid.uuid4())
+    job_record = {
+        'id': job_id,
+        # 'sync' si la creó /transcribe y la espera la petición
+        'mode': mode,
+        'status': JobStatus.PENDING,
+        'progress': 0,
+        'priority': options['priority'],
+        'client': options['client'],
+        'audio_duration_estimate': media.get('duration'),
+        'format': options['format'],
+        'timestamps': options['timestamps'],
+        'language': options['language'],
+        'model': options['model'],
+        'input_path': input_path,
+        'audio_sha256': audio_hash,
+        'size_bytes': upload_size,
+        'container': media.get('container'),
+        'codec': media.get('codec'),
+        'timings': dict(timings or {}),
+        'original_filename': filename,
+        'timestamp': timestamp,
+        'created_at': datetime.datetime.utcnow().isoformat()
+    }
+    if batch_id:
+        job_record['batch_id'] = batch_id
+    job_store.create(job_record)
+    _job_wakeup.set()
+    return job_id
+
 @app.route('/transcribe_async', methods=['POST'])
 def transcribe_async():
     if not ENABLE_ASYNC:
         return jsonify({'error': 'Modo asíncrono deshabilitado'}), 400
+    request_started = time.perf_counter()
     try:
-        if 'audio' not in request.files:
-            return jsonify({'error': 'No se encontró archivo de audio'}), 400
-        file = request.files['audio']
-        if file.filename == '':
-            return jsonify({'error': 'No se seleccionó archivo'}), 400
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Formato de archivo no soportado', 'supported_formats': list(ALLOWED_EXTENSIONS)}), 400
-        output_format = request.form.get('format', 'pdf').lower()
-        language = request.form.get('lang', 'spanish').lower()
-        if language not in SUPPORTED_LANGUAGES:
-            language = 'spanish'
-        if output_format not in ['pdf', 'docx']:
-            return jsonify({'error': 'Formato de salida debe ser "pdf" o "docx"'}), 400
-        filename = secure_filename(file.filename)
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp}_{filename}")
-        os.makedirs(os.path.dirname(input_path), exist_ok=True)
-        file.save(input_path)
-        job_id = str(uuid.uuid4())
-        job_record = {
-            'id': job_id,
-            'status': JobStatus.PENDING,
-            'progress': 0,
-            'format': output_format,
-            'language': language,
-            'input_path': input_path,
-            'original_filename': filename,
-            'timestamp': timestamp,
-            'created_at': datetime.datetime.utcnow().isoformat()
-        }
-        with jobs_lock:
-            jobs[job_id] = job_record
-        job_queue.put(job_record)
-        return jsonify({'job_id': job_id, 'status': 'queued'})
+        try:
+            options = job_options()
+            input_path, filename, timestamp, upload_size, audio_hash, media = receive_audio()
+        except UploadError as e:
+            return e.response()
+        job_id = enqueue_job(
+            options, input_path, filename, timestamp, upload_size, audio_hash, media,
+            # Recepción del cuerpo + hash + sondeo de cabecera
+            timings={'upload': round(time.perf_counter() - request_started, 4)}
+        )
+        position, eta_seconds = job_store.queue_position(job_id, ASYNC_WORKERS)
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'queue_position': position,
+            'estimated_start_seconds': round(eta_seconds, 1) if eta_seconds is not None else None
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creando tarea: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _public_job(job):
+    """Vista pública de una tarea: sin rutas internas y con la posición en cola si está pendiente"""
+    filtered = {k: v for k, v in job.items() if k not in ('input_path', 'transcript_path')}
+    if job['status'] == JobStatus.PENDING:
+        position, eta_seconds = job_store.queue_position(job['id'], ASYNC_WORKERS)
+        if position is not None:
+            filtered['queue_position'] = position
+            filtered['estimated_start_seconds'] = round(eta_seconds, 1)
+            filtered['estimated_start_at'] = (
+                datetime.datetime.utcnow() + datetime.timedelta(seconds=eta_seconds)
+            ).isoformat()
+    return filtered
+
 @app.route('/jobs/<job_id>', methods=['GET'])
 def job_status(job_id):
-    with jobs_lock:
-        job = jobs.get(job_id)
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    return jsonify(_public_job(job))
+
+# Espera máxima de un long-poll y cada cuánto se envía un keep-alive por SSE
+LONG_POLL_MAX_SECONDS = _env_float("LONG_POLL_MAX_SECONDS", 30)
+SSE_KEEPALIVE_SECONDS = _env_float("SSE_KEEPALIVE_SECONDS", 15)
+# Conexiones largas a la vez (SSE, partial.txt, long-poll): cada una ocupa un hilo de
+# gunicorn mientras espera, aunque dormido en el Condition de su tarea (sin CPU ni SQLite).
+# WEB_THREADS es el --threads de gunicorn (Procfile y render.yaml lo leen de la misma
+# variable); el cupo por defecto son todos los hilos salvo los de /transcribe síncrono
+# y STREAM_RESERVED_THREADS para las peticiones cortas (subidas, /jobs, /health)
+WEB_THREADS = max(1, int(os.environ.get("WEB_THREADS", 256)))
+STREAM_RESERVED_THREADS = max(1, int(os.environ.get("STREAM_RESERVED_THREADS", 8)))
+JOB_STREAM_MAX = max(1, int(os.environ.get(
+    "JOB_STREAM_MAX", WEB_THREADS - SYNC_MAX_WAITING - STREAM_RESERVED_THREADS
+)))
+if JOB_STREAM_MAX + SYNC_MAX_WAITING >= WEB_THREADS:
+    logger.warning(
+        f"[Streams] JOB_STREAM_MAX={JOB_STREAM_MAX} y SYNC_MAX_WAITING={SYNC_MAX_WAITING} pueden ocupar "
+        f"los {WEB_THREADS} hilos de WEB_THREADS y dejar sin servicio al resto de peticiones"
+    )
+_job_streams = threading.BoundedSemaphore(JOB_STREAM_MAX)
+
+def _streams_busy():
+    """503 para un stream por encima del cupo; el cliente pasa a sondear /jobs/<id>"""
+    response = jsonify({'error': 'Demasiadas conexiones de seguimiento abiertas, consulta /jobs/<id>'})
+    response.status_code = 503
+    response.headers['Retry-After'] = _retry_after(SSE_KEEPALIVE_SECONDS)
+    return response
+
+def _stream_response(generate, mimetype):
+    """Respuesta en streaming que libera su hueco de _job_streams al cerrarse"""
+    response = Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(_job_streams.release)
+    return response
+
+@app.route('/jobs/<job_id>/wait', methods=['GET'])
+def job_wait(job_id):
+    """Long-poll: responde en cuanto la tarea supera la versión `since` (o al vencer `timeout`)"""
+    try:
+        since = int(request.args.get('since', -1))
+        timeout = min(float(request.args.get('timeout', LONG_POLL_MAX_SECONDS)), LONG_POLL_MAX_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'Parámetros since/timeout inválidos'}), 400
+    # Sin cupo de conexiones largas se responde al momento (sondeo corto)
+    if timeout > 0 and _job_streams.acquire(blocking=False):
+        try:
+            job = job_store.wait_for_update(job_id, since, timeout)
+        finally:
+            _job_streams.release()
+    else:
+        job = job_store.wait_for_update(job_id, since, 0)
     if not job:
         return jsonify({'error': 'Job no encontrado'}), 404
-    filtered = {k: v for k, v in job.items() if k not in ('input_path',)}
-    return jsonify(filtered)
+    body = _public_job(job)
+    body['changed'] = job.get('version', 0) > since
+    return jsonify(body)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream SSE con el progreso de la tarea: eventos progress, y done/error al terminar"""
+    if not job_store.get(job_id):
+        return jsonify({'error': 'Job no encontrado'}), 404
+    try:
+        since = int(request.headers.get('Last-Event-ID', request.args.get('since', -1)))
+    except ValueError:
+        since = -1
+    if not _job_streams.acquire(blocking=False):
+        return _streams_busy()
+
+    def generate():
+        version = since
+        # Pedir al navegador que reintente en 3 s si se corta la conexión
+        yield "retry: 3000\n\n"
+        while True:
+            job = job_store.wait_for_update(job_id, version, SSE_KEEPALIVE_SECONDS)
+            if job is None:
+                yield "event: error\ndata: {\"error\": \"Job no encontrado\"}\n\n"
+                return
+            if job.get('version', 0) <= version and job['status'] not in (JobStatus.DONE, JobStatus.ERROR):
+                yield ": keep-alive\n\n"
+                continue
+            version = job.get('version', 0)
+            event = job['status'] if job['status'] in (JobStatus.DONE, JobStatus.ERROR) else 'progress'
+            payload = json.dumps(_public_job(job), ensure_ascii=False)
+            yield f"id: {version}\nevent: {event}\ndata: {payload}\n\n"
+            if event != 'progress':
+                return
+
+    return _stream_response(generate, 'text/event-stream')
+
+@app.route('/jobs/<job_id>/partial', methods=['GET'])
+def job_partial(job_id):
+    """Segmentos ya transcritos (con tiempos) mientras la tarea sigue en proceso"""
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    try:
+        since = max(0, int(request.args.get('since', 0)))
+    except ValueError:
+        return jsonify({'error': 'Parámetro since inválido'}), 400
+    segments = job_store.get_segments(job_id, since)
+    return jsonify({
+        'id': job_id,
+        'status': job['status'],
+        'progress': job.get('progress', 0),
+        'segments': segments,
+        'text': ' '.join((s['text'] or '').strip() for s in segments),
+        'next': since + len(segments)
+    })
+
+@app.route('/jobs/<job_id>/partial.txt', methods=['GET'])
+def job_partial_txt(job_id):
+    """Descarga TXT que crece a medida que terminan los chunks (respuesta en streaming)"""
+    if not job_store.get(job_id):
+        return jsonify({'error': 'Job no encontrado'}), 404
+    if not _job_streams.acquire(blocking=False):
+        return _streams_busy()
+
+    def generate():
+        since = 0
+        version = -1
+        while True:
+            job = job_store.wait_for_update(job_id, version, SSE_KEEPALIVE_SECONDS)
+            if job is None:
+                return
+            version = job.get('version', 0)
+            segments = job_store.get_segments(job_id, since)
+            for s in segments:
+                yield f"[{_format_timestamp(s['start'] or 0.0)}] {(s['text'] or '').strip()}\n"
+            since += len(segments)
+            if job['status'] in (JobStatus.DONE, JobStatus.ERROR):
+                return
+
+    return _stream_response(generate, 'text/plain')
 
 @app.route('/jobs/<job_id>/download', methods=['GET'])
 def job_download(job_id):
-    with jobs_lock:
-        job = jobs.get(job_id)
+    requested_format = request.args.get('format')
+    if requested_format:
+        return job_export(job_id, requested_format)
+    job = job_store.get(job_id)
     if not job:
         return jsonify({'error': 'Job no encontrado'}), 404
     if job['status'] != JobStatus.DONE:
@@ -797,14 +4521,292 @@ def job_download(job_id):
         download_name=job.get('download_name', os.path.basename(output_path))
     )
 
+@app.route('/jobs/<job_id>/export/<fmt>', methods=['GET'])
+def job_export(job_id, fmt):
+    """Descargar el resultado en cualquier formato, renderizado la primera vez que se pide"""
+    fmt = fmt.lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Formato debe ser uno de: {", ".join(EXPORT_FORMATS)}'}), 400
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    if job['status'] != JobStatus.DONE:
+        return jsonify({'error': 'Job no está listo'}), 400
+    try:
+        timestamps = request.args.get('timestamps', '0').lower() in ('1', 'true', 'on')
+        output_path = export_job_output(job_id, fmt, timestamps=timestamps)
+    except FileNotFoundError:
+        return jsonify({'error': 'Transcripción intermedia no disponible'}), 410
+    except Exception as e:
+        logger.error(f"Error exportando job {job_id} a {fmt}: {e}")
+        return jsonify({'error': f'Error generando {fmt}: {str(e)}'}), 500
+    return send_file(
+        output_path,
+        as_attachment=True,
+        download_name=f"{job['timestamp']}_transcription.{fmt}",
+        mimetype=EXPORT_MIMETYPES[fmt]
+    )
+
+#############################################
+# LOTES: VARIOS ARCHIVOS EN UNA PETICIÓN    #
+#############################################
+# POST /batches recibe varios archivos en `audio` (o zips en `archive`) y crea una
+# tarea hija por archivo en la cola de siempre, con las mismas opciones y cliente: el
+# modelo residente, la caché por contenido y la inferencia por lotes se comparten entre
+# ellas. GET /batches/<id> agrega el progreso y /batches/<id>/download entrega todas
+# las salidas en un zip generado en streaming.
+
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "100"))
+# Formatos ya comprimidos: dentro del zip se guardan tal cual
+_STORED_FORMATS = ('pdf', 'docx')
+
+def _archive_members(archive):
+    """(info, nombre seguro) de los archivos de un zip, sin directorios, ocultos ni metadatos de macOS"""
+    for info in archive.infolist():
+        base = os.path.basename(info.filename)
+        if info.is_dir() or not base or base.startswith('.') or info.filename.startswith('__MACOSX/'):
+            continue
+        yield info, secure_filename(base)
+
+def receive_batch_files(timestamp):
+    """Guardar en UPLOAD_FOLDER los archivos de un lote y sondear cada uno.
+
+    Devuelve (aceptados, rechazados): aceptados son tuplas (input_path, filename,
+    size, sha256, media); rechazados, dicts con filename y error. Los archivos sin
+    audio no invalidan el lote; exceder BATCH_MAX_FILES o el tamaño máximo sí.
+    """
+    uploads = [f for f in request.files.getlist('audio') if f.filename]
+    archives = [f for f in request.files.getlist('archive') if f.filename]
+    if not uploads and not archives:
+        raise UploadError('No se encontraron archivos (campos `audio` o `archive`)')
+    accepted, rejected = [], []
+
+    def _accept(filename, save):
+        if len(accepted) + len(rejected) >= BATCH_MAX_FILES:
+            raise UploadError(f'Demasiados archivos en el lote (máximo {BATCH_MAX_FILES})', 413)
+        if not allowed_file(filename):
+            rejected.append({'filename': filename, 'error': 'Formato de archivo no soportado'})
+            return
+        input_path = unique_input_path(timestamp, filename)
+        size, audio_hash = save(input_path)
+        try:
+            media = accept_media(input_path, size, audio_hash)
+        except UploadError as e:
+            rejected.append({'filename': filename, 'error': str(e)})
+            return
+        accepted.append((input_path, filename, size, audio_hash, media))
+
+    try:
+        for file in uploads:
+            _accept(secure_filename(file.filename), lambda path: save_upload(file, path))
+        for file in archives:
+            zip_path = unique_input_path(timestamp, 'lote.zip')
+            save_upload(file, zip_path)
+            try:
+                with zipfile.ZipFile(zip_path) as archive:
+                    # Límite sobre el tamaño declarado: un zip bomba no llega a descomprimirse
+                    budget = app.config['MAX_CONTENT_LENGTH']
+                    for info, filename in _archive_members(archive):
+                        budget -= info.file_size
+                        if budget < 0:
+                            raise UploadError('El zip descomprimido supera el tamaño máximo permitido', 413)
+                        with archive.open(info) as member:
+                            _accept(filename, lambda path: copy_hashed(member, path))
+            except zipfile.BadZipFile:
+                raise UploadError(f'Zip inválido: {secure_filename(file.filename)}')
+            finally:
+                os.remove(zip_path)
+    except BaseException:
+        for input_path, *_ in accepted:
+            if os.path.exists(input_path):
+                os.remove(input_path)
+        raise
+    return accepted, rejected
+
+def batch_summary(batch):
+    """Estado agregado de un lote a partir de sus tareas hijas"""
+    jobs = job_store.batch_jobs(batch['id'])
+    counts = collections.Counter(job['status'] for job in jobs)
+    finished = counts[JobStatus.DONE] + counts[JobStatus.ERROR]
+    if jobs and finished == len(jobs):
+        status = JobStatus.DONE
+    elif finished or counts[JobStatus.PROCESSING]:
+        status = JobStatus.PROCESSING
+    else:
+        status = 'queued'
+    # Progreso ponderado por la duración sondeada: un archivo de 1 h pesa más que uno de 1 min
+    weights = [job.get('audio_duration_estimate') or 1.0 for job in jobs]
+    done_pct = [100 if job['status'] in (JobStatus.DONE, JobStatus.ERROR) else job.get('progress', 0) for job in jobs]
+    progress = sum(w * p for w, p in zip(weights, done_pct)) / sum(weights) if jobs else 0
+    return {
+        'batch_id': batch['id'],
+        'status': status,
+        'progress': round(progress, 1),
+        'total': len(jobs),
+        'counts': dict(counts),
+        'audio_seconds': round(sum(job.get('audio_duration_estimate') or 0 for job in jobs), 1),
+        'created_at': batch['created_at'],
+        'jobs': [
+            {
+                'job_id': job['id'],
+                'filename': job.get('original_filename'),
+                'status': job['status'],
+                'progress': job.get('progress', 0),
+                'error': job.get('error')
+            }
+            for job in jobs
+        ],
+        'rejected': batch.get('rejected', [])
+    }
+
+class _ZipStream:
+    """Destino de escritura sin seek para zipfile: acumula lo escrito para emitirlo por trozos"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_batch_zip(summary):
+    """Generador del zip de un lote: las salidas terminadas más un manifest.json"""
+    sink = _ZipStream()
+    used_names = set()
+    manifest = []
+    with zipfile.ZipFile(sink, 'w') as zf:
+        for entry in summary['jobs']:
+            entry = dict(entry)
+            manifest.append(entry)
+            if entry['status'] != JobStatus.DONE:
+                continue
+            job = job_store.get(entry['job_id'])
+            try:
+                path = export_job_output(job['id'], job['format'], timestamps=job.get('timestamps', False))
+            except FileNotFoundError:
+                entry['error'] = 'Transcripción intermedia no disponible'
+                continue
+            stem = os.path.splitext(entry['filename'] or job['id'])[0]
+            arcname, n = f"{stem}.{job['format']}", 1
+            while arcname in used_names:
+                n += 1
+                arcname = f"{stem}_{n}.{job['format']}"
+            used_names.add(arcname)
+            entry['file'] = arcname
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.path.getmtime(path))[:6])
+            info.compress_type = zipfile.ZIP_STORED if job['format'] in _STORED_FORMATS else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, zf.open(info, 'w') as dst:
+                while True:
+                    block = src.read(UPLOAD_BLOCK_SIZE)
+                    if not block:
+                        break
+                    dst.write(block)
+                    data = sink.pop()
+                    if data:
+                        yield data
+        zf.writestr('manifest.json', json.dumps(
+            {'batch_id': summary['batch_id'], 'files': manifest, 'rejected': summary['rejected']},
+            ensure_ascii=False, indent=2
+        ))
+    yield sink.pop()
+
+@app.route('/batches', methods=['POST'])
+def create_batch():
+    """Crear un lote: una tarea en cola por archivo subido o contenido en un zip"""
+    if not ENABLE_ASYNC:
+        return jsonify({'error': 'Modo asíncrono deshabilitado'}), 400
+    request_started = time.perf_counter()
+    try:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        try:
+            options = job_options()
+            accepted, rejected = receive_batch_files(timestamp)
+        except UploadError as e:
+            return e.response()
+        if not accepted:
+            return jsonify({'error': 'Ningún archivo del lote contiene audio válido', 'rejected': rejected}), 415
+        batch_id = str(uuid.uuid4())
+        job_store.create_batch({
+            'id': batch_id,
+            'timestamp': timestamp,
+            'format': options['format'],
+            'client': options['client'],
+            'rejected': rejected,
+            'created_at': datetime.datetime.utcnow().isoformat()
+        })
+        # Recepción de todo el lote (cuerpo + hashes + sondeos)
+        timings = {'upload': round(time.perf_counter() - request_started, 4)}
+        jobs = [
+            {'job_id': enqueue_job(options, input_path, filename, timestamp, size, audio_hash, media,
+                                   timings=timings, batch_id=batch_id),
+             'filename': filename}
+            for input_path, filename, size, audio_hash, media in accepted
+        ]
+        logger.info(f"Lote {batch_id} creado: {len(jobs)} tareas, {len(rejected)} archivos rechazados")
+        return jsonify({'batch_id': batch_id, 'status': 'queued', 'jobs': jobs, 'rejected': rejected})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creando lote: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    batch = job_store.get_batch(batch_id)
+    if not batch:
+        return jsonify({'error': 'Lote no encontrado'}), 404
+    return jsonify(batch_summary(batch))
+
+@app.route('/batches/<batch_id>/download', methods=['GET'])
+def batch_download(batch_id):
+    """Todas las salidas del lote en un zip (con ?partial=1, aunque queden tareas en curso)"""
+    batch = job_store.get_batch(batch_id)
+    if not batch:
+        return jsonify({'error': 'Lote no encontrado'}), 404
+    summary = batch_summary(batch)
+    if summary['status'] != JobStatus.DONE and request.args.get('partial', '0') != '1':
+        return jsonify({'error': 'Lote no está listo', 'progress': summary['progress']}), 400
+    return Response(
+        stream_with_context(stream_batch_zip(summary)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{batch["timestamp"]}_lote.zip"'}
+    )
+
 @app.errorhandler(413)
 def too_large(e):
     return jsonify({'error': 'Archivo demasiado grande. Máximo permitido: 1GB'}), 413
 
+@app.errorhandler(415)
+def unsupported_media(e):
+    return jsonify({'error': getattr(e, 'description', None) or 'Formato de archivo no soportado',
+                    'supported_formats': list(ALLOWED_EXTENSIONS)}), 415
+
 @app.errorhandler(500)
 def internal_error(e):
     return jsonify({'error': 'Error interno del servidor'}), 500
 
+# Fin de la importación: a partir de aquí gunicorn ya puede aceptar peticiones
+startup_state['import_seconds'] = round(time.perf_counter() - _IMPORT_STARTED, 3)
+startup_state['process_seconds'] = _process_age()
+startup_state['started_at'] = datetime.datetime.now().isoformat()
+logger.info(
+    f"Módulo importado en {startup_state['import_seconds']}s "
+    f"(proceso {startup_state['process_seconds']}s, FAST_START={int(FAST_START)})"
+)
+
 if __name__ == '__main__':
     print("Iniciando API de Transcripción de Audio en Español...")
     print("Idioma configurado: Español")
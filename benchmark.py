@@ -0,0 +1,469 @@
+"""
+Benchmark del pipeline de transcripción de extremo a extremo.
+
+Funciona sin conexión: genera audio sintético (tonos con modulación tipo sílaba y pausas)
+y, por defecto, usa un modelo Whisper "stub" con pesos aleatorios, de modo que mide el
+coste del pipeline (decodificación, inferencia, renderizado, cola) y no la precisión.
+Con --model tiny/base/... se usa el modelo real (debe estar descargado).
+
+Mide por etapa:
+  - decode: FFmpeg -> PCM 16 kHz (decode_audio)
+  - transcribe: transcribe_audio (RTF, pico de RSS)
+  - render: create_pdf_with_reportlab, create_docx y el resto de formatos de exportación
+  - async: N tareas simultáneas por /transcribe_async (espera en cola, proceso, throughput)
+  - batch: N archivos cortos en un POST /batches frente a N POST /transcribe_async
+
+Los resultados se escriben en JSON para compararlos entre versiones:
+    python benchmark.py --output resultados_v2.json
+    python benchmark.py --output resultados_v3.json --compare resultados_v2.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_RATE = 16000
+
+
+def synthetic_speech(seconds, seed=0):
+    """Audio parecido a voz: armónicos con envolvente a ~4 Hz y pausas de 0.5-2 s"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    f0 = 120 + 40 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    # Pausas aleatorias entre "frases"
+    pauses = np.ones_like(t)
+    position = 0.0
+    while position < seconds:
+        position += rng.uniform(3, 8)
+        gap = rng.uniform(0.5, 2.0)
+        pauses[int(position * SAMPLE_RATE):int((position + gap) * SAMPLE_RATE)] = 0
+        position += gap
+    audio = 0.3 * voice * envelope * pauses + 0.003 * rng.standard_normal(len(t))
+    return np.clip(audio, -1, 1).astype(np.float32)
+
+
+def write_wav(path, audio):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((audio * 32767).astype('<i2').tobytes())
+
+
+def install_stub_model():
+    """Reemplazar whisper.load_model por un modelo diminuto con pesos aleatorios (sin descargas)"""
+    import torch
+    import whisper
+    from whisper.model import ModelDimensions, Whisper
+
+    def load_stub(name, device=None, **kwargs):
+        torch.manual_seed(0)
+        dims = ModelDimensions(
+            n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+            n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1
+        )
+        return Whisper(dims).to(device or 'cpu').eval()
+
+    whisper.load_model = load_stub
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        'min': round(ordered[0], 4),
+        'p50': round(statistics.median(ordered), 4),
+        'p95': round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 4),
+        'max': round(ordered[-1], 4),
+        'mean': round(statistics.mean(ordered), 4)
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def bench_decode(app, files, repeats):
+    results = {}
+    for name, path, seconds in files:
+        timings = [timed(app.decode_audio, path)[0] for _ in range(repeats)]
+        results[name] = {'audio_seconds': seconds, 'seconds': summarize(timings),
+                         'rtf': round(statistics.median(timings) / seconds, 5)}
+    return results
+
+
+def bench_transcribe(app, files, repeats, language):
+    results = {}
+    last_transcript = None
+    for name, path, seconds in files:
+        timings, peaks = [], []
+        for _ in range(repeats):
+            stats = {}
+            elapsed, (text, segments) = timed(app.transcribe_audio, path, language, stats=stats)
+            timings.append(elapsed)
+            peaks.append(stats.get('peak_rss_mb'))
+            last_transcript = (text, segments)
+        results[name] = {
+            'audio_seconds': seconds,
+            'seconds': summarize(timings),
+            'rtf': round(statistics.median(timings) / seconds, 5),
+            'peak_rss_mb': max(p for p in peaks if p is not None) if any(peaks) else None,
+            'chunks': stats.get('chunks')
+        }
+    return results, last_transcript
+
+
+def synthetic_transcript(paragraphs):
+    """Transcripción larga de relleno para medir el renderizado independientemente del modelo"""
+    sentence = "Esta es una frase de prueba para medir el tiempo de generación de documentos. "
+    segments = []
+    for i in range(paragraphs * 5):
+        segments.append({'id': i, 'start': i * 4.0, 'end': i * 4.0 + 3.5, 'text': ' ' + sentence.strip(), 'chunk': i // 5})
+    text = '\n'.join(sentence * 5 for _ in range(paragraphs))
+    return {'text': text, 'segments': segments, 'metadata': {'filename': 'benchmark.wav', 'timestamp': 'benchmark'}}
+
+
+def bench_render(app, transcript, repeats, workdir):
+    results = {}
+    for fmt in app.EXPORT_FORMATS:
+        output_path = os.path.join(workdir, f"bench.{fmt}")
+        timings = []
+        for _ in range(repeats):
+            if fmt == 'pdf':
+                elapsed, _ = timed(app.create_pdf_with_reportlab, transcript['text'], output_path, transcript['metadata'])
+            elif fmt == 'docx':
+                elapsed, _ = timed(app.create_docx, transcript['text'], output_path, transcript['metadata'])
+            else:
+                elapsed, _ = timed(app.render_transcript, transcript, fmt, output_path)
+            timings.append(elapsed)
+        results[fmt] = {'seconds': summarize(timings), 'bytes': os.path.getsize(output_path)}
+    return results
+
+
+def _parse_iso(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def wait_jobs(app, job_ids, timeout):
+    """Esperar a que las tareas terminen; devuelve (registros terminados, ids sin terminar)"""
+    pending = set(j for j in job_ids if j)
+    records = {}
+    deadline = time.time() + timeout
+    while pending and time.time() < deadline:
+        for job_id in list(pending):
+            job = app.job_store.get(job_id)
+            if job and job['status'] in (app.JobStatus.DONE, app.JobStatus.ERROR):
+                records[job_id] = job
+                pending.discard(job_id)
+        time.sleep(0.05)
+    return records, pending
+
+
+def bench_batch(app, path, files, output_format, language, timeout):
+    """Mismos `files` archivos por un POST /batches frente a N POST /transcribe_async.
+
+    El audio de cada archivo lleva un byte distinto (sin aciertos de caché) y cada
+    variante usa bytes propios, así que ninguna reutiliza el trabajo de la otra.
+    """
+    client = app.app.test_client()
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    def payload(variant, i):
+        return io.BytesIO(data + bytes([variant, i % 256]))
+
+    def run(variant, count):
+        started = time.perf_counter()
+        if variant != 1:
+            job_ids = []
+            for i in range(count):
+                response = client.post('/transcribe_async', data={
+                    'audio': (payload(variant, i), f"bench_{i}.wav"), 'format': output_format, 'lang': language
+                })
+                job_ids.append((response.get_json() or {}).get('job_id'))
+        else:
+            response = client.post('/batches', data={
+                'audio': [(payload(variant, i), f"bench_{i}.wav") for i in range(count)],
+                'format': output_format, 'lang': language
+            })
+            job_ids = [job.get('job_id') for job in (response.get_json() or {}).get('jobs', [])]
+        records, pending = wait_jobs(app, job_ids, timeout)
+        total_seconds = time.perf_counter() - started
+        done = sum(1 for j in records.values() if j['status'] == app.JobStatus.DONE)
+        return {
+            'completed': done,
+            'failed': len(records) - done,
+            'timed_out': len(pending),
+            'total_seconds': round(total_seconds, 3),
+            'throughput_jobs_per_min': round(done / total_seconds * 60, 2) if total_seconds else None
+        }
+
+    # Calentamiento: la primera tanda de la cola paga arranques que no son de ninguna variante
+    run(2, 2)
+    batches_before = app._batch_engine.batches if app._batch_engine else 0
+    independent = run(0, files)
+    batches_mid = app._batch_engine.batches if app._batch_engine else 0
+    batch = run(1, files)
+    batches_after = app._batch_engine.batches if app._batch_engine else 0
+    independent['encoder_batches'] = batches_mid - batches_before
+    batch['encoder_batches'] = batches_after - batches_mid
+    return {
+        'files': files,
+        'workers': app.ASYNC_WORKERS,
+        'group_size': app.batch_group_size(),
+        'independent': independent,
+        'batch': batch,
+        'speedup': round(independent['total_seconds'] / batch['total_seconds'], 2) if batch['total_seconds'] else None
+    }
+
+
+def bench_async(app, path, jobs, output_format, language, timeout):
+    """Enviar `jobs` tareas a la vez por /transcribe_async y esperar a que terminen"""
+    client = app.app.test_client()
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    job_ids = []
+    lock = threading.Lock()
+
+    def submit(i):
+        # Un byte distinto al final evita aciertos de caché entre tareas
+        payload = data + bytes([i % 256])
+        response = client.post('/transcribe_async', data={
+            'audio': (io.BytesIO(payload), f"bench_{i}.wav"),
+            'format': output_format,
+            'lang': language
+        })
+        body = response.get_json() or {}
+        with lock:
+            job_ids.append(body.get('job_id'))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    submit_seconds = time.perf_counter() - started
+
+    records, pending = wait_jobs(app, job_ids, timeout)
+    total_seconds = time.perf_counter() - started
+
+    waits, processing, end_to_end = [], [], []
+    for job in records.values():
+        created, began = _parse_iso(job.get('created_at')), _parse_iso(job.get('started_at'))
+        if created and began:
+            waits.append((began - created).total_seconds())
+            if job.get('processing_seconds') is not None:
+                processing.append(job['processing_seconds'])
+                end_to_end.append((began - created).total_seconds() + job['processing_seconds'])
+    done = sum(1 for j in records.values() if j['status'] == app.JobStatus.DONE)
+    return {
+        'jobs': jobs,
+        'workers': app.ASYNC_WORKERS,
+        'completed': done,
+        'failed': len(records) - done,
+        'timed_out': len(pending),
+        'submit_seconds': round(submit_seconds, 3),
+        'total_seconds': round(total_seconds, 3),
+        'throughput_jobs_per_min': round(done / total_seconds * 60, 2) if total_seconds else None,
+        'queue_wait_seconds': summarize(waits),
+        'processing_seconds': summarize(processing),
+        'end_to_end_seconds': summarize(end_to_end)
+    }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round((peak if sys.platform == 'darwin' else peak * 1024) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare(current, previous_path):
+    """Imprimir las métricas de tiempo/RTF/memoria que cambiaron respecto a otro resultado"""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    now = _flatten('', current['results'], {})
+    before = _flatten('', previous['results'], {})
+    print(f"\nComparación con {previous_path} ({previous.get('revision')} -> {current.get('revision')}):")
+    keys = [k for k in now if k in before and k.rsplit('.', 1)[-1] in ('p50', 'rtf', 'peak_rss_mb', 'throughput_jobs_per_min')]
+    for key in sorted(keys):
+        if before[key]:
+            change = (now[key] - before[key]) / before[key] * 100
+            print(f"  {key:<55} {before[key]:>10} -> {now[key]:>10}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de transcripción")
+    parser.add_argument('--model', default='stub', help="'stub' (pesos aleatorios, sin descarga) o un modelo Whisper real")
+    parser.add_argument('--durations', default='10,60', help="Duraciones del audio sintético en segundos (separadas por comas)")
+    parser.add_argument('--audio', nargs='*', default=[], help="Archivos de audio propios a incluir")
+    parser.add_argument('--repeats', type=int, default=3, help="Repeticiones por medición (se reportan percentiles)")
+    parser.add_argument('--jobs', type=int, default=8, help="Tareas simultáneas en la prueba de la cola (0 la omite)")
+    parser.add_argument('--workers', type=int, default=2, help="ASYNC_WORKERS para la prueba de la cola")
+    parser.add_argument('--batch-files', type=int, default=8, help="Archivos de la prueba /batches frente a N /transcribe_async (0 la omite)")
+    parser.add_argument('--batch-size', type=int, help="BATCH_MAX_SIZE durante el benchmark (p. ej. 8; sin indicar, el del entorno)")
+    parser.add_argument('--chunk-seconds', type=int, default=0, help="CHUNK_SECONDS durante el benchmark")
+    parser.add_argument('--paragraphs', type=int, default=200, help="Párrafos del documento sintético para renderizar")
+    parser.add_argument('--format', default='pdf', help="Formato de salida de las tareas asíncronas")
+    parser.add_argument('--lang', default='spanish')
+    parser.add_argument('--timeout', type=float, default=600, help="Tiempo máximo de espera de la prueba de la cola")
+    parser.add_argument('--output', default='benchmark_results.json', help="Archivo JSON de resultados")
+    parser.add_argument('--compare', help="Resultado anterior (JSON) con el que comparar")
+    args = parser.parse_args()
+    if args.repeats < 1:
+        parser.error("--repeats debe ser al menos 1")
+    try:
+        durations = [float(d) for d in args.durations.split(',') if d.strip()]
+    except ValueError:
+        parser.error("--durations debe ser una lista de números separados por comas")
+    if any(d <= 0 for d in durations):
+        parser.error("--durations solo admite duraciones positivas")
+    if not durations and not args.audio:
+        parser.error("No hay audios que medir: indica --durations o --audio")
+
+    output_path = os.path.abspath(args.output)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    user_audio = [os.path.abspath(p) for p in args.audio]
+
+    # Directorio de trabajo aislado: uploads/, outputs/, caché y base de tareas temporales
+    workdir = tempfile.mkdtemp(prefix='transcribe_bench_')
+    os.chdir(workdir)
+    os.environ.update({
+        'JOB_DB_PATH': os.path.join(workdir, 'jobs.db'),
+        'CACHE_FOLDER': os.path.join(workdir, 'cache'),
+        'TRANSCRIPT_CACHE_MB': '0',
+        'WARMUP': '0',
+        'ENABLE_ASYNC': '1',
+        'ASYNC_WORKERS': str(args.workers),
+        'CHUNK_SECONDS': str(args.chunk_seconds),
+    })
+    if args.batch_size is not None:
+        os.environ['BATCH_MAX_SIZE'] = str(args.batch_size)
+    if args.model != 'stub':
+        os.environ['WHISPER_MODEL'] = args.model
+    else:
+        # El stub solo existe en este proceso: sin pool de procesos
+        os.environ['TRANSCRIBE_PROCESSES'] = '0'
+        install_stub_model()
+
+    sys.path.insert(0, REPO_DIR)
+    started = time.perf_counter()
+    import app
+    import_seconds = time.perf_counter() - started
+
+    try:
+        files = []
+        for seconds in durations:
+            path = os.path.join(workdir, f"synthetic_{int(seconds)}s.wav")
+            write_wav(path, synthetic_speech(seconds))
+            files.append((f"synthetic_{int(seconds)}s", path, seconds))
+        for path in user_audio:
+            # Sin duración no hay RTF: los archivos que FFmpeg no sabe sondear se omiten
+            duration = app.probe_duration(path)
+            if not duration:
+                print(f"Aviso: no se pudo obtener la duración de {path}, se omite")
+                continue
+            files.append((os.path.basename(path), path, duration))
+        if not files:
+            print("Ninguno de los audios indicados se puede medir")
+            return 1
+
+        print(f"Benchmark en {workdir} (modelo {args.model}, {len(files)} audios, {args.repeats} repeticiones)")
+        load_seconds, _ = timed(app.load_whisper_model)
+        results = {'startup': {'import_seconds': round(import_seconds, 3), 'model_load_seconds': round(load_seconds, 3)}}
+
+        print("- decodificación")
+        results['decode'] = bench_decode(app, files, args.repeats)
+        print("- transcripción")
+        results['transcribe'], (text, segments) = bench_transcribe(app, files, args.repeats, args.lang)
+        print("- renderizado")
+        results['render'] = {
+            'synthetic': bench_render(app, synthetic_transcript(args.paragraphs), args.repeats, workdir),
+            'transcript': bench_render(
+                app, {'text': text, 'segments': segments, 'metadata': {'filename': files[-1][0]}},
+                args.repeats, workdir
+            )
+        }
+        if args.jobs > 0:
+            print(f"- cola asíncrona ({args.jobs} tareas, {args.workers} workers)")
+            results['async'] = bench_async(app, files[0][1], args.jobs, args.format, args.lang, args.timeout)
+        if args.batch_files > 0:
+            # Archivos cortos: una sola ventana de 30 s, el caso típico de una ingesta por lotes
+            short = min(files, key=lambda f: f[2])
+            print(f"- lote frente a tareas sueltas ({args.batch_files} archivos de {short[2]:.0f}s)")
+            results['batch'] = bench_batch(app, short[1], args.batch_files, args.format, args.lang, args.timeout)
+        results['peak_rss_mb'] = peak_rss_mb()
+
+        report = {
+            'revision': git_revision(),
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': {
+                'model': args.model,
+                'backend': app.whisper_backend(),
+                'chunk_seconds': args.chunk_seconds,
+                'repeats': args.repeats,
+                'paragraphs': args.paragraphs,
+                'workers': args.workers,
+                'batch_size': app.BATCH_MAX_SIZE,
+            },
+            'results': results
+        }
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        print(f"\nResultados guardados en {output_path}")
+        if compare_path:
+            compare(report, compare_path)
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
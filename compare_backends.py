@@ -0,0 +1,160 @@
+"""
+Comparación de precisión y velocidad entre backends de inferencia de Whisper.
+
+Transcribe los mismos archivos con cada backend (torch, int8, compile, ctranslate2)
+y mide tiempo de carga, RTF (segundos de cómputo por segundo de audio), memoria del
+modelo y WER frente a una referencia (archivo de texto) o, si no hay, frente al
+primer backend de la lista.
+
+Uso:
+    python compare_backends.py audio1.mp3 audio2.wav --model base --backends torch,int8,compile
+    python compare_backends.py charla.mp3 --reference charla.txt --json resultados.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# Sin cola ni precalentamiento: solo se usan las funciones de carga y decodificación
+os.environ.setdefault("ENABLE_ASYNC", "0")
+os.environ.setdefault("WARMUP", "0")
+
+import app
+
+
+def word_error_rate(reference, hypothesis):
+    """WER por distancia de edición entre listas de palabras normalizadas"""
+    ref = app._normalize_words(reference)
+    hyp = app._normalize_words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def run_backend(backend, model_name, audios, language, runs):
+    """Cargar el modelo con `backend` y transcribir cada audio `runs` veces"""
+    started = time.time()
+    model = app.load_whisper_model(model_name, backend=backend)
+    load_seconds = time.time() - started
+
+    started = time.time()
+    app._synthetic_inference(model)
+    warmup_seconds = time.time() - started
+
+    options = {"fp16": False, "task": "transcribe", "verbose": False, "temperature": 0.0}
+    if language != 'auto':
+        options["language"] = language
+
+    files = []
+    for path, audio in audios:
+        timings = []
+        text = ''
+        for _ in range(runs):
+            started = time.time()
+            result = model.transcribe(audio, **options)
+            timings.append(time.time() - started)
+            text = result.get('text', '').strip()
+        duration = len(audio) / app.SAMPLE_RATE
+        seconds = statistics.median(timings)
+        files.append({
+            'file': path,
+            'audio_seconds': round(duration, 2),
+            'seconds': round(seconds, 3),
+            'rtf': round(seconds / duration, 4) if duration else None,
+            'text': text
+        })
+
+    return {
+        'backend': backend,
+        'load_seconds': round(load_seconds, 2),
+        'warmup_seconds': round(warmup_seconds, 2),
+        'model_memory_mb': round(app._model_footprint(model) / (1024 * 1024), 1),
+        'files': files
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparar backends de Whisper (precisión y velocidad)")
+    parser.add_argument('audio', nargs='+', help="Archivos de audio a transcribir")
+    parser.add_argument('--model', default=app.MODEL, help="Modelo Whisper (por defecto WHISPER_MODEL)")
+    parser.add_argument('--backends', default='torch,int8,compile',
+                        help="Lista separada por comas de: " + ', '.join(app.WHISPER_BACKENDS))
+    parser.add_argument('--lang', default='spanish', help="Idioma forzado o 'auto'")
+    parser.add_argument('--runs', type=int, default=1, help="Repeticiones por archivo (se usa la mediana)")
+    parser.add_argument('--reference', nargs='*', default=None,
+                        help="Transcripciones de referencia (.txt), una por audio y en el mismo orden")
+    parser.add_argument('--json', help="Guardar resultados completos en este archivo")
+    args = parser.parse_args()
+
+    backends = [b.strip().lower() for b in args.backends.split(',') if b.strip()]
+    unknown = [b for b in backends if b not in app.WHISPER_BACKENDS]
+    if unknown:
+        parser.error(f"Backends desconocidos: {', '.join(unknown)}")
+    if args.reference and len(args.reference) != len(args.audio):
+        parser.error("--reference necesita un archivo por cada audio")
+
+    references = None
+    if args.reference:
+        references = []
+        for path in args.reference:
+            with open(path, 'r', encoding='utf-8') as f:
+                references.append(f.read())
+
+    print(f"Decodificando {len(args.audio)} archivo(s)...")
+    audios = [(path, app.decode_audio(path)) for path in args.audio]
+
+    results = []
+    for backend in backends:
+        print(f"\n== Backend {backend} ==")
+        try:
+            result = run_backend(backend, args.model, audios, args.lang.lower(), args.runs)
+        except Exception as e:
+            print(f"  Error: {e}")
+            results.append({'backend': backend, 'error': str(e)})
+            continue
+        print(f"  Carga {result['load_seconds']}s, warm-up {result['warmup_seconds']}s, "
+              f"modelo {result['model_memory_mb']} MB")
+        results.append(result)
+
+    # WER frente a la referencia o frente al primer backend que funcionó
+    baseline = next((r for r in results if 'error' not in r), None)
+    for result in results:
+        if 'error' in result:
+            continue
+        for i, f in enumerate(result['files']):
+            reference = references[i] if references else baseline['files'][i]['text']
+            f['wer'] = round(word_error_rate(reference, f['text']), 4)
+        total_audio = sum(f['audio_seconds'] for f in result['files'])
+        total_seconds = sum(f['seconds'] for f in result['files'])
+        result['rtf'] = round(total_seconds / total_audio, 4) if total_audio else None
+        result['wer'] = round(statistics.mean(f['wer'] for f in result['files']), 4)
+
+    versus = 'referencia' if references else f"backend {baseline['backend']}" if baseline else '-'
+    print(f"\n{'backend':<12} {'carga s':>8} {'RTF':>8} {'vs torch':>9} {'MB':>8} {'WER':>7}  (WER vs {versus})")
+    base_rtf = next((r['rtf'] for r in results if r.get('backend') == 'torch' and 'rtf' in r), None)
+    for result in results:
+        if 'error' in result:
+            print(f"{result['backend']:<12} error: {result['error'][:60]}")
+            continue
+        speedup = f"{base_rtf / result['rtf']:.2f}x" if base_rtf and result['rtf'] else '-'
+        print(f"{result['backend']:<12} {result['load_seconds']:>8} {result['rtf']:>8} {speedup:>9} "
+              f"{result['model_memory_mb']:>8} {result['wer']:>7}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'model': args.model, 'language': args.lang, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados guardados en {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())